@@ -9,6 +9,22 @@ async def hello (request):
     return r
 
 
+async def headers(request):
+    return web.Response(text=str(dict(request.headers)))
+
+
+async def large(request):
+    return web.Response(text=Config.large_body)
+
+
+async def static_file(request):
+    return web.FileResponse("./static/testFile.htm")
+
+
 app = web.Application()
 app.router.add_get('/', hello)
+app.router.add_get('/hello', hello)
+app.router.add_get('/headers', headers)
+app.router.add_get('/large', large)
+app.router.add_get('/static/file', static_file)
 web.run_app(app, host=Config.host, port=Config.port)
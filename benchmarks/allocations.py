@@ -0,0 +1,93 @@
+# coding=utf-8
+"""
+Memory allocated per request, traced with tracemalloc.
+
+    python -m benchmarks.allocations [--requests 2000] [--pool-sizes 0,256] [--json]
+
+The requests go through AsyncHTTPServer.handle_one_request in this process, over socketpairs whose
+client side has sent its request and shut its write side down up front: the handler never waits
+for the network, no listening socket or client code is traced. For each pool size (0: every
+StreamSock and request handler is allocated, see qsonac.pool) and each request:
+
+    blocks, bytes   allocated since the request started and still alive when the application is called:
+                    the stream, the handler, their buffers, dicts and closures
+    peak            the highest memory traced during the whole request
+
+The medians are reported, with the objects the pools reused and the ones they allocated.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import tracemalloc
+
+REQUEST = b"GET /hello HTTP/1.1\r\nHost: 127.0.0.1\r\nUser-Agent: bench\r\nAccept: */*\r\n\r\n"
+
+
+def measure(pool_size, requests, warmup = 200):
+    from qsonac import metrics
+    from qsonac.asynchttpserver import AsyncHTTPServer
+    from qsonac.handler import makeWSGIhandler
+
+    at_app = []
+
+    def app(environ, start_response):
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__),
+                                                                  tracemalloc.Filter(False, tracemalloc.__file__)])
+            at_app.append((len(snapshot.traces), sum(trace.size for trace in snapshot.traces)))
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "5")])
+        return [b"hello"]
+
+    loop = asyncio.new_event_loop()
+    server = AsyncHTTPServer(makeWSGIhandler(app), ("127.0.0.1", 0), loop, pool_size=pool_size)
+    pool_acquires = { outcome: counter.value for outcome, counter in metrics.pool_acquires.children.items() }
+    peaks = []
+    try:
+        for i in range(warmup + requests):
+            if i == warmup:
+                pool_acquires = { outcome: counter.value for outcome, counter in metrics.pool_acquires.children.items() }
+                tracemalloc.start()
+            server_side, client = socket.socketpair()
+            server_side.setblocking(False)
+            client.sendall(REQUEST)
+            client.shutdown(socket.SHUT_WR)
+            if tracemalloc.is_tracing():
+                tracemalloc.clear_traces()
+            loop.run_until_complete(AsyncHTTPServer.handle_one_request(server_side, ("127.0.0.1", 0), server, loop))
+            if tracemalloc.is_tracing():
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            client.recv(4096)
+            client.close()
+    finally:
+        tracemalloc.stop()
+        loop.close()
+    return {
+        "pool_size"    : pool_size,
+        "blocks"       : statistics.median(blocks for blocks, _ in at_app),
+        "bytes"        : statistics.median(size for _, size in at_app),
+        "peak_bytes"   : statistics.median(peaks),
+        "pool_reused"  : metrics.pool_acquires["reused"].value - pool_acquires["reused"],
+        "pool_created" : metrics.pool_acquires["created"].value - pool_acquires["created"],
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.allocations", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pool-sizes", default="0,256", help="comma separated pool sizes to compare")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [measure(int(size), args.requests) for size in args.pool_sizes.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print("pool_size=%-5d %6.0f blocks %8.0f bytes at the application, peak %8.0f bytes, %d objects reused, %d allocated" % (
+            result["pool_size"], result["blocks"], result["bytes"], result["peak_bytes"], result["pool_reused"], result["pool_created"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# coding=utf-8
+"""
+Compare qsonac with the bundled reference servers.
+
+    python -m benchmarks.compare [--servers qsonac,aiohttp] [--duration 5] [--python python3.6] [--baseline old.json]
+
+Every server script (example.py, aiohttp-server.py, flask-server.py, sanic-server.py) is started on
+an ephemeral port (QSONAC_PORT, read by Config), the ones whose framework cannot be imported are skipped.
+The same scenarios run against each one with qsonac.loadgen:
+
+    hello      GET /hello, a short constant body
+    headers    GET /headers, the request headers echoed back
+    static     GET /static/file
+    large      GET /large, a 1 MiB body
+    idle       GET /hello while --idle connections are held open doing nothing
+
+For each scenario the throughput, the latency percentiles, the CPU time used by the server process
+and its peak RSS (from /proc) are written to a JSON file. With --baseline, a throughput drop over
+--threshold against a previous results file is reported and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from qsonac.loadgen import LoadGenerator, build_request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (script, module it needs)
+SERVERS = {
+    "qsonac" : ("example.py", None),
+    "aiohttp": ("aiohttp-server.py", "aiohttp"),
+    "flask"  : ("flask-server.py", "flask"),
+    "sanic"  : ("sanic-server.py", "sanic"),
+}
+
+# name: (path, holds idle connections)
+SCENARIOS = {
+    "hello"  : ("/hello", False),
+    "headers": ("/headers", False),
+    "static" : ("/static/file", False),
+    "large"  : ("/large", False),
+    "idle"   : ("/hello", True),
+}
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def available(python, module):
+    if module is None:
+        return True
+    return subprocess.call([python, "-c", "import " + module], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+
+# region <process stats>
+
+def cpu_seconds(pid):
+    """ user + system time of the process, from /proc/<pid>/stat """
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def memory_kb(pid):
+    """ (current RSS, peak RSS) in KiB, from /proc/<pid>/status """
+    rss = peak = 0
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1])
+    return rss, peak
+
+# endregion
+
+
+class ServerProcess:
+    def __init__(self, name, script, python, port, log):
+        self.name = name
+        self.script = script
+        self.python = python
+        self.port = port
+        self.log = log
+        self.process = None
+
+    def __enter__(self):
+        env = dict(os.environ, QSONAC_PORT=str(self.port))
+        self.process = subprocess.Popen([self.python, self.script], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=self.log)
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("%s exited with %d" % (self.name, self.process.returncode))
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("%s is not listening on %d" % (self.name, self.port))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+async def hold_idle(port, count):
+    connections = []
+    for _ in range(count):
+        try:
+            connections.append(await asyncio.open_connection("127.0.0.1", port))
+        except OSError:
+            break
+    return connections
+
+
+def run_scenario(server, scenario, args, loop):
+    path, idle = SCENARIOS[scenario]
+    connections = []
+    if idle:
+        connections = loop.run_until_complete(hold_idle(server.port, args.idle))
+    cpu_before = cpu_seconds(server.pid)
+    generator = LoadGenerator("127.0.0.1", server.port, [build_request("127.0.0.1", server.port, path=path)],
+                              args.connections, args.duration, args.rate, loop=loop)
+    report = loop.run_until_complete(generator.run())
+    cpu = cpu_seconds(server.pid) - cpu_before
+    rss, peak_rss = memory_kb(server.pid)
+    for reader, writer in connections:
+        writer.close()
+    report.update({
+        "server"      : server.name,
+        "scenario"    : scenario,
+        "idle"        : len(connections),
+        "cpu_seconds" : cpu,
+        "cpu_percent" : 100.0 * cpu / report["duration"] if report["duration"] else 0.0,
+        "rss_kb"      : rss,
+        "peak_rss_kb" : peak_rss,
+    })
+    return report
+
+
+def regressions(results, baseline, threshold):
+    previous = { (r["server"], r["scenario"]): r for r in baseline["results"] }
+    found = []
+    for result in results:
+        old = previous.get((result["server"], result["scenario"]))
+        if old and old["rate"] and result["rate"] < old["rate"] * (1 - threshold):
+            found.append("%s/%s: %.1f req/s, was %.1f" % (result["server"], result["scenario"], result["rate"], old["rate"]))
+    return found
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--python", default=sys.executable, help="interpreter running the servers")
+    parser.add_argument("-c", "--connections", type=int, default=20)
+    parser.add_argument("-d", "--duration", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=None, help="open loop rate, closed loop if not set")
+    parser.add_argument("--idle", type=int, default=1000, help="connections held open in the idle scenario")
+    parser.add_argument("--output", default="compare-results.json")
+    parser.add_argument("--baseline", help="previous results file to check the throughput against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="throughput drop reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    log = open(os.path.splitext(args.output)[0] + ".log", "w")
+    try:
+        for name in args.servers.split(","):
+            script, module = SERVERS[name]
+            if not available(args.python, module):
+                print("%s: skipped, %s is not installed" % (name, module))
+                continue
+            with ServerProcess(name, script, args.python, free_port(), log) as server:
+                for scenario in args.scenarios.split(","):
+                    result = run_scenario(server, scenario, args, loop)
+                    results.append(result)
+                    print("%-8s %-8s %9.1f req/s  p50 %7.3fms  p99 %7.3fms  cpu %5.1f%%  rss %6d KiB  errors %d" % (
+                        name, scenario, result["rate"], result["latency"]["p50"] * 1000, result["latency"]["p99"] * 1000,
+                        result["cpu_percent"], result["peak_rss_kb"], sum(result["errors"].values())))
+    finally:
+        loop.close()
+        log.close()
+
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python" : subprocess.check_output([args.python, "-c", "import sys; print(sys.version.split()[0])"]).decode().strip(),
+        "machine": platform.platform(),
+        "options": { "connections": args.connections, "duration": args.duration, "rate": args.rate, "idle": args.idle },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(document, f, indent=2)
+    print("results written to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for line in found:
+            print("REGRESSION " + line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
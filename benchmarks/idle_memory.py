@@ -0,0 +1,140 @@
+# coding=utf-8
+"""
+Memory held by idle keep-alive connections.
+
+    python -m benchmarks.idle_memory [--connections 10000] [--python python3.6] [--target 6000]
+
+A qsonac server is started in a child process (with `--python`) and 10,000 connections are opened
+to it and left idle, they never send a byte. The growth of the server RSS divided by the number
+of connections is the cost of a parked connection in user space: the task, its coroutines,
+the StreamSock and the request handler. Kernel socket buffers are not part of the RSS.
+
+The exit status is 1 when the cost is over --target bytes per connection.
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.compare import free_port, memory_kb
+
+
+def raise_fd_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(wanted, hard)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def serve(port, connections):
+    """ the server side, run in the child process """
+    import asyncio
+    from qsonac.asynchttpserver import AsyncHTTPServer
+    from qsonac.handler import makeWSGIhandler
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Length", "2")])
+        return [b"ok"]
+
+    raise_fd_limit(connections + 256)
+    loop = asyncio.get_event_loop()
+    server = AsyncHTTPServer(makeWSGIhandler(app), ("127.0.0.1", port), loop, backlog=4096, request_queue_size=256,
+                             idle_timeout=3600, metrics_path="/metrics")
+    with server:
+        server.serve_forever()
+
+
+def active_connections(port):
+    with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % port, timeout=30) as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith("qsonac_active_connections "):
+                # minus the connection asking
+                return int(line.split()[1]) - 1
+    return 0
+
+
+def wait_connections(port, count, timeout = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        active = active_connections(port)
+        if active >= count:
+            return active
+        time.sleep(0.2)
+    raise RuntimeError("only %d of %d connections are served" % (active, count))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.idle_memory", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--python", default=sys.executable, help="interpreter running the server")
+    parser.add_argument("--target", type=int, default=None, help="maximal bytes per connection")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.connections)
+        return
+
+    if raise_fd_limit(args.connections + 256) < args.connections + 64:
+        sys.exit("the descriptor limit is too low for %d connections" % args.connections)
+    port = free_port()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([args.python, "-m", "benchmarks.idle_memory", "--serve", str(port), "--connections", str(args.connections)],
+                              cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    clients = []
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("the server did not start")
+                time.sleep(0.1)
+        # a small first wave warms up the code paths and the caches
+        for count in (min(500, args.connections), args.connections):
+            for sock in clients:
+                sock.close()
+            clients = []
+            wait_connections(port, 0)
+            rss_before, _ = memory_kb(server.pid)
+            for _ in range(count):
+                clients.append(socket.create_connection(("127.0.0.1", port)))
+            wait_connections(port, count)
+            rss_after, peak = memory_kb(server.pid)
+    finally:
+        for sock in clients:
+            sock.close()
+        server.terminate()
+        server.wait()
+
+    per_connection = (rss_after - rss_before) * 1024.0 / args.connections
+    report = {
+        "connections"         : args.connections,
+        "rss_before_kb"       : rss_before,
+        "rss_after_kb"        : rss_after,
+        "peak_rss_kb"         : peak,
+        "bytes_per_connection": per_connection,
+        "target"              : args.target,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("%d idle connections: RSS %d KiB -> %d KiB, %.0f bytes per connection" % (
+            args.connections, rss_before, rss_after, per_connection))
+    if args.target is not None and per_connection > args.target:
+        print("over the target of %d bytes per connection" % args.target)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
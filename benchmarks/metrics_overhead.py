@@ -0,0 +1,72 @@
+# coding=utf-8
+"""
+Cost of the latency histograms and counters.
+
+    python -m benchmarks.metrics_overhead [--number N]
+
+Times one observe() and one inc() on their own, then the whole instrumentation
+a connection carrying one request goes through (the clock reads, 5 histograms and 4 counters),
+against the same code path with the metrics calls left out.
+"""
+import argparse
+import time
+import timeit
+
+from qsonac import metrics
+
+
+def instrumented(monotonic = time.monotonic, m = metrics):
+    accepted_at = monotonic()
+    m.connections.inc()
+    started_at = monotonic()
+    m.accept_latency.observe(started_at - accepted_at)
+    start = monotonic()
+    m.parse_latency.observe(monotonic() - start)
+    m.requests.inc()
+    m.bytes_received.inc(120)
+    start = monotonic()
+    m.app_latency.observe(monotonic() - start)
+    m.bytes_sent.inc(1024)
+    m.drain_latency.observe(0.0001)
+    m.connection_duration.observe(monotonic() - accepted_at)
+
+
+def bare(monotonic = time.monotonic):
+    accepted_at = monotonic()
+    started_at = monotonic()
+    started_at - accepted_at
+    start = monotonic()
+    monotonic() - start
+    start = monotonic()
+    monotonic() - start
+    monotonic() - accepted_at
+
+
+def best(stmt, number, repeat = 5):
+    """ nanoseconds per call, best of repeat """
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    histogram = metrics.Registry().histogram("bench_seconds")
+    counter = metrics.Registry().counter("bench_total")
+    results = [
+        ("Histogram.observe()", best(lambda: histogram.observe(0.0123), args.number)),
+        ("Counter.inc()", best(lambda: counter.inc(), args.number)),
+    ]
+    with_metrics = best(instrumented, args.number)
+    without = best(bare, args.number)
+    results.append(("per connection, instrumented", with_metrics))
+    results.append(("per connection, bare", without))
+    results.append(("per connection, overhead", with_metrics - without))
+    for name, ns in results:
+        print("%-32s %8.0f ns" % (name, ns))
+    metrics.REGISTRY.reset()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# coding=utf-8
+"""
+Microbenchmarks of the hot components, stdlib only.
+
+    python -m benchmarks.micro [--filter parse] [--repeat 15] [--save micro-baseline.json]
+    python -m benchmarks.micro --baseline micro-baseline.json [--threshold 0.1]
+
+Every case is warmed up, then timed `repeat` times over a batch of calls sized to last
+about `--min-time` seconds; the median of the per call times is the figure compared
+to the baseline, min and spread are reported alongside. A case slower than the baseline
+by more than `threshold` is flagged and the exit status is 1.
+
+The coroutines (parse_request, readline) are driven by hand over buffers filled up front,
+they never suspend, so no event loop iteration is measured.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+CASES = []
+
+
+def case(name):
+    """ register a factory returning the function to time, or raising to skip the case """
+    def register(factory):
+        CASES.append((name, factory))
+        return factory
+
+    return register
+
+
+def run_coroutine(coro):
+    """ run a coroutine which never suspends """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("the coroutine suspended, some data is missing from the buffer")
+
+
+# region <fixtures>
+
+class FakeSocket:
+    """ just enough of a socket for a StreamSock whose read buffer is filled by hand """
+
+    def fileno(self):
+        return -1
+
+    def recv(self, n):
+        return b""
+
+
+SMALL_HEAD = b"GET /hello HTTP/1.1\r\nHost: 127.0.0.1:48539\r\nUser-Agent: bench\r\nAccept: */*\r\n\r\n"
+
+BROWSER_HEAD = (b"GET /static/file?version=3 HTTP/1.1\r\n"
+                b"Host: 127.0.0.1:48539\r\n"
+                b"Connection: keep-alive\r\n"
+                b"Cache-Control: max-age=0\r\n"
+                b"Upgrade-Insecure-Requests: 1\r\n"
+                b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36\r\n"
+                b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8\r\n"
+                b"Sec-Fetch-Site: none\r\n"
+                b"Sec-Fetch-Mode: navigate\r\n"
+                b"Sec-Fetch-User: ?1\r\n"
+                b"Sec-Fetch-Dest: document\r\n"
+                b"Accept-Encoding: gzip, deflate, br\r\n"
+                b"Accept-Language: en-US,en;q=0.9\r\n"
+                b"Cookie: session=0123456789abcdef; theme=dark\r\n"
+                b"\r\n")
+
+_loop = None
+
+
+def stream(data):
+    """ a StreamSock whose read buffer already holds data """
+    global _loop
+    from qsonac.streamsock import StreamSock
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    conn = StreamSock(_loop, FakeSocket())
+    conn._read_buffer = bytearray(data)
+    return conn
+
+
+def request_handler():
+    from qsonac.handler import makeWSGIhandler
+    return makeWSGIhandler(lambda environ, start_response: [])
+
+# endregion
+
+
+# region <cases>
+
+def _parse_request(head):
+    handler_class = request_handler()
+    request_line, _, rest = head.partition(b"\r\n")
+    request_line += b"\r\n"
+
+    def parse():
+        conn = stream(rest)
+        handler = handler_class(conn)
+        handler.raw_requestline = request_line
+        run_coroutine(handler.parse_request())
+
+    return parse
+
+
+@case("handler.parse_request small")
+def parse_request_small():
+    return _parse_request(SMALL_HEAD)
+
+
+@case("handler.parse_request browser")
+def parse_request_browser():
+    return _parse_request(BROWSER_HEAD)
+
+
+@case("handler.parse_headers browser")
+def parse_headers_browser():
+    handler_class = request_handler()
+    headers = BROWSER_HEAD.partition(b"\r\n")[2]
+
+    def parse():
+        conn = stream(headers)
+        handler = handler_class(conn)
+        run_coroutine(handler.parse_headers(conn))
+
+    return parse
+
+
+def _urlmap_lookup(routes):
+    from qsonac.urlmap import URLMap
+    urlmap = URLMap()
+    paths = ["/api/v%d/resource%d/item" % (i % 3, i) for i in range(routes)]
+    for path in paths:
+        urlmap.add_rule(path, len)
+    lookups = paths[::max(1, routes // 10)]
+
+    def lookup():
+        for path in lookups:
+            urlmap[path]
+
+    return lookup
+
+
+@case("URLMap lookup x10, 10 routes")
+def urlmap_10():
+    return _urlmap_lookup(10)
+
+
+@case("URLMap lookup x10, 100 routes")
+def urlmap_100():
+    return _urlmap_lookup(100)
+
+
+@case("URLMap lookup x10, 1000 routes")
+def urlmap_1000():
+    return _urlmap_lookup(1000)
+
+
+@case("Response construction")
+def response_construction():
+    from qsonac.response import Response
+
+    def construct():
+        Response(200, "Hello, World!")
+
+    return construct
+
+
+@case("Response.generate_headers 10 headers")
+def response_headers():
+    from qsonac.response import Response
+    response = Response(200, "Hello, World!")
+    headers = { "X-Header-%d" % i: "value %d" % i for i in range(10) }
+
+    def generate():
+        response.generate_headers(headers)
+
+    return generate
+
+
+@case("StreamSock.readline browser head")
+def streamsock_readline():
+    def read_lines():
+        conn = stream(BROWSER_HEAD)
+        while run_coroutine(conn.readline()) != b"\r\n":
+            pass
+
+    return read_lines
+
+# endregion
+
+
+def measure(func, repeat, min_time, warmup):
+    """ per call seconds of `repeat` batches, the batch size calibrated to last about min_time """
+    deadline = time.perf_counter() + warmup
+    while time.perf_counter() < deadline:
+        func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed < min_time / 4 else max(2, int(min_time / elapsed) + 1)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    found = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old and result["median_ns"] > old["median_ns"] * (1 + threshold):
+            found.append("%s: %.0f ns, was %.0f ns (+%.0f%%)" % (
+                name, result["median_ns"], old["median_ns"], 100.0 * (result["median_ns"] / old["median_ns"] - 1)))
+    return found
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only the cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per timed batch")
+    parser.add_argument("--warmup", type=float, default=0.2, help="seconds of warmup per case")
+    parser.add_argument("--save", help="write the results to this file, to be used as a baseline")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    results = { }
+    for name, factory in CASES:
+        if args.filter not in name:
+            continue
+        try:
+            func = factory()
+            func()
+        except Exception as e:
+            print("%-40s skipped: %s: %s" % (name, type(e).__name__, e))
+            continue
+        timings = measure(func, args.repeat, args.min_time, args.warmup)
+        median = statistics.median(timings)
+        results[name] = {
+            "median_ns": median * 1e9,
+            "min_ns"   : min(timings) * 1e9,
+            "spread"   : (max(timings) - min(timings)) / median,
+        }
+        print("%-40s %10.0f ns  (min %.0f, spread %.1f%%)" % (name, median * 1e9, min(timings) * 1e9, 100 * results[name]["spread"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({ "python": sys.version.split()[0], "results": results }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = compare(results, json.load(f)["results"], args.threshold)
+        for line in found:
+            print("REGRESSION " + line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 # coding=utf-8
+import os
 
 loopback = "0.0.0.0"
 localhost = "127.0.0.1"
@@ -6,5 +7,7 @@ localhost = "127.0.0.1"
 
 class Config:
     host = localhost
-    port = 48539
+    # the benchmark harness starts the servers on an ephemeral port
+    port = int(os.environ.get("QSONAC_PORT", 48539))
     message = "Hello, World!"
+    large_body = "x" * (1 << 20)
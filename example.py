@@ -12,6 +12,22 @@ def hello(*args, **kwargs):
     return str(request.headers)
 
 
+@app.route("/hello")
+def hello_world(*args, **kwargs):
+    return Config.message
+
+
+@app.route("/headers")
+def headers(*args, **kwargs):
+    request = kwargs.pop("request")
+    return str(request.headers)
+
+
+@app.route("/large")
+def large(*args, **kwargs):
+    return Config.large_body
+
+
 @app.route("/static/file")
 def file_provide_test(*args, **kwargs):
     return app.send_static_file("./static/testFile.htm")
@@ -10,6 +10,21 @@ def hello_world():
     return request.headers
 
 
+@app.route('/hello')
+def hello():
+    return Config.message
+
+
+@app.route('/headers')
+def headers():
+    return str(request.headers)
+
+
+@app.route('/large')
+def large():
+    return Config.large_body
+
+
 @app.route("/static/file")
 def file_provide_test():
     return send_file("./static/testFile.htm")
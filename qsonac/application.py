@@ -1,4 +1,5 @@
 # coding=utf-8
+from qsonac.cache import CachedResponse, ResponseCache
 from qsonac.request import Request
 from qsonac.response import Response
 from qsonac.urlmap import URLMap
@@ -8,12 +9,22 @@ class Application:
     Request_class = Request
     Response_class = Response
 
-    def __init__(self):
+    def __init__(self, cache = None):
         self.rules = URLMap()
+        # the ResponseCache of the routes declared with cache=True, a default one is created for the first of them
+        self.cache = cache
+        # handle: ResponseCache
+        self.route_caches = { }
+
+    def route(self, rule, cache = None):
+        """ cache: True to cache the responses of the route in the application cache, or its own ResponseCache """
 
-    def route(self, rule):
         def wrapper(f):
             self.add_routing(rule, f)
+            if cache:
+                if cache is True and self.cache is None:
+                    self.cache = ResponseCache()
+                self.route_caches[f] = self.cache if cache is True else cache
             return f
 
         return wrapper
@@ -441,6 +452,9 @@ class Application:
         """
         rq = self.make_request(environ)
         rv = self.dispatch_request(rq)
+        if isinstance(rv, CachedResponse):
+            start_response(rv.status, list(rv.headers))
+            return rv
         if not isinstance(rv, tuple):
             rv = (200, rv)
         return self.make_response(rv[0], rv[1], start_response)
@@ -456,7 +470,17 @@ class Application:
         handle = self.rules[path]
         if not handle:
             handle = self.not_found
-        return handle(request=request)
+        cache = self.route_caches.get(handle)
+        if cache is None or request.environ.get("REQUEST_METHOD", "GET") not in cache.methods:
+            return handle(request=request)
+        return cache.fetch(cache.key(request.environ), lambda: self.serialize(handle(request=request)))
+
+    def serialize(self, rv):
+        """ (status, headers, body bytes) of what a handle returned, for the response cache """
+        if not isinstance(rv, tuple):
+            rv = (200, rv)
+        response = self.make_response(rv[0], rv[1], None)
+        return response.http_args["status"], list(response.headers.items()), b"".join(response.body)
 
     def not_found(self, *args, **kwargs):
         return 404, "not found"
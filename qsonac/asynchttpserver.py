@@ -2,13 +2,30 @@
 
 import asyncio
 import errno
+import itertools
 import logging
+import os
+import signal
 import socket
+import time
 
+from qsonac import listeners, logs, metrics
+from qsonac.gctuning import GCTuning
 from qsonac.handler import makeWSGIhandler
-from qsonac.streamsock import StreamSock
+from qsonac.handoff import ListenSocketReceiver
+from qsonac.limiter import ConcurrencyLimiter
+from qsonac.logs import AccessLog, TrafficCapture, traced
+from qsonac.pool import ObjectPool
+from qsonac.streamsock import IOStats, StreamSock
 
+logger = logging.getLogger("qsonac.server")
 
+# python 3.12+: a connection handler runs right away in the accept callback, up to its first suspension,
+# a request already readable is parsed, answered and flushed without a trip through the loop
+_eager_task_factory = getattr(asyncio, "eager_task_factory", None)
+
+
+@traced
 class AsyncHTTPServer:
     # make it in class level, so can be accessed from class method, handle_one_request
     RequestHandlerClass = None
@@ -21,59 +38,291 @@ class AsyncHTTPServer:
     # Seconds to wait before retrying accept().
     ACCEPT_RETRY_DELAY = 1
 
-    def __init__(self, requestHandlerClass, client_address = ("127.0.0.1", 80), loop = None, request_queue_size = 15, multithread = False, multiprocess = False):
+    # Seconds the in-flight requests have to complete once a graceful shutdown started.
+    graceful_timeout = 10
+    DRAIN_POLL_INTERVAL = 0.1
+    # seconds the connections accepted but still without a request have to send it once draining started
+    DRAIN_IDLE_GRACE = 1.0
+
+    # how the acceptor spreads connections across the loops: "round_robin" or "least_loaded"
+    balance = "round_robin"
+
+    # pre-serialized answers for the connections refused by the admission control
+    BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+    TOO_MANY_RESPONSE = b"HTTP/1.1 429 Too Many Requests\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+    def __init__(self, requestHandlerClass, client_address = ("127.0.0.1", 80), loop = None, request_queue_size = 15, multithread = False, multiprocess = False,
+                 sock = None, loops = None, balance = None, backlog = 128, max_connections = None, max_connections_per_ip = None,
+                 idle_timeout = None, header_timeout = None, body_timeout = None, write_timeout = None, debug = False, access_log = None,
+                 metrics_path = None, io_stats = False, loop_monitor = None, concurrency_limit = None, priority_paths = (), capture = None,
+                 listen = (), unix_socket_mode = None, unix_socket_group = None, socket_options = None, close_grace = None,
+                 lingering_timeout = None, pool_size = 256):
         if not loop:
             loop = asyncio.get_event_loop()
-        self.handler_list = { }
+        # loops running the connections, the acceptor loop itself unless some other loops (one per thread) are given
+        self.loops = list(loops) if loops else [loop]
+        self._next_loop = itertools.cycle(self.loops)
+        if balance:
+            self.balance = balance
+        # per-loop registry of the active StreamSock, each inner dict is only modified from its own loop
+        self.handler_list = { l: { } for l in self.loops }
+        # client_address then the other `listen` addresses, (host, port) or "unix:/path" ("host:port" strings are parsed),
+        # a host with a colon is IPv6, "::" being dual-stack
+        self.addresses = [listeners.parse_address(address) for address in [client_address] + list(listen)]
+        self.unix_socket_mode = unix_socket_mode
+        self.unix_socket_group = unix_socket_group
+        # already bound and listening sockets to adopt instead of creating new ones, one or a list,
+        # e.g. inherited from a prefork supervisor, a predecessor or the service manager (LISTEN_FDS)
+        self.listeners = [] if sock is None else list(sock) if isinstance(sock, (list, tuple)) else [sock]
+        self.server_socket = self.listeners[0] if self.listeners else None
+        # the unix socket files bound here, removed on exit unless handed over
+        self.unix_sockets = []
+        # kernel options of the TCP listening and accepted sockets, a SocketOptions or its arguments
+        self.socket_options = listeners.SocketOptions(**socket_options) if isinstance(socket_options, dict) else socket_options
+        self.requests_served = 0
+        self.draining = False
         self.loop = loop
-        self.loop.set_debug(True)
+        # asyncio debug mode is expensive, opt-in only
+        self.loop.set_debug(debug)
         logging.getLogger('asyncio').setLevel(logging.WARNING)
+        # an AccessLog, or the path of a file to write one to
+        self.access_log = AccessLog(access_log) if isinstance(access_log, str) else access_log
+        # a TrafficCapture, or the path of a JSONL file to capture the requests to, see qsonac.replay
+        self.capture = TrafficCapture(capture) if isinstance(capture, str) else capture
+        # path answered with the metrics in the Prometheus text format instead of the application, e.g. "/metrics"
+        self.metrics_path = metrics_path
+        metrics.REGISTRY.gauge("qsonac_active_connections", "Connections being served", self.connection_count)
+        # LoopMonitor of each loop, started with the server if loop_monitor is set (True or the LoopMonitor options)
+        # or at runtime by toggle_loop_monitor()
+        self.loop_monitor = loop_monitor
+        self.loop_monitors = { }
+        # per connection syscall, byte and buffer accounting, summed per loop when the connections end
+        self.io_stats = io_stats
+        self.io_totals = { l: IOStats() for l in self.loops } if io_stats else None
+        if io_stats:
+            for name in IOStats().as_dict():
+                type = "gauge" if name.startswith("peak_") else "counter"
+                metrics.REGISTRY.gauge("qsonac_io_" + name, name.replace("_", " "),
+                                       lambda name = name: getattr(self.io_summary(), name), type)
         self.multithread = multithread
         self.multiprocess = multiprocess
+        # maximum number of connections accepted per event loop tick
         self.request_queue_size = request_queue_size
+        # maximum number of queued connections in the kernel
+        self.backlog = backlog
+
+        """admission control"""
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        # seconds a client has to send the whole header block, however slowly the bytes trickle in
+        self.header_timeout = header_timeout
+        # idle keep-alive, body read stall and write stall timeouts of the connections, None keeps the StreamSock default
+        self.idle_timeout = idle_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        # seconds a client has to close first after a response, then our input draining time after our FIN (lingering close),
+        # None keeps the StreamSock default
+        self.close_grace = StreamSock.close_grace if close_grace is None else close_grace
+        self.lingering_timeout = StreamSock.lingering_timeout if lingering_timeout is None else lingering_timeout
+        self.active_connections = 0
+        self.connections_per_ip = { }
+        # adaptive limit of the requests in flight, one ConcurrencyLimiter per loop (True or the ConcurrencyLimiter options),
+        # the requests over it are answered BUSY_RESPONSE right after their head is parsed, except the priority ones
+        options = concurrency_limit if isinstance(concurrency_limit, dict) else { }
+        self.limiters = { l: ConcurrencyLimiter(**options) for l in self.loops } if concurrency_limit else None
+        self.priority_paths = frozenset(priority_paths)
+        if metrics_path:
+            self.priority_paths |= { metrics_path }
+        if self.limiters:
+            metrics.REGISTRY.gauge("qsonac_concurrency_limit", "Adaptive limit of the requests in flight",
+                                   lambda: sum(int(limiter.limit) for limiter in self.limiters.values()))
+            metrics.REGISTRY.gauge("qsonac_requests_in_flight", "Requests counted by the concurrency limiter",
+                                   lambda: sum(limiter.in_flight for limiter in self.limiters.values()))
+        # a descriptor kept in reserve, closed to be able to accept() and drop a connection when out of descriptors
+        self._spare_fd = None
         self.__class__.RequestHandlerClass = requestHandlerClass
-        self.host, self.port = client_address
+        # per loop free lists of the StreamSock and the request handlers of the finished connections, at most pool_size each
+        self.pools = { l: (ObjectPool(StreamSock, pool_size), ObjectPool(requestHandlerClass, pool_size, requestHandlerClass.unbind))
+                       for l in self.loops }
+        self.host, self.port = (self.addresses[0], None) if listeners.is_unix(self.addresses[0]) else self.addresses[0][:2]
 
     def server_bind(self):
-        self.server_socket.bind((self.host, self.port))
+        for sock, address in zip(self.listeners, self.addresses):
+            listeners.bind(sock, address, self.unix_socket_mode, self.unix_socket_group)
+            if listeners.is_unix(address):
+                self.unix_sockets.append(sock)
 
     def server_activate(self):
         # become a server socket
         # maximum number of queued connections
-        self.server_socket.listen(self.request_queue_size)
-        print(f"listening on http://{self.host}:{self.port}")
+        for sock, address in zip(self.listeners, self.addresses):
+            sock.listen(self.backlog)
+            logger.info("listening on %s", listeners.describe(address))
 
     def setup(self):
-        # create and INET STREAMing socket
-        self.server_socket = socket.socket(self.address_family, self.socket_type)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-        if hasattr(socket, "SO_REUSEPORT"):
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
-        self.server_socket.setblocking(False)
+        # one STREAMing socket per address
+        self.listeners = [listeners.create_socket(address, reuse_port=True) for address in self.addresses]
+        self.server_socket = self.listeners[0]
+        if self.socket_options is not None:
+            for sock, address in zip(self.listeners, self.addresses):
+                if sock.family != socket.AF_UNIX:
+                    logger.info("socket options of %s: %s", listeners.describe(address), self.socket_options.apply(sock))
         # self._selector = selectors.DefaultSelector()
 
     def __enter__(self):
-        self.setup()
-        self.server_bind()
-        self.server_activate()
+        if not self.listeners:
+            self.setup()
+            self.server_bind()
+            self.server_activate()
+        elif self.socket_options is not None:
+            # adopted, e.g. from the prefork supervisor which reported them already
+            for sock in self.listeners:
+                if sock.family != socket.AF_UNIX:
+                    logger.debug("socket options of %s: %s", sock.getsockname(), self.socket_options.apply(sock))
+        self.reserve_spare_fd()
+        if self.access_log is not None:
+            self.access_log.start()
+        if self.capture is not None:
+            self.capture.start()
+        if self.loop_monitor:
+            self.toggle_loop_monitor()
+        if self.limiters is not None:
+            # the loop lag signal: a timer probing every loop, from the loop thread
+            for loop, limiter in self.limiters.items():
+                if loop is self.loop:
+                    limiter.start_lag_probe(loop)
+                else:
+                    loop.call_soon_threadsafe(limiter.start_lag_probe, loop)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         # self._selector.unregister(self)
         # self._selector.close()
-        self.server_socket.close()
+        self.close_listeners()
+        if self._spare_fd is not None:
+            os.close(self._spare_fd)
+            self._spare_fd = None
+        if self.access_log is not None:
+            self.access_log.stop()
+        if self.capture is not None:
+            self.capture.stop()
+        if self.io_stats:
+            logger.info("connections I/O: %r", self.io_summary())
+        for loop, monitor in self.loop_monitors.items():
+            if loop is self.loop:
+                monitor.stop()
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(monitor.stop)
+        for loop, limiter in (self.limiters or { }).items():
+            if loop is self.loop:
+                limiter.stop_lag_probe()
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(limiter.stop_lag_probe)
 
     def start_serve(self):
         """ Main loop awaiting connections """
         # self._selector.register(self, selectors.EVENT_READ)
         # add event listener to server socket
-        self.loop.add_reader(self, self.handle_requests)
+        for sock in self.listeners:
+            self.loop.add_reader(sock, self.handle_requests, sock)
+
+    def stop_accepting(self):
+        for sock in self.listeners:
+            self.loop.remove_reader(sock)
 
     def serve_forever(self):
         self.start_serve()
         self.loop.run_forever()
 
-    def handle_requests(self):
+    def stop(self):
+        """ Stop accepting and let serve_forever return """
+        self.stop_accepting()
+        self.loop.stop()
+
+    async def shutdown(self, timeout = None):
+        """
+        Graceful shutdown.
+
+        Stop accepting, give the connections still without a request DRAIN_IDLE_GRACE seconds to send it
+        and the active handlers `timeout` seconds to finish, abort whatever is still running and stop the loop.
+        The connections already queued on the listening sockets are served, then they are closed.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        if timeout is None:
+            timeout = self.graceful_timeout
+        deadline = self.loop.time() + timeout
+        self.stop_accepting()
+        logger.info("draining %d connections", self.connection_count())
+        self.close_listeners(serve_queued=True)
+        idle_deadline = self.loop.time() + self.DRAIN_IDLE_GRACE
+        while self.connection_count() and self.loop.time() < deadline:
+            await asyncio.sleep(self.DRAIN_POLL_INTERVAL)
+            if self.loop.time() >= idle_deadline:
+                # a fresh connection closed right away would fail its request, a late one only held us up
+                self.abort_connections(idle_only=True)
+        if self.connection_count():
+            self.abort_connections()
+            # let the aborted handlers run their cleanup
+            await asyncio.sleep(self.DRAIN_POLL_INTERVAL)
+        self.loop.stop()
+
+    def graceful_shutdown(self):
+        self.loop.create_task(self.shutdown())
+
+    def close_listeners(self, serve_queued = False):
+        # with SO_REUSEPORT the kernel keeps queuing connections on our socket until it is closed,
+        # closed only on exit they would be reset while a sibling or a successor could have served them
+        for sock in self.listeners:
+            while serve_queued:
+                try:
+                    request, client_address = self.accept_request(sock)
+                except OSError:
+                    break
+                self.admit(request, client_address)
+            if sock in self.unix_sockets:
+                listeners.unlink(sock)
+            sock.close()
+        self.unix_sockets = []
+
+    def reexec(self):
+        """ Start a new copy of this process and hand the listening socket over to it """
+        from qsonac.handoff import ListenSocketHandoff
+        if not self.draining:
+            ListenSocketHandoff(self).start()
+
+    def install_signal_handlers(self):
+        # SIGTERM drains, SIGUSR2 re-executes with zero downtime, SIGUSR1 starts/stops the loop monitor
+        self.loop.add_signal_handler(signal.SIGTERM, self.graceful_shutdown)
+        self.loop.add_signal_handler(signal.SIGUSR2, self.reexec)
+        self.loop.add_signal_handler(signal.SIGUSR1, self.toggle_loop_monitor)
+
+    def toggle_loop_monitor(self):
+        """ Start or stop the lag monitor and stall sampler of every loop """
+        from qsonac.monitor import LoopMonitor
+        options = self.loop_monitor if isinstance(self.loop_monitor, dict) else { }
+        for loop in self.loops:
+            monitor = self.loop_monitors.get(loop)
+            if monitor is None:
+                monitor = self.loop_monitors[loop] = LoopMonitor(loop, **options)
+            if loop is self.loop:
+                monitor.toggle()
+            else:
+                # started from the loop's own thread, it samples this thread
+                loop.call_soon_threadsafe(monitor.toggle)
+
+    def abort_connections(self, idle_only = False):
+        for loop, handlers in self.handler_list.items():
+            for conn in list(handlers):
+                if idle_only and not conn.idle:
+                    continue
+                if loop is self.loop:
+                    conn.abort()
+                else:
+                    loop.call_soon_threadsafe(conn.abort)
+
+    def handle_requests(self, listener = None):
         # This method is only called once for each event loop tick where the
         # listening socket has triggered an EVENT_READ. There may be multiple
         # connections waiting for an .accept() so it is called in a loop.
@@ -81,114 +330,280 @@ class AsyncHTTPServer:
         for i in range(self.request_queue_size):
             try:
                 # Handle one request
-                request, client_address = self.accept_request()
+                request, client_address = self.accept_request(listener)
             except (BlockingIOError, InterruptedError, ConnectionAbortedError):
                 # Early exit because the socket accept buffer is empty.
                 break
             except OSError as exc:
                 # There's nowhere to send the error, so just log it.
-                if exc.errno in (errno.EMFILE, errno.ENFILE,
-                                 errno.ENOBUFS, errno.ENOMEM):
+                if exc.errno in (errno.EMFILE, errno.ENFILE) and self._spare_fd is not None:
+                    # out of descriptors: free the spare one to accept and drop the pending connection,
+                    # the client is told right away instead of hanging in the backlog
+                    self.drop_pending_connection(listener)
+                elif exc.errno in (errno.EMFILE, errno.ENFILE,
+                                   errno.ENOBUFS, errno.ENOMEM):
                     # Some platforms (e.g. Linux keep reporting the FD as
                     # ready, so we remove the read handler temporarily.
                     # We'll try again in a while.
-                    self.log(self.server_socket, (self.host, self.port), str({
-                        'message'  : 'socket.accept() out of system resource',
-                        'exception': exc,
-                        'socket'   : self.server_socket,
-                    }))
-                    self.loop.remove_reader(self)
+                    logger.warning("socket.accept() out of system resource: %s, %s", exc, listener)
+                    self.stop_accepting()
                     self.loop.call_later(self.ACCEPT_RETRY_DELAY, self.start_serve)
                 else:
                     raise  # The event loop will catch, log and ignore it.
             else:
-                self.create_new_request_handler(request, client_address)
+                self.admit(request, client_address)
         # perform periodic task
         self.service_actions()
 
     def service_actions(self):
-        # print("thread list:", len(threading.enumerate()), threading.enumerate())
-        print(asyncio.Task.all_tasks())
+        # a hook run once per accept batch, O(1): no walk over the tasks of the connections
+        metrics.accept_wakeups.inc()
 
-    def accept_request(self):
+    def accept_request(self, listener = None):
         # conn - socket to client
-        # addr - clients address
-        client_socket, client_address = self.server_socket.accept()
+        # addr - clients address, '' for a unix socket peer
+        client_socket, client_address = (listener or self.server_socket).accept()
         self.log(client_socket, client_address, "Got")
         return client_socket, client_address
 
+    # region <admission control>
+
+    def reserve_spare_fd(self):
+        if self._spare_fd is None:
+            try:
+                self._spare_fd = os.open(os.devnull, os.O_RDONLY)
+            except OSError:
+                pass  # still exhausted, try again later
+
+    def drop_pending_connection(self, listener = None):
+        os.close(self._spare_fd)
+        self._spare_fd = None
+        try:
+            request, client_address = (listener or self.server_socket).accept()
+        except OSError:
+            pass
+        else:
+            logger.warning("connection from %s dropped, out of file descriptors", client_address)
+            self.reject_request(request, self.BUSY_RESPONSE)
+        finally:
+            self.reserve_spare_fd()
+
+    @staticmethod
+    def client_ip(client_address):
+        return client_address[0] if isinstance(client_address, tuple) else client_address
+
+    def admit(self, request, client_address):
+        response = self.verify_request(request, client_address)
+        if response is None:
+            self.create_new_request_handler(request, client_address)
+        else:
+            self.reject_request(request, response)
+
+    def verify_request(self, request, client_address):
+        """
+        Admit the connection and account for it, return None, or the response to refuse it with
+        """
+        if self.max_connections is not None and self.active_connections >= self.max_connections:
+            return self.BUSY_RESPONSE
+        ip = self.client_ip(client_address)
+        per_ip = self.connections_per_ip.get(ip, 0)
+        if self.max_connections_per_ip is not None and per_ip >= self.max_connections_per_ip:
+            return self.TOO_MANY_RESPONSE
+        self.active_connections += 1
+        self.connections_per_ip[ip] = per_ip + 1
+        return None
+
+    def release_request(self, client_address):
+        # must run on the acceptor loop, the only one touching the admission counters
+        self.active_connections -= 1
+        ip = self.client_ip(client_address)
+        count = self.connections_per_ip.pop(ip, 1) - 1
+        if count > 0:
+            self.connections_per_ip[ip] = count
+
+    def request_limiter(self, loop, path):
+        """ The ConcurrencyLimiter a request on this loop must go through, None if it is never shed """
+        if self.limiters is None or path.partition("?")[0] in self.priority_paths:
+            return None
+        return self.limiters[loop]
+
+    def reject_request(self, request, response):
+        try:
+            # best effort, a fresh socket send buffer always takes such a short answer
+            request.setblocking(False)
+            request.send(response)
+        except OSError:
+            pass
+        request.close()
+
+    # endregion
+
+    def select_loop(self):
+        if len(self.loops) == 1:
+            return self.loops[0]
+        if self.balance == "least_loaded":
+            return min(self.loops, key=lambda loop: len(self.handler_list[loop]))
+        return next(self._next_loop)
+
     def create_new_request_handler(self, request, client_address):
         # worker = threading.Thread(target=self.__class__.process_request, args=(request, client_address, self))
         # worker.daemon = self.daemon_threads
         # # worker.join()
         # worker.start()
-        self.loop.create_task(self.handle_one_request(request, client_address, self))
+        metrics.connections.inc()
+        # every loop clock is time.monotonic(), the handler measures the hand-off against it
+        accepted_at = time.monotonic()
+        loop = self.select_loop()
+        if loop is self.loop:
+            self.start_request_handler(loop, request, client_address, accepted_at)
+        else:
+            # the connection belongs to another thread's loop from now on
+            loop.call_soon_threadsafe(self.start_request_handler, loop, request, client_address, accepted_at)
+
+    def start_request_handler(self, loop, request, client_address, accepted_at = None):
+        coro = self.handle_one_request(request, client_address, self, loop, accepted_at)
+        if _eager_task_factory is not None:
+            _eager_task_factory(loop, coro)
+        else:
+            loop.create_task(coro)
 
     @classmethod
-    @asyncio.coroutine
-    def handle_one_request(cls, request, client_address, server):
+    async def handle_one_request(cls, request, client_address, server, loop = None, accepted_at = None):
         cls.log(request, client_address, "start handling")
+        started_at = (loop or server.loop).time()
+        if accepted_at is None:
+            accepted_at = started_at
+        metrics.accept_latency.observe(started_at - accepted_at)
         try:
-            if cls.verify_request(request, client_address):
-                yield from cls.process_request(request, client_address, cls.RequestHandlerClass, server)
-                cls.finish_request(request, client_address)
+            await cls.process_request(request, client_address, cls.RequestHandlerClass, server, loop)
+            server.finish_request(request, client_address)
         except Exception as e:
             cls.handle_error(request, client_address, e)
         finally:
             cls.shutdown_request(request)
+            metrics.connection_duration.observe((loop or server.loop).time() - accepted_at)
+            if loop is None or loop is server.loop:
+                server.release_request(client_address)
+            else:
+                server.loop.call_soon_threadsafe(server.release_request, client_address)
 
     @staticmethod
-    def log(request, client_address: tuple = "", msg: str = "", *args):
+    def debug_log(request, client_address: tuple = "", msg: str = "", *args):
         # print(threading.current_thread(), " start handling ", request, " from ", client_address)
-        print(asyncio.Task.current_task(), msg, request, " from ", client_address)
-
-    @staticmethod
-    async def process_request(request, client_address, RequestHandlerClass, server):
-        async with StreamSock(server.loop, request, server) as streamRW:
-            async with RequestHandlerClass(streamRW) as handle:
-                return await handle
+        logger.debug("%s %s from %s", msg, request, client_address)
 
     @staticmethod
-    def verify_request(request, client_address):
-        return True
+    async def process_request(request, client_address, RequestHandlerClass, server, loop = None):
+        loop = loop or server.loop
+        streams, handlers = server.pools[loop]
+        streamRW = streams.acquire(loop, request, server)
+        handle = handlers.acquire(streamRW)
+        try:
+            async with streamRW:
+                async with handle:
+                    return await handle
+        finally:
+            # the handler first, it holds the stream
+            handlers.release(handle)
+            streams.release(streamRW)
 
-    @staticmethod
-    def finish_request(request, client_address):
+    def finish_request(self, request, client_address):
         # a hook function for future use
-        pass
+        self.requests_served += 1
 
     @classmethod
     def shutdown_request(cls, request):
         """Called to shutdown and close an individual request."""
-        try:
-            # explicitly shutdown.  socket.close() merely releases
-            # the socket and waits for GC to perform the actual close.
-            request.shutdown(socket.SHUT_WR)
-            cls.log(request, msg="shutdown")
-        except OSError:
-            pass  # some platforms may raise ENOTCONN here
+        # StreamSock.close() has already shut it down and closed it, unless it failed before taking it over
         request.close()
         cls.log(request, msg="hsa closed")
 
     @classmethod
     def handle_error(cls, request, client_address, e):
-        cls.log(request, client_address, "exception raised during processing", e)
-        import traceback
-        traceback.print_exc()
+        logger.error("exception raised during processing %s from %s", request, client_address, exc_info=e)
 
     def fileno(self):
         return self.server_socket.fileno()
 
     def attach(self, handler, conn):
-        self.handler_list[handler] = conn
+        self.handler_list[handler.loop][handler] = conn
 
     def detach(self, handler, exc):
-        del self.handler_list[handler]
-        print(handler, exc)
+        del self.handler_list[handler.loop][handler]
+        if handler.io is not None:
+            self.io_totals[handler.loop].add(handler.io)
+        self.log(handler, exc, "detached")
+
+    def connection_count(self):
+        return sum(len(handlers) for handlers in self.handler_list.values())
+
+    def io_summary(self):
+        """ IOStats of all the finished connections, None unless io_stats is set """
+        if self.io_totals is None:
+            return None
+        summary = IOStats()
+        for totals in list(self.io_totals.values()):
+            summary.merge(totals)
+        return summary
 
 
-def serve(app, host = "127.0.0.1", port = 38764, loop = None):
+def serve(app, host = "127.0.0.1", port = 38764, loop = None, workers = None, reuse_port = True, threads = None, balance = None, gc_tuning = None,
+          **options):
+    """
+    Serve the wsgi application forever.
+
+    With workers=N a prefork supervisor forks N worker processes, each one running its own event loop.
+    If reuse_port is set (and the platform supports SO_REUSEPORT) every worker binds its own listening socket
+    and the kernel balances the connections, otherwise all the workers accept on one inherited socket.
+    The workers are recycled, a successor being forked first, past max_requests requests (plus a random
+    0..max_requests_jitter), max_rss bytes of resident memory or max_age seconds.
+
+    With threads=N the process runs N event loops on their own threads, the calling loop only accepts
+    and hands the connections over, round robin or to the least loaded loop (balance="least_loaded").
+
+    host may be "unix:/path" to listen on a unix socket, with the unix_socket_mode and unix_socket_group
+    permissions, listen=[...] adds addresses served by the same loop ("::" is IPv6 dual-stack).
+    Started by a service manager passing listening sockets (socket activation, LISTEN_FDS), those are
+    served instead of any address.
+
+    gc_tuning (a GCTuning, its arguments or True for its defaults) sets the garbage collector up once the application
+    is loaded, before the workers are forked: gc.freeze(), the generation thresholds and the pause metrics.
+
+    The remaining options are passed to AsyncHTTPServer, e.g. backlog, max_connections,
+    max_connections_per_ip, idle_timeout, header_timeout, body_timeout, write_timeout,
+    debug (asyncio debug mode and the per request traces), access_log, metrics_path, io_stats, loop_monitor,
+    concurrency_limit, priority_paths, capture, socket_options (kernel TCP tuning, see listeners.SocketOptions),
+    close_grace and lingering_timeout (how a connection is closed, see StreamSock.close),
+    pool_size (finished connection objects kept per loop for the next ones, 0 allocates them all).
+    """
+    logs.configure(options.get("debug", False))
     handler_class = makeWSGIhandler(app)
+    address = host if host.startswith(listeners.UNIX_PREFIX) else (host, port)
+    # started by a zero-downtime re-exec, the listening sockets come from our predecessor
+    handoff = ListenSocketReceiver.from_environ()
+    sock = handoff.receive() if handoff else listeners.listen_fds() or None
+    if gc_tuning:
+        gc_tuning = GCTuning(**gc_tuning) if isinstance(gc_tuning, dict) else GCTuning() if gc_tuning is True else gc_tuning
+        logger.info("garbage collector: %s", gc_tuning.apply())
+    if workers:
+        from qsonac.prefork import PreforkSupervisor
+        PreforkSupervisor(handler_class, address, workers, reuse_port, sock=sock, handoff=handoff, **options).run()
+        return
+    if threads:
+        from qsonac.loopgroup import LoopGroup
+        with LoopGroup(threads) as group:
+            with AsyncHTTPServer(handler_class, address, loop, multithread=True, loops=group.loops, balance=balance, sock=sock, **options) as server:
+                _serve_forever(server, handoff)
+        return
     # asyncio.start_server(print)  # stupid
-    with AsyncHTTPServer(handler_class, (host, port), loop) as server:
-        server.serve_forever()
+    with AsyncHTTPServer(handler_class, address, loop, sock=sock, **options) as server:
+        _serve_forever(server, handoff)
+
+
+def _serve_forever(server, handoff = None):
+    server.install_signal_handlers()
+    if handoff:
+        # the socket files of our predecessor are ours to remove
+        server.unix_sockets = [sock for sock in server.listeners if sock.family == socket.AF_UNIX]
+        server.loop.call_soon(handoff.acknowledge)
+    server.serve_forever()
@@ -0,0 +1,266 @@
+# coding=utf-8
+
+import asyncio
+import collections
+import json
+import struct
+import threading
+import time
+
+from qsonac import metrics
+
+# bookkeeping counted in the size of an entry, next to its body and headers
+ENTRY_OVERHEAD = 256
+
+
+class CachedResponse:
+    """ A serialized response: the status line, the header list and the whole body """
+    __slots__ = ("status", "headers", "body", "expires", "stale_until", "size")
+
+    def __init__(self, status, headers, body, expires = 0.0, stale_until = 0.0):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.stale_until = stale_until
+        self.size = len(body) + sum(len(name) + len(value) for name, value in headers) + ENTRY_OVERHEAD
+
+    def __iter__(self):
+        return iter((self.body,))
+
+    def dumps(self):
+        """ bytes for the backends out of the process """
+        head = json.dumps([self.status, self.headers, self.expires, self.stale_until]).encode("utf-8")
+        return struct.pack("<I", len(head)) + head + self.body
+
+    @classmethod
+    def loads(cls, data):
+        size = struct.unpack_from("<I", data)[0]
+        status, headers, expires, stale_until = json.loads(data[4:4 + size].decode("utf-8"))
+        return cls(status, [tuple(header) for header in headers], data[4 + size:], expires, stale_until)
+
+
+class MemoryBackend:
+    """
+        In process LRU of CachedResponse bounded by the bytes of the entries.
+
+        A backend only needs get(key), set(key, entry), delete(key) and clear(),
+        it is called from the threads of all the event loops.
+    """
+
+    def __init__(self, max_bytes = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                metrics.cache_evictions.inc()
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class _Flight:
+    __slots__ = ("done", "entry", "loop", "refresh")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        # a refresh not run yet, scheduled on loop
+        self.loop = None
+        self.refresh = None
+
+
+class ResponseCache:
+    """
+        Micro-cache of whole responses, keyed by method, path, query and the `vary` request headers.
+
+        A response is fresh for `ttl` seconds, then served stale for `stale_while_revalidate` more seconds
+        while a single refresh runs after the current request (on the running event loop, or on a thread
+        without one). Concurrent misses of a key are coalesced: one runs the application, the others wait
+        for its response up to `wait_timeout` seconds, then run it themselves.
+        Only the `methods` are looked up and only the `statuses` stored, a response setting a cookie or
+        marked no-store/private is never stored.
+
+        Usable as Application(cache=...) / @app.route(rule, cache=...) or as a wsgi middleware: cache.wsgi(app).
+    """
+
+    def __init__(self, ttl = 1.0, stale_while_revalidate = 0.0, max_bytes = 16 * 1024 * 1024, vary = (), methods = ("GET", "HEAD"),
+                 statuses = (200,), backend = None, wait_timeout = 5.0, clock = time.monotonic):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.backend = backend if backend is not None else MemoryBackend(max_bytes)
+        # environ keys of the vary headers
+        self.vary = tuple("HTTP_" + name.upper().replace("-", "_") for name in vary)
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self._flights = { }
+        self._lock = threading.Lock()
+
+    def key(self, environ):
+        key = "%s %s?%s" % (environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", ""), environ.get("QUERY_STRING", ""))
+        if self.vary:
+            key += "\n" + "\n".join(environ.get(name, "") for name in self.vary)
+        return key
+
+    def storable(self, status, headers):
+        if int(status.split(" ", 1)[0]) not in self.statuses:
+            return False
+        for name, value in headers:
+            name = name.lower()
+            if name == "set-cookie" or (name == "cache-control" and ("no-store" in value or "private" in value)):
+                return False
+        return True
+
+    def fetch(self, key, produce):
+        """
+        The CachedResponse of key, produce() -> (status, headers, body) runs the application on a miss.
+        """
+        entry = self.backend.get(key)
+        if entry is not None:
+            now = self.clock()
+            if now < entry.expires:
+                metrics.cache_hits.inc()
+                return entry
+            if now < entry.stale_until:
+                metrics.cache_stale_hits.inc()
+                self._revalidate(key, produce)
+                return entry
+        return self._produce_once(key, produce)
+
+    def _produce_once(self, key, produce):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            metrics.cache_coalesced.inc()
+            if flight.loop is not None and flight.loop is asyncio._get_running_loop():
+                # the refresh is queued behind us on this loop, waiting for it would hold it up for wait_timeout: run it now
+                refresh = flight.refresh
+                if refresh is not None:
+                    refresh()
+                if flight.entry is not None:
+                    return flight.entry
+                return self._store(key, produce)[0]
+            if flight.done.wait(self.wait_timeout) and flight.entry is not None:
+                return flight.entry
+            return self._store(key, produce)[0]
+        try:
+            entry, stored = self._store(key, produce)
+            if stored:
+                # a response for this client only (a cookie, private...) is not handed over, the waiters produce their own
+                flight.entry = entry
+            return entry
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _store(self, key, produce):
+        """ (entry, whether it was stored) """
+        metrics.cache_misses.inc()
+        status, headers, body = produce()
+        now = self.clock()
+        entry = CachedResponse(status, headers, body, now + self.ttl, now + self.ttl + self.stale_while_revalidate)
+        stored = self.storable(status, headers)
+        if stored:
+            self.backend.set(key, entry)
+        return entry, stored
+
+    def _revalidate(self, key, produce):
+        with self._lock:
+            if key in self._flights:
+                return
+            flight = self._flights[key] = _Flight()
+
+        def refresh():
+            if flight.refresh is None:
+                return  # run already by a request of its loop
+            flight.refresh = None
+            try:
+                entry, stored = self._store(key, produce)
+                if stored:
+                    flight.entry = entry
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        flight.refresh = refresh
+        loop = asyncio._get_running_loop()
+        if loop is not None:
+            # after the stale response is written
+            flight.loop = loop
+            loop.call_soon(refresh)
+        else:
+            threading.Thread(target=refresh, name="qsonac-cache-refresh", daemon=True).start()
+
+    def invalidate(self, key = None):
+        """ drop one key, or everything """
+        if key is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(key)
+
+    def wsgi(self, app):
+        """ app wrapped in a wsgi middleware caching its responses """
+
+        def middleware(environ, start_response):
+            if environ.get("REQUEST_METHOD", "GET") not in self.methods:
+                return app(environ, start_response)
+
+            def produce():
+                head = []
+                chunks = []
+
+                def buffering_start_response(status, response_headers, exc_info = None):
+                    head[:] = [status, list(response_headers)]
+                    return chunks.append
+
+                itr = app(environ, buffering_start_response)
+                try:
+                    chunks.extend(itr)
+                finally:
+                    if hasattr(itr, "close"):
+                        itr.close()
+                return head[0], head[1], b"".join(chunks)
+
+            entry = self.fetch(self.key(environ), produce)
+            start_response(entry.status, list(entry.headers))
+            return entry
+
+        return middleware
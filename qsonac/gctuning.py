@@ -0,0 +1,63 @@
+# coding=utf-8
+
+import gc
+import time
+
+from qsonac import metrics
+
+
+class GCTuning:
+    """
+        Cyclic garbage collector settings of a server process, applied once the application is loaded.
+
+        * freeze: collect, then move every object alive (the application, its routes, the imported modules)
+          to the permanent generation with gc.freeze() (python 3.7+): the collections never scan them again,
+          and in prefork mode, applied before the workers are forked, they do not touch those pages,
+          which stay shared copy-on-write
+        * thresholds: (threshold0[, threshold1[, threshold2]]) of gc.set_threshold(), e.g. (50000, 20, 100)
+          to collect the young objects less often, the interpreter defaults unless given
+        * pause_metrics: time every collection through gc.callbacks, in metrics.gc_young_pause (generations 0 and 1)
+          and metrics.gc_full_pause (generation 2), counted per generation in metrics.gc_collections
+
+        The settings are inherited through fork(), apply() reports what it did.
+    """
+
+    def __init__(self, freeze = True, thresholds = None, pause_metrics = True):
+        if thresholds is not None and (not 1 <= len(thresholds) <= 3 or not all(isinstance(value, int) and value >= 0 for value in thresholds)):
+            raise ValueError("thresholds must be 1 to 3 numbers for gc.set_threshold(), not %r" % (thresholds,))
+        self.freeze = freeze
+        self.thresholds = tuple(thresholds) if thresholds is not None else None
+        self.pause_metrics = pause_metrics
+        # perf_counter() at the start of the collection running, they never overlap
+        self._started = None
+
+    def apply(self):
+        report = []
+        if self.thresholds is not None:
+            gc.set_threshold(*self.thresholds)
+        report.append("thresholds=%d/%d/%d" % gc.get_threshold())
+        if self.pause_metrics and self.on_collection not in gc.callbacks:
+            gc.callbacks.append(self.on_collection)
+            report.append("pauses timed")
+        if self.freeze:
+            if hasattr(gc, "freeze"):
+                # no garbage in the permanent generation, it would never be freed
+                gc.collect()
+                gc.freeze()
+                report.append("%d objects frozen" % gc.get_freeze_count())
+            else:
+                report.append("freeze needs python 3.7+")
+        return ", ".join(report)
+
+    def on_collection(self, phase, info):
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+        if self._started is None:
+            # installed while a collection was running
+            return
+        pause = time.perf_counter() - self._started
+        self._started = None
+        generation = info["generation"]
+        (metrics.gc_full_pause if generation == 2 else metrics.gc_young_pause).observe(pause)
+        metrics.gc_collections[generation].inc()
@@ -1,16 +1,27 @@
 # coding=utf-8
 
-import asyncio
+import itertools
+import logging
 import sys
+import time
 from email.utils import formatdate
 from urllib.parse import unquote, urlparse
 
+from qsonac import metrics
+from qsonac.logs import traced
 from qsonac.response import Response
 from qsonac.status_codes import codes as status_codes
 from qsonac.streamsock import StreamSock
 
 
+logger = logging.getLogger("qsonac.handler")
+
+# ids of the handled requests, they tag the stack samples of the loop monitor
+_request_ids = itertools.count(1)
+
+
 def makeWSGIhandler(wsgi_app):
+    @traced
     class WSGIRequestHandler():
         """
             A HTTP request handler that implements WSGI dispatching.
@@ -157,11 +168,60 @@ def makeWSGIhandler(wsgi_app):
 
         http_head_encoding = "iso-8859-1"
 
+        # one handler per connection lives as long as the connection, even idle, keep it small
+        __slots__ = ("debug", "request", "request_id", "start_time", "command", "status", "bytes_sent",
+                     "raw_requestline", "requestline", "target", "path", "request_version", "headers", "close_connection",
+                     "environ", "response_status", "response_headers", "headers_sent", "body_sample",
+                     "bound_start_response", "bound_write")
+        # bound_start_response and bound_write, for ObjectPool
+        self_references = 2
+
         def __init__(self, requestStream: StreamSock, debug: bool = True):
+            # bound once, a pooled handler hands the same ones to all its requests
+            self.bound_start_response = self.start_response
+            self.bound_write = self.write
+            self.reset(requestStream, debug)
+
+        def reset(self, requestStream: StreamSock, debug: bool = True):
+            """ reused from an ObjectPool for a new connection """
             self.debug = debug
             self.request = requestStream
+            self.request_id = next(_request_ids)
             self.log("handler created for")
-            self.response_head_buffer = { "status": "", "headers": { } }
+            # set by start_response, sent along the first chunk of the body
+            self.response_status = None
+            self.response_headers = None
+            self.headers_sent = False
+            # start of the body for the traffic capture
+            self.body_sample = None
+            # for the access log
+            self.start_time = requestStream.loop.time()
+            self.command = None
+            # the request head, for the logs even when it never arrived in full
+            self.requestline = None
+            self.target = None
+            self.path = None
+            self.request_version = None
+            self.headers = None
+            self.status = None
+            self.bytes_sent = 0
+
+        def clear(self):
+            """ entering an ObjectPool: the stream, the request and its environ are not kept alive """
+            self.request = None
+            self.raw_requestline = None
+            self.requestline = None
+            self.target = None
+            self.path = None
+            self.headers = None
+            self.environ = None
+            self.response_headers = None
+            self.body_sample = None
+
+        def unbind(self):
+            """ left out of the pool: no cycle through the bound methods, reference counting frees it """
+            self.bound_start_response = None
+            self.bound_write = None
 
         # region <async flow>
 
@@ -171,16 +231,22 @@ def makeWSGIhandler(wsgi_app):
         async def __aexit__(self, exc_type, exc_val, exc_tb):
             return False
 
-        async def __coro_call__(self, *args, **kwargs):
+        async def __coro_call__(self):
             try:
                 self.log("start handle ")
                 await self.handle()
             except  TimeoutError as e:
-                await self.send_error(408, str(e))
+                if not self.headers_sent:
+                    # the request head or body was too slow
+                    await self.send_error(408, str(e))
+                else:
+                    # the client stopped reading the response: cut it (reset), a 408 would land in the middle of its body
+                    self.request.abort(ConnectionAbortedError(str(e)))
+            except (ConnectionAbortedError, EOFError) as e:
+                # aborted by a graceful drain, or the connection ended before a whole request head: a normal close
+                self.log("connection ended", e)
             except Exception as e:
-                self.log("error happened during processing ", e)
-                import traceback
-                traceback.print_exc()
+                logger.exception("error happened during processing %s", self.request)
             finally:
                 await self.finish()
 
@@ -189,14 +255,9 @@ def makeWSGIhandler(wsgi_app):
 
         # endregion
 
-
-
-        def log(self, msg, *args):
+        def debug_log(self, msg, *args):
             # print(threading.current_thread(), ":", msg, self.request, "from", self.client_address, sep="")
-            print(asyncio.Task.current_task(), ":", msg, self.request, "from", self.request.remote_address, sep="")
-            if args:
-                print("more info", args, sep="")
-            print()
+            logger.debug("%s %s %s", msg, self.request, args)
 
         def make_environ(self):
             request_url = urlparse(self.path)
@@ -215,7 +276,7 @@ def makeWSGIhandler(wsgi_app):
                 "wsgi.multithread" : self.request.server.multithread,
                 "wsgi.multiprocess": self.request.server.multiprocess,
                 'SERVER_SOFTWARE'  : self.server_version,
-                'REMOTE_ADDR'      : self.request.remote_host,
+                'REMOTE_ADDR'      : self.request.remote_host,  # 127.0.0.1 for a unix socket peer
                 'REMOTE_PORT'      : self.request.remote_port,
             }
             for key, value in self.headers.items():
@@ -233,12 +294,26 @@ def makeWSGIhandler(wsgi_app):
 
         async def finish(self):
             self.log("completed handling")
+            server = self.request.server
+            if server is not None and server.access_log is not None and self.command:
+                server.access_log.record(self.request.remote_host, self.command, self.path, self.request_version,
+                                         self.status, self.bytes_sent, self.request.loop.time() - self.start_time)
+            if server is not None and server.capture is not None and self.command:
+                server.capture.record(self.command, self.target, self.headers or { }, self.body_sample,
+                                      self.status, self.bytes_sent, self.request.loop.time() - self.start_time)
             await self.request.close()
 
         async def send_error(self, code: int, message: str = "error occured", explain = None):
+            self.status = code
             if self.debug:
                 await self.write_itr(Response(code, message))
 
+        async def shed(self):
+            # over the concurrency limit: a pre-serialized 503, before any environ is built
+            self.status = 503
+            metrics.shed_requests.inc()
+            await self.request.write(self.request.server.BUSY_RESPONSE)
+
         async def parse_headers(self, fp):
             """
             Parses only RFC2822 headers from a file pointer.
@@ -276,8 +351,9 @@ def makeWSGIhandler(wsgi_app):
             #   - HTTP/2.4 is a lower version than HTTP/2.13, which in
             #      turn is lower than HTTP/12.3;
             #   - Leading zeros MUST be ignored by recipients.
-            self.command, self.path, self.request_version = self.requestline.split()
-            self.path = unquote(self.path)
+            self.command, self.target, self.request_version = self.requestline.split()
+            # the request-target as sent, still percent-encoded, for the traffic capture
+            self.path = unquote(self.target)
             if self.request_version[:5] != 'HTTP/':
                 raise ValueError
             self.headers = await self.parse_headers(self.request)
@@ -292,8 +368,16 @@ def makeWSGIhandler(wsgi_app):
         async def handle_request(self):
             if self.headers.get('Expect', '').lower().strip() == '100-continue':
                 self.request.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            server = self.request.server
+            if server is not None and server.metrics_path and self.path.partition("?")[0] == server.metrics_path:
+                await self.run_wsgi(metrics.metrics_app)
+                return
             self.log("try to run wsgi app")
-            await self.run_wsgi(wsgi_app)
+            started_at = time.monotonic()
+            try:
+                await self.run_wsgi(wsgi_app)
+            finally:
+                metrics.app_latency.observe(time.monotonic() - started_at)
 
         async def handle(self):
             '''
@@ -318,22 +402,42 @@ def makeWSGIhandler(wsgi_app):
             if self.raw_requestline:
                 if self.raw_requestline.endswith(b"\n"):
                     self.log("try to parse request head")
+                    started_at = time.monotonic()
                     await self.parse_request()
-                    await self.handle_request()
+                    metrics.parse_latency.observe(time.monotonic() - started_at)
+                    metrics.requests.inc()
+                    self.request.set_phase(StreamSock.BODY)
+                    server = self.request.server
+                    if server is not None and server.capture is not None and server.capture.body_sample:
+                        # what came along the head, before the application reads it
+                        self.body_sample = self.request.peek(server.capture.body_sample)
+                    limiter = server.request_limiter(self.request.loop, self.path) if server is not None else None
+                    if limiter is None:
+                        await self.handle_request()
+                    elif limiter.try_acquire():
+                        started_at = time.monotonic()
+                        try:
+                            await self.handle_request()
+                        finally:
+                            limiter.release(time.monotonic() - started_at)
+                    else:
+                        await self.shed()
                 else:
                     # 414 - 'Request-URI Too Long'
                     await self.send_error(status_codes["414"])
 
         async def write(self, data):
             if data:
-                if hasattr(self, "response_head_buffer") and self.response_head_buffer:
-                    buffer = [self.response_head_buffer["status"]] + [('%s: %s\r\n' % header) for header in self.response_head_buffer["headers"].items()] + ["\r\n"]
+                if self.response_status is not None and not self.headers_sent:
+                    buffer = [self.response_status] + [('%s: %s\r\n' % header) for header in self.response_headers.items()] + ["\r\n"]
                     http_head = "".join(buffer).encode(self.http_head_encoding)
                     self.log("try to send response head", http_head)
+                    # if application intent to reset header start response will raise exception
+                    self.headers_sent = True
                     await self.request.write(http_head)
-                    # del such buffer, if application intent to reset header will raise exception in start response
-                    del self.response_head_buffer
+                    self.response_headers = None
                 self.log("try to send to", data)
+                self.bytes_sent += len(data)
                 return await self.request.write(data)
 
         async def write_itr(self, itr):
@@ -341,7 +445,29 @@ def makeWSGIhandler(wsgi_app):
                 for chunk in itr:
                     await self.write(chunk)
             finally:
-                itr.close()
+                # PEP 3333: the iterable may not have a close()
+                if hasattr(itr, "close"):
+                    itr.close()
+
+        # this could be called more than once
+        def start_response(self, status, response_headers, exc_info = None):
+            headers = dict([(key.capitalize(), value) for key, value in response_headers])
+            # one request per connection: the client closes once it has the Content-Length bytes, before our FIN
+            headers["Connection"] = "close"
+            self.request.delimited = 'Content-length' in headers
+            if 'Server' not in headers:
+                # A name for the server
+                headers['Server'] = self.request.server.version
+            if 'Date' not in headers:
+                # The date and time that the message was sent (in "HTTP-date" format as defined by RFC 7231
+                headers['Date'] = formatdate(timeval=None, localtime=False, usegmt=True)
+            if self.headers_sent:
+                raise RuntimeError("the response headers have already been sent")
+            self.response_status = f"{self.request_version} {status}\r\n"
+            self.status = status.split(" ", 1)[0]
+            self.response_headers = headers
+            exc_info = None  # Avoid circular
+            return self.bound_write
 
         async def run_wsgi(self, app):
             """
@@ -355,29 +481,7 @@ def makeWSGIhandler(wsgi_app):
             :return: None
             :rtype: None
             """
-
-            # this could be called more than once
-            def start_response(status, response_headers, exc_info = None):
-                headers = dict([(key.capitalize(), value) for key, value in response_headers])
-                if 'Content-length' not in headers:
-                    headers["Connection"] = "close"
-                if 'Server' not in headers:
-                    # A name for the server
-                    headers['Server'] = self.request.server.version
-                if 'Date' not in headers:
-                    # The date and time that the message was sent (in "HTTP-date" format as defined by RFC 7231
-                    headers['Date'] = formatdate(timeval=None, localtime=False, usegmt=True)
-                # will raise exception if try reset headers after it has already been sent
-                self.response_head_buffer["status"] = f"{self.request_version} {status}\r\n"
-                self.response_head_buffer["headers"] = headers
-                exc_info = None  # Avoid circular
-                return self.write
-
-            async def execute(app):
-                self.environ = self.make_environ()
-                app_itr = app(self.environ, start_response)
-                await self.write_itr(app_itr)
-
-            await execute(app)
+            self.environ = self.make_environ()
+            await self.write_itr(app(self.environ, self.bound_start_response))
 
     return WSGIRequestHandler
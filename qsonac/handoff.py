@@ -0,0 +1,155 @@
+# coding=utf-8
+
+import array
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+# environment variable telling a re-executed server where to fetch its listening sockets from
+HANDOFF_ENV = "QSONAC_HANDOFF"
+
+READY = b"ready"
+
+logger = logging.getLogger("qsonac.server")
+
+
+# region <SCM_RIGHTS>
+
+def send_sockets(channel: socket.socket, socks):
+    """
+    Pass the file descriptors of socks over the unix socket channel (SCM_RIGHTS),
+    the payload carries their address family so the receiver can rebuild them.
+    """
+    fds = array.array("i", [sock.fileno() for sock in socks])
+    payload = ",".join(str(int(sock.family)) for sock in socks).encode("ascii")
+    channel.sendmsg([payload], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+
+def recv_sockets(channel: socket.socket, maxfds = 16):
+    fds = array.array("i")
+    payload, ancdata, flags, addr = channel.recvmsg(1024, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            # Append data, ignoring any truncated integers at the end.
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    families = [int(family) for family in payload.decode("ascii").split(",") if family]
+    socks = []
+    for fd, family in zip(fds, families):
+        sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+        os.close(fd)  # fromfd() made a dup
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+# endregion
+
+
+class ListenSocketHandoff:
+    """
+        Zero-downtime re-exec, old process side.
+
+        start -> spawn -> SEND -> ACK -> drain -> end
+
+        The current command line is executed again with HANDOFF_ENV pointing to a unix socket,
+        the new process connects to it and receives the listening sockets through SCM_RIGHTS.
+        Once it acknowledges that it is accepting, this process drains gracefully.
+        The listening sockets are open in at least one process all along, so their backlog is never
+        closed and no connection is refused during the release.
+    """
+
+    # seconds the new process has to acknowledge before the handoff is abandoned
+    timeout = 30
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = server.loop
+        self.path = os.path.join(tempfile.gettempdir(), "qsonac-handoff-%d.sock" % os.getpid())
+        self.channel = None
+        self.conn = None
+        self.process = None
+        self._timer = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.channel.bind(self.path)
+        self.channel.listen(1)
+        self.channel.setblocking(False)
+        self.loop.add_reader(self.channel, self.on_connect)
+        self._timer = self.loop.call_later(self.timeout, self.abandon, "timed out")
+        env = dict(os.environ)
+        env[HANDOFF_ENV] = self.path
+        self.process = subprocess.Popen([sys.executable] + sys.argv, env=env)
+        logger.info("re-executed as pid %d, waiting for handoff", self.process.pid)
+        return self.process
+
+    def on_connect(self):
+        try:
+            self.conn, _ = self.channel.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        self.loop.remove_reader(self.channel)
+        send_sockets(self.conn, self.server.listeners)
+        self.conn.setblocking(False)
+        self.loop.add_reader(self.conn, self.on_ack)
+
+    def on_ack(self):
+        try:
+            data = self.conn.recv(len(READY))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            data = e
+        if data != READY:
+            self.abandon("new process failed: %r" % (data,))
+            return
+        self.cleanup()
+        # the new process is accepting, and owns the unix socket files now
+        self.server.unix_sockets = []
+        # leave the stage
+        self.loop.create_task(self.server.shutdown())
+
+    def abandon(self, reason):
+        logger.warning("handoff abandoned, keep serving: %s", reason)
+        self.cleanup()
+
+    def cleanup(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        for sock in (self.channel, self.conn):
+            if sock is not None:
+                self.loop.remove_reader(sock)
+                sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ListenSocketReceiver:
+    """
+        Zero-downtime re-exec, new process side: fetch the listening sockets
+        and acknowledge once they are served by our loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.channel = None
+
+    @classmethod
+    def from_environ(cls):
+        path = os.environ.pop(HANDOFF_ENV, None)
+        return cls(path) if path else None
+
+    def receive(self):
+        self.channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.channel.connect(self.path)
+        return recv_sockets(self.channel)
+
+    def acknowledge(self):
+        try:
+            self.channel.sendall(READY)
+        finally:
+            self.channel.close()
@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import time
+
+
+class ConcurrencyLimiter:
+    """
+        Adaptive limit of the requests in flight on one event loop (AIMD driven by latency and loop lag).
+
+        Two signals tell the loop is overloaded:
+        * the request latency: its moving average compared to the no-load latency (the lowest seen,
+          slowly forgotten), going over `tolerance` times the no-load latency (and at least `slack` seconds
+          above it, sub-millisecond handlers jitter a lot) means requests queue up
+        * the loop lag: how late a timer runs on the loop, probed every `lag_interval` seconds once
+          start_lag_probe() is called, over `max_lag` the loop is saturated whatever the latency of the application
+
+        Every `window` seconds the limit is cut by `backoff` when overloaded, otherwise it grows
+        by one if the current limit was actually reached during the window.
+        A request over the limit should be answered right away (503) instead of queued.
+    """
+
+    def __init__(self, initial_limit = 64, min_limit = 4, max_limit = 1024, tolerance = 2.0, slack = 0.005, max_lag = 0.05,
+                 backoff = 0.9, window = 0.1, smoothing = 0.1, lag_interval = 0.05):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.slack = slack
+        self.max_lag = max_lag
+        self.backoff = backoff
+        self.window = window
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.shed = 0
+        self.latency = None  # moving average
+        self.no_load_latency = None
+        self.lag = 0.0  # moving average
+        self.lag_interval = lag_interval
+        self._probe = None  # (loop, timer handle, time it is due)
+        self._peak = 0  # in flight during the window
+        self._window_end = time.monotonic() + window
+
+    def try_acquire(self):
+        if self.in_flight >= int(self.limit):
+            self.shed += 1
+            self.update()
+            return False
+        self.in_flight += 1
+        if self.in_flight > self._peak:
+            self._peak = self.in_flight
+        return True
+
+    def release(self, latency):
+        self.in_flight -= 1
+        if self.latency is None:
+            self.latency = self.no_load_latency = latency
+        else:
+            self.latency += (latency - self.latency) * self.smoothing
+            if latency < self.no_load_latency:
+                self.no_load_latency = latency
+            else:
+                # forget slowly, the application may have become slower for good
+                self.no_load_latency += (latency - self.no_load_latency) * self.smoothing * 0.01
+        self.update()
+
+    def observe_lag(self, lag):
+        self.lag += (lag - self.lag) * self.smoothing
+
+    def start_lag_probe(self, loop):
+        """ to be called from the thread of loop """
+        if self._probe is None:
+            due = loop.time() + self.lag_interval
+            self._probe = (loop, loop.call_at(due, self._probe_lag), due)
+
+    def stop_lag_probe(self):
+        if self._probe is not None:
+            self._probe[1].cancel()
+            self._probe = None
+
+    def _probe_lag(self):
+        loop, _, due = self._probe
+        now = loop.time()
+        # the callbacks and the I/O which ran before this timer since it was due
+        self.observe_lag(now - due)
+        self.update()
+        due = now + self.lag_interval
+        self._probe = (loop, loop.call_at(due, self._probe_lag), due)
+
+    @property
+    def overloaded(self):
+        if self.lag > self.max_lag:
+            return True
+        latency, no_load = self.latency, self.no_load_latency
+        return latency is not None and latency > no_load * self.tolerance and latency > no_load + self.slack
+
+    def update(self, now = None):
+        now = time.monotonic() if now is None else now
+        if now < self._window_end:
+            return
+        if self.overloaded:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif self._peak >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1)
+        self._peak = self.in_flight
+        self._window_end = now + self.window
@@ -0,0 +1,281 @@
+# coding=utf-8
+
+import errno
+import grp
+import logging
+import os
+import socket
+import stat
+
+# first descriptor passed by the service manager, see sd_listen_fds(3)
+LISTEN_FDS_START = 3
+
+UNIX_PREFIX = "unix:"
+
+logger = logging.getLogger("qsonac.server")
+
+
+# region <addresses>
+
+def parse_address(address):
+    """
+    An address as the listeners take it: a (host, port) tuple or a "unix:/path" string,
+    from a tuple, "host:port", "[ipv6 host]:port" or "unix:/path".
+    """
+    if isinstance(address, tuple) or address.startswith(UNIX_PREFIX):
+        return address
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def is_unix(address):
+    return isinstance(address, str)
+
+
+def unix_path(address):
+    return address[len(UNIX_PREFIX):]
+
+
+def family_of(address):
+    if is_unix(address):
+        return socket.AF_UNIX
+    return socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+
+
+def describe(address):
+    if is_unix(address):
+        return address
+    host, port = address[:2]
+    return "http://%s:%s" % ("[%s]" % host if ":" in host else host, port)
+
+# endregion
+
+
+# region <binding>
+
+def create_socket(address, reuse_port = False):
+    family = family_of(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family != socket.AF_UNIX:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+        if reuse_port and hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+    if family == socket.AF_INET6 and hasattr(socket, "IPV6_V6ONLY"):
+        # dual-stack: "::" accepts the IPv4 clients too, as ::ffff:a.b.c.d
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, False)
+    sock.setblocking(False)
+    return sock
+
+
+def bind(sock, address, mode = None, group = None):
+    """
+    Bind sock to address, a unix socket file gets the permission `mode` and the `group` (name or gid),
+    before listen() no client can connect through the default permissions.
+    """
+    if not is_unix(address):
+        sock.bind(address)
+        return
+    path = unix_path(address)
+    remove_stale(path)
+    sock.bind(path)
+    if group is not None:
+        if isinstance(group, str):
+            group = grp.getgrnam(group).gr_gid
+        os.chown(path, -1, group)
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+def remove_stale(path):
+    """ unlink the socket file left by a dead server, refuse to take over the one of a live server """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(errno.EADDRINUSE, "%s exists and is not a socket" % path)
+    except FileNotFoundError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+    else:
+        raise OSError(errno.EADDRINUSE, "%s is used by another server" % path)
+    finally:
+        probe.close()
+
+
+def open_listener(address, backlog = 128, reuse_port = False, mode = None, group = None, options = None):
+    """ a non blocking socket listening on address, with the SocketOptions `options` if it is TCP """
+    sock = create_socket(address, reuse_port)
+    try:
+        if options is not None and sock.family != socket.AF_UNIX:
+            logger.info("socket options of %s: %s", describe(address), options.apply(sock))
+        bind(sock, address, mode, group)
+        sock.listen(backlog)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def unlink(sock):
+    """ remove the file of a unix socket bound by this process """
+    path = sock.getsockname() if sock.family == socket.AF_UNIX and sock.fileno() != -1 else None
+    if path and isinstance(path, str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+# endregion
+
+
+# region <socket options>
+
+class SocketOptions:
+    """
+        Kernel options of the listening and the accepted TCP sockets, the kernel defaults unless given.
+
+        * defer_accept: seconds, TCP_DEFER_ACCEPT, accept() only returns a connection once its first bytes
+          are there, the loop is not woken up for connections which have nothing to read yet
+        * fastopen: queue length of TCP_FASTOPEN, the request of a returning client rides in its SYN
+        * rcvbuf, sndbuf: bytes of SO_RCVBUF and SO_SNDBUF, set before listen() for the window scale to fit them
+        * keepalive: (idle, interval, count) seconds and probes, SO_KEEPALIVE and TCP_KEEPIDLE, TCP_KEEPINTVL, TCP_KEEPCNT
+        * quickack: TCP_QUICKACK on the accepted sockets, the request is acked without waiting for the delayed ack
+        * cork: TCP_CORK on the accepted sockets, the response head and body leave in full segments and the last one
+          when the connection uncorks once the response is flushed, not for streamed responses
+        * nodelay: TCP_NODELAY on the accepted sockets
+
+        The options of a listening socket are inherited by its accepted sockets (buffers and keepalive on Linux),
+        only quickack, cork and nodelay cost a syscall per connection. apply() tries every option once and reports
+        what the kernel made of them, the accepted socket options it refuses are not tried again.
+    """
+
+    def __init__(self, defer_accept = None, fastopen = None, rcvbuf = None, sndbuf = None, keepalive = None, quickack = False,
+                 cork = False, nodelay = True):
+        for name, value in (("defer_accept", defer_accept), ("fastopen", fastopen), ("rcvbuf", rcvbuf), ("sndbuf", sndbuf)):
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                raise ValueError("%s must be a positive number, not %r" % (name, value))
+        if keepalive is not None and (len(keepalive) != 3 or not all(isinstance(value, int) and value > 0 for value in keepalive)):
+            raise ValueError("keepalive must be (idle, interval, count), not %r" % (keepalive,))
+        # name -> [(level, socket module constant, value)], set on the listening sockets
+        self.listener_options = { }
+        if defer_accept:
+            self.listener_options["defer_accept"] = [(socket.IPPROTO_TCP, "TCP_DEFER_ACCEPT", defer_accept)]
+        if fastopen:
+            self.listener_options["fastopen"] = [(socket.IPPROTO_TCP, "TCP_FASTOPEN", fastopen)]
+        if rcvbuf:
+            self.listener_options["rcvbuf"] = [(socket.SOL_SOCKET, "SO_RCVBUF", rcvbuf)]
+        if sndbuf:
+            self.listener_options["sndbuf"] = [(socket.SOL_SOCKET, "SO_SNDBUF", sndbuf)]
+        if keepalive:
+            self.listener_options["keepalive"] = [(socket.SOL_SOCKET, "SO_KEEPALIVE", 1)] + [
+                (socket.IPPROTO_TCP, option, value) for option, value in zip(("TCP_KEEPIDLE", "TCP_KEEPINTVL", "TCP_KEEPCNT"), keepalive)]
+        # and on every accepted socket
+        self.connection_options = { name: [(socket.IPPROTO_TCP, option, 1)]
+                                    for name, option, enabled in (("nodelay", "TCP_NODELAY", nodelay), ("quickack", "TCP_QUICKACK", quickack),
+                                                                  ("cork", "TCP_CORK", cork)) if enabled }
+        # (level, option, value) of the accepted socket options the kernel took
+        self._connection_calls = None
+
+    def apply(self, sock):
+        """ set the options of a TCP listening socket, try the ones of the accepted sockets, the report of what the kernel took """
+        refused = self._set(sock, self.listener_options)
+        probe = socket.socket(sock.family, socket.SOCK_STREAM)
+        try:
+            refused_per_connection = self._set(probe, self.connection_options)
+        finally:
+            probe.close()
+        self._connection_calls = [(level, getattr(socket, option), value) for name, calls in self.connection_options.items()
+                                  if name not in refused_per_connection for level, option, value in calls]
+        refused.update(refused_per_connection)
+        report = []
+        for name, calls in list(self.listener_options.items()) + list(self.connection_options.items()):
+            if name in refused:
+                report.append("%s refused (%s)" % (name, refused[name]))
+            elif name in ("defer_accept", "rcvbuf", "sndbuf"):
+                # rounded to retransmissions, doubled for the kernel bookkeeping, capped by net.core.[rw]mem_max
+                level, option, value = calls[0]
+                report.append("%s=%d (asked %d)" % (name, sock.getsockopt(level, getattr(socket, option)), value))
+            elif name == "fastopen":
+                report.append("fastopen=%d" % calls[0][2] if fastopen_enabled() else "fastopen set but net.ipv4.tcp_fastopen does not enable it for servers")
+            elif name == "keepalive":
+                report.append("keepalive=%d/%d/%d" % tuple(value for level, option, value in calls[1:]))
+            else:
+                report.append(name)
+        return ", ".join(report) or "kernel defaults"
+
+    def apply_connection(self, sock):
+        if self._connection_calls is None:
+            # no listening socket went through apply()
+            self._connection_calls = [(level, getattr(socket, option), value) for calls in self.connection_options.values()
+                                      for level, option, value in calls if hasattr(socket, option)]
+        for level, option, value in self._connection_calls:
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _set(sock, options):
+        """ {name: reason} of the options the kernel refused """
+        refused = { }
+        for name, calls in options.items():
+            for level, option, value in calls:
+                if not hasattr(socket, option):
+                    refused[name] = "no %s here" % option
+                    break
+                try:
+                    sock.setsockopt(level, getattr(socket, option), value)
+                except OSError as e:
+                    refused[name] = "%s: %s" % (option, e.strerror)
+                    break
+        return refused
+
+
+def fastopen_enabled():
+    """ whether the kernel answers TCP_FASTOPEN requests of the clients, bit 2 of net.ipv4.tcp_fastopen """
+    try:
+        with open("/proc/sys/net/ipv4/tcp_fastopen") as f:
+            return bool(int(f.read()) & 2)
+    except (OSError, ValueError):
+        return True  # not Linux, nothing to tell
+
+# endregion
+
+
+# region <socket activation>
+
+def adopt_fd(fd):
+    """ the socket of an inherited listening descriptor, of whatever family """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0, fd)
+    # python 3.6 does not detect the family of a descriptor
+    family = probe.getsockopt(socket.SOL_SOCKET, socket.SO_DOMAIN)
+    sock = socket.socket(family, socket.SOCK_STREAM, 0, probe.detach())
+    sock.setblocking(False)
+    return sock
+
+
+def listen_fds(unset_environment = True):
+    """
+    Listening sockets passed by a service manager (systemd socket activation, the LISTEN_FDS protocol):
+    the descriptors 3 to 3 + $LISTEN_FDS - 1, when $LISTEN_PID is this process.
+    """
+    try:
+        pid = int(os.environ.get("LISTEN_PID", ""))
+        count = int(os.environ.get("LISTEN_FDS", ""))
+    except ValueError:
+        return []
+    if unset_environment:
+        # not for the processes we start
+        for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+            os.environ.pop(name, None)
+    if pid != os.getpid():
+        return []
+    socks = []
+    for fd in range(LISTEN_FDS_START, LISTEN_FDS_START + count):
+        os.set_inheritable(fd, False)
+        socks.append(adopt_fd(fd))
+    return socks
+
+# endregion
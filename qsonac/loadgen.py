@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+HTTP load generator, one process, asyncio, meant for 127.0.0.1.
+
+    python -m qsonac.loadgen --port 48539 -c 50 -d 10                 # closed loop
+    python -m qsonac.loadgen --port 48539 -c 50 -d 10 --rate 5000     # open loop, fixed rate
+    python -m qsonac.loadgen --port 48539 --requests reqs.jsonl --pipeline 4 --json
+
+Closed loop: every connection sends its next request as soon as the previous response arrived.
+Open loop: requests are issued at a fixed rate whatever the server does, a request waits
+for a free connection when they are all busy.
+
+Latency percentiles are corrected for the coordinated omission: in open loop a latency is measured
+from the time the request was due, not from the time it could be sent; in closed loop the requests
+a slow response kept us from sending are added back (as HdrHistogram does) with the mean latency as
+the expected interval. The raw service time is reported too.
+
+The requests file holds one JSON object per line:
+    {"method": "POST", "path": "/api", "headers": {"Content-Type": "application/json"}, "body": "{}"}
+every field is optional, the lines are sent round robin.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+
+from qsonac.metrics import Registry
+
+_Pending = collections.namedtuple("_Pending", "due sent raw")
+
+
+def build_request(host, port, method = "GET", path = "/", headers = None, body = "", keepalive = True):
+    body = body.encode("utf-8") if isinstance(body, str) else (body or b"")
+    lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s:%d" % (host, port)]
+    for name, value in (headers or { }).items():
+        lines.append("%s: %s" % (name, value))
+    if body or method in ("POST", "PUT", "PATCH"):
+        lines.append("Content-Length: %d" % len(body))
+    lines.append("Connection: %s" % ("keep-alive" if keepalive else "close"))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + body
+
+
+def load_requests(path, host, port, keepalive = True):
+    requests = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                spec = json.loads(line)
+                requests.append(build_request(host, port, spec.get("method", "GET"), spec.get("path", "/"),
+                                              spec.get("headers"), spec.get("body", ""), keepalive))
+    if not requests:
+        raise ValueError("no request in %s" % path)
+    return requests
+
+
+async def read_response(reader):
+    """ Read one response, return (status, the server closes the connection after it) """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("iso-8859-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = { }
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    close = headers.get("connection", "").lower() == "close"
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif status >= 200 and status not in (204, 304):
+        # delimited by the end of the connection
+        await reader.read()
+        close = True
+    return status, close
+
+
+def corrected(histogram, interval):
+    """
+    Coordinated omission correction of a closed loop histogram (HdrHistogram's copyCorrectedForCoordinatedOmission):
+    a response taking L seconds while one was expected every `interval` seconds hid the requests that
+    would have been sent meanwhile, they are added back with the latencies L - interval, L - 2 * interval, ...
+    The latencies of a bucket are taken at its middle: its upper bound is the lower bound of the next one,
+    where record() would count them.
+    """
+    if interval <= 0:
+        return histogram
+    result = Registry().histogram(histogram.name, sub_buckets=histogram.sub_buckets)
+    for index, count in enumerate(histogram.bucket_counts()):
+        if not count:
+            continue
+        lower = histogram.upper_bound(index - 1) if index else 0.0
+        # the last bucket has no upper bound, its lower one is inside it
+        value = (lower + histogram.upper_bound(index)) / 2 if index < histogram.size - 1 else lower
+        result.record(value, count)
+        missing = value - interval
+        while missing >= interval:
+            result.record(missing, count)
+            missing -= interval
+    return result
+
+
+class LoadGenerator:
+    def __init__(self, host = "127.0.0.1", port = 48539, requests = None, connections = 10, duration = 10.0, rate = None,
+                 keepalive = True, pipeline = 1, timeout = 10.0, loop = None):
+        self.host = host
+        self.port = port
+        self.requests = requests or [build_request(host, port, keepalive=keepalive)]
+        self._next_request = itertools.cycle(self.requests).__next__
+        self.connections = connections
+        self.duration = duration
+        self.rate = rate
+        self.keepalive = keepalive
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.loop = loop or asyncio.get_event_loop()
+        registry = Registry()
+        # latency from the time the request was due / service time from the time it was written
+        self.latency = registry.histogram("latency", sub_buckets=16)
+        self.service_time = registry.histogram("service_time", sub_buckets=16)
+        self.max_latency = 0.0
+        self.statuses = collections.Counter()
+        self.errors = collections.Counter()
+        self.connects = 0
+        self._queue = None
+        self._end = None
+        self.elapsed = None
+
+    # region <request sources>
+
+    async def _generate(self):
+        """ open loop: put the requests in the queue at their due time """
+        interval = 1.0 / self.rate
+        start = self.loop.time()
+        for i in itertools.count():
+            due = start + i * interval
+            if due >= self._end:
+                break
+            delay = due - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._queue.put_nowait((due, self._next_request()))
+        for _ in range(self.connections):
+            self._queue.put_nowait(None)
+
+    async def _take(self, wait):
+        """ next (due time, request), None when none is available (without wait) or the run is over """
+        if self._queue is None:
+            now = self.loop.time()
+            return (now, self._next_request()) if now < self._end else None
+        if wait:
+            item = await self._queue.get()
+            if item is None:
+                self._queue.put_nowait(None)  # let the other idle workers see it too
+            return item
+        if self._queue.empty():
+            return None
+        item = self._queue.get_nowait()
+        if item is None:
+            self._queue.put_nowait(None)
+        return item
+
+    # endregion
+
+    async def _worker(self):
+        reader = writer = None
+        pending = collections.deque()
+        retry = collections.deque()
+        while True:
+            # fill the pipeline
+            while len(pending) < self.pipeline:
+                if retry:
+                    due, raw = retry.popleft()
+                else:
+                    item = await self._take(wait=not pending)
+                    if item is None:
+                        break
+                    due, raw = item
+                if writer is None:
+                    try:
+                        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                        self.connects += 1
+                    except (OSError, asyncio.TimeoutError) as e:
+                        self.errors[type(e).__name__] += 1
+                        await asyncio.sleep(0.01)
+                        continue
+                writer.write(raw)
+                pending.append(_Pending(due, self.loop.time(), raw))
+            if not pending:
+                break
+            try:
+                await writer.drain()
+                status, close = await asyncio.wait_for(read_response(reader), self.timeout)
+            except (OSError, EOFError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                self.errors[type(e).__name__] += 1
+                pending.popleft()
+                retry.extend((request.due, request.raw) for request in pending)
+                pending.clear()
+                writer.close()
+                reader = writer = None
+                continue
+            now = self.loop.time()
+            request = pending.popleft()
+            self.latency.observe(now - request.due)
+            self.service_time.observe(now - request.sent)
+            self.max_latency = max(self.max_latency, now - request.due)
+            self.statuses[status] += 1
+            if close or not self.keepalive:
+                # the pipelined requests after it were never answered, send them again on a new connection
+                retry.extend((request.due, request.raw) for request in pending)
+                pending.clear()
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    async def run(self):
+        start = self.loop.time()
+        self._end = start + self.duration
+        tasks = []
+        if self.rate:
+            self._queue = asyncio.Queue()
+            tasks.append(self.loop.create_task(self._generate()))
+        tasks.extend(self.loop.create_task(self._worker()) for _ in range(self.connections))
+        await asyncio.gather(*tasks)
+        self.elapsed = self.loop.time() - start
+        return self.report()
+
+    def report(self):
+        completed = sum(self.statuses.values())
+        latency = self.latency
+        if not self.rate and completed:
+            latency = corrected(self.latency, self.latency.sum / completed)
+        return {
+            "mode"        : "open" if self.rate else "closed",
+            "connections" : self.connections,
+            "pipeline"    : self.pipeline,
+            "keepalive"   : self.keepalive,
+            "target_rate" : self.rate,
+            "duration"    : self.elapsed,
+            "completed"   : completed,
+            "rate"        : completed / self.elapsed if self.elapsed else 0.0,
+            "connects"    : self.connects,
+            "statuses"    : { str(status): count for status, count in sorted(self.statuses.items()) },
+            "errors"      : dict(self.errors),
+            # a bucket bound past the slowest response is not a latency anybody saw
+            "latency"     : { "p50": min(latency.percentile(50), self.max_latency), "p90": min(latency.percentile(90), self.max_latency),
+                              "p99": min(latency.percentile(99), self.max_latency), "p999": min(latency.percentile(99.9), self.max_latency),
+                              "max": self.max_latency },
+            "service_time": { "p50": self.service_time.percentile(50), "p99": self.service_time.percentile(99),
+                              "p999": self.service_time.percentile(99.9) },
+        }
+
+
+def format_report(report):
+    lines = [
+        "%(mode)s loop, %(connections)d connections, pipeline %(pipeline)d, keep-alive %(keepalive)s" % report,
+        "  %d requests in %.2fs, %.1f req/s, %d connects" % (report["completed"], report["duration"], report["rate"], report["connects"]),
+        "  statuses: %s" % (", ".join("%s=%d" % item for item in report["statuses"].items()) or "-"),
+        "  errors: %s" % (", ".join("%s=%d" % item for item in report["errors"].items()) or "-"),
+        "  latency (corrected)  p50 %s  p90 %s  p99 %s  p99.9 %s  max %s" % tuple(
+            _ms(report["latency"][key]) for key in ("p50", "p90", "p99", "p999", "max")),
+        "  service time         p50 %s  p99 %s  p99.9 %s" % tuple(_ms(report["service_time"][key]) for key in ("p50", "p99", "p999")),
+    ]
+    return "\n".join(lines)
+
+
+def _ms(seconds):
+    return "%.3fms" % (seconds * 1000)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m qsonac.loadgen", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=48539, help="default: Config.port of example.py")
+    parser.add_argument("-c", "--connections", type=int, default=10)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--rate", type=float, default=None, help="requests per second, open loop; closed loop if not set")
+    parser.add_argument("--pipeline", type=int, default=1, help="requests in flight per connection")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false", help="one request per connection")
+    parser.add_argument("--requests", help="JSONL file of the requests to send")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.requests:
+        requests = load_requests(args.requests, args.host, args.port, args.keepalive)
+    else:
+        requests = [build_request(args.host, args.port, path=args.path, keepalive=args.keepalive)]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        generator = LoadGenerator(args.host, args.port, requests, args.connections, args.duration, args.rate,
+                                  args.keepalive, args.pipeline, args.timeout, loop)
+        report = loop.run_until_complete(generator.run())
+    finally:
+        loop.close()
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return report
+
+
+if __name__ == "__main__":
+    main()
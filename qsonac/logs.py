@@ -0,0 +1,191 @@
+# coding=utf-8
+
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+import weakref
+from email.utils import formatdate
+
+logger = logging.getLogger("qsonac")
+
+# classes whose `log` method is on the hot path, see traced(), not kept alive for it (one handler class per makeWSGIhandler())
+_traced = weakref.WeakSet()
+_debug = False
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def traced(cls):
+    """
+    Class decorator for the per request/connection traces.
+
+    cls.log stays a no-op, so a disabled trace costs one empty call, no formatting,
+    no current task lookup, until set_debug(True) swaps in cls.debug_log.
+    """
+    _traced.add(cls)
+    cls.log = cls.__dict__["debug_log"] if _debug else staticmethod(_noop)
+    return cls
+
+
+def set_debug(enabled = True):
+    global _debug
+    _debug = enabled
+    for cls in _traced:
+        cls.log = cls.__dict__["debug_log"] if enabled else staticmethod(_noop)
+    if enabled:
+        logger.setLevel(logging.DEBUG)
+
+
+def configure(debug = False, stream = None):
+    """ Log qsonac's messages to stream (stderr), INFO and above unless debug is set """
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    set_debug(debug)
+
+
+class AccessLog:
+    """
+        Access log written in batches by a background thread.
+
+        record() never blocks the event loop: the entry is appended to a bounded queue,
+        or dropped when the queue is full or more than `sample_per_second` entries were
+        already taken during the current second. Dropped entries are counted.
+        The writer thread formats and writes everything queued every `flush_interval` seconds.
+    """
+
+    def __init__(self, stream = None, max_queue = 10000, sample_per_second = None, flush_interval = 0.5):
+        # the file we open, and close once stopped, given a path
+        self.path = stream if isinstance(stream, str) else None
+        if self.path is not None:
+            stream = self._open()
+        self.stream = stream or sys.stdout
+        self.max_queue = max_queue
+        self.sample_per_second = sample_per_second
+        self.flush_interval = flush_interval
+        self.queue = collections.deque()
+        self.dropped = 0
+        self._second = 0
+        self._taken = 0
+        self._stopped = threading.Event()
+        self._writer = None
+
+    def _open(self):
+        return open(self.path, "a", buffering=1 << 16)
+
+    def start(self):
+        if self._writer is None:
+            if self.path is not None and self.stream.closed:
+                self.stream = self._open()
+            self._stopped.clear()
+            self._writer = threading.Thread(target=self._run, name="qsonac-access-log", daemon=True)
+            self._writer.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        self.flush()
+        if self.path is not None:
+            self.stream.close()
+
+    def admit(self):
+        """ False when the entry has to be dropped, the sampling budget is spent or the queue is full """
+        if self.sample_per_second is not None:
+            second = int(time.time())
+            if second != self._second:
+                self._second = second
+                self._taken = 0
+            if self._taken >= self.sample_per_second:
+                self.dropped += 1
+                return False
+            self._taken += 1
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return False
+        return True
+
+    def record(self, remote_addr, method, path, protocol, status, size, duration):
+        if self.admit():
+            # formatting is left to the writer thread
+            self.queue.append((time.time(), remote_addr, method, path, protocol, status, size, duration))
+
+    @staticmethod
+    def format(entry):
+        timestamp, remote_addr, method, path, protocol, status, size, duration = entry
+        return '%s - - [%s] "%s %s %s" %s %d %.6f\n' % (remote_addr, formatdate(timestamp, usegmt=True), method, path, protocol, status, size, duration)
+
+    def flush(self):
+        lines = []
+        queue = self.queue
+        while queue:
+            lines.append(self.format(queue.popleft()))
+        if lines:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("access log writer failed")
+
+
+class TrafficCapture(AccessLog):
+    """
+        Capture of the served requests, one JSON object per line, to be replayed by qsonac.replay:
+
+        {"time": 1760870000.5123, "offset": 0.0123, "method": "POST", "path": "/api?x=1", "headers": {...}, "body_length": 42, "body": "name=a&",
+         "status": 200, "bytes": 17, "latency": 0.00042}
+
+        time is the arrival time of the request (epoch), offset the same from the start of the capture:
+        the prefork workers each write their own entries, replay by time when merging their captures.
+        body holds the first `body_sample` bytes of the body (as latin-1 text) which came along the head, if any.
+        The entries are written in completion order, not arrival order.
+        Same queue, sampling and writer thread as the access log.
+    """
+
+    def __init__(self, stream = None, body_sample = 0, max_queue = 10000, sample_per_second = None, flush_interval = 0.5):
+        super().__init__(stream, max_queue, sample_per_second, flush_interval)
+        self.body_sample = body_sample
+        self.started = time.time()
+
+    def record(self, method, path, headers, body, status, size, latency):
+        if self.admit():
+            # arrival = now - latency, both measured when the response is done
+            arrival = time.time() - latency
+            self.queue.append((arrival, arrival - self.started, method, path, headers, body, status, size, latency))
+
+    @staticmethod
+    def format(entry):
+        arrival, offset, method, path, headers, body, status, size, latency = entry
+        # no headers when the head never arrived in full (408)
+        headers = { name.strip(): value.strip() for name, value in (headers or { }).items() if name.strip() }
+        body_length = 0
+        for name, value in headers.items():
+            if name.lower() == "content-length" and value.isdigit():
+                body_length = int(value)
+        line = {
+            "time"       : round(arrival, 6),
+            "offset"     : round(offset, 6),
+            "method"     : method,
+            "path"       : path,
+            "headers"    : headers,
+            "body_length": body_length,
+            "status"     : int(status) if status else None,
+            "bytes"      : size,
+            "latency"    : round(latency, 6),
+        }
+        if body:
+            line["body"] = body.decode("iso-8859-1")
+        return json.dumps(line) + "\n"
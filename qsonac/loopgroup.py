@@ -0,0 +1,64 @@
+# coding=utf-8
+
+import asyncio
+import threading
+
+
+class LoopThread(threading.Thread):
+    """
+        A thread owning one event loop and running it forever.
+
+        The loop is created up front so connections can be handed to it with call_soon_threadsafe()
+        as soon as the thread is started. Every StreamSock created on this loop stays bound to it.
+    """
+
+    def __init__(self, name = None):
+        super().__init__(name=name, daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class LoopGroup:
+    """
+        N event loops, each one running on its own thread, fed by a dedicated acceptor.
+        This is the single process alternative to prefork, for free-threaded builds
+        or when fork() is not allowed.
+    """
+
+    def __init__(self, size = 2):
+        self.threads = [LoopThread("qsonac-loop-%d" % i) for i in range(size)]
+
+    @property
+    def loops(self):
+        return [thread.loop for thread in self.threads]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        for thread in self.threads:
+            thread.started.wait()
+
+    def stop(self, timeout = None):
+        for thread in self.threads:
+            thread.stop()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,329 @@
+# coding=utf-8
+
+import math
+import mmap
+from array import array
+from math import frexp
+
+
+class Registry:
+    """
+        All the metrics of a process, stored in two flat arrays: one of unsigned counts
+        (counters, histogram buckets) and one of doubles (histogram sums).
+
+        A metric only keeps an offset into them, an update is an item assignment,
+        no object is allocated per sample. The arrays can be swapped for any other
+        buffer with the same layout (see bind()).
+    """
+
+    def __init__(self):
+        self.counts = array("Q")
+        self.sums = array("d")
+        self.metrics = []
+        self.gauges = []
+        # the StatsSegment we are attached to, render() then aggregates all its slots
+        self.segment = None
+
+    def _allocate(self, counts, sums = 0):
+        offsets = (len(self.counts), len(self.sums))
+        self.counts.extend([0] * counts)
+        self.sums.extend([0.0] * sums)
+        return offsets
+
+    def counter(self, name, help = ""):
+        metric = Counter(self, name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def counter_family(self, name, help, label, values):
+        metric = CounterFamily(self, name, help, label, values)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help = "", **kwargs):
+        metric = Histogram(self, name, help, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, func, type = "gauge"):
+        """ a value computed when scraped, type is the one advertised, e.g. counter for a total kept elsewhere """
+        self.gauges = [gauge for gauge in self.gauges if gauge[0] != name]
+        self.gauges.append((name, help, func, type))
+
+    def bind(self, counts, sums):
+        """ Point every metric to other storage with the same layout """
+        self.counts = counts
+        self.sums = sums
+        for metric in self.metrics:
+            for part in getattr(metric, "children", { }).values() or (metric,):
+                part._counts = counts
+                part._sums = sums
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        for i in range(len(self.sums)):
+            self.sums[i] = 0.0
+
+    def render(self, counts = None, sums = None):
+        """ Prometheus text exposition format, of the given storage, of all the workers or of our own """
+        if counts is None and self.segment is not None:
+            counts, sums = self.segment.aggregate()
+        counts = self.counts if counts is None else counts
+        sums = self.sums if sums is None else sums
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(counts, sums))
+        for name, help, func, type in self.gauges:
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, type))
+            lines.append("%s %s" % (name, func()))
+        lines.append("")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, registry, name, help = ""):
+        self.name = name
+        self.help = help
+        self._offset, _ = registry._allocate(1)
+        self._counts = registry.counts
+        self._sums = registry.sums
+
+    def inc(self, amount = 1):
+        self._counts[self._offset] += amount
+
+    @property
+    def value(self):
+        return self._counts[self._offset]
+
+    def render(self, counts, sums):
+        return [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s counter" % self.name,
+            "%s %d" % (self.name, counts[self._offset]),
+        ]
+
+
+class CounterFamily:
+    """ counters told apart by the value of one label, e.g. family["timeout"].inc(), rendered under one name """
+
+    def __init__(self, registry, name, help, label, values):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.children = { value: Counter(registry, name, help) for value in values }
+
+    def __getitem__(self, value):
+        return self.children[value]
+
+    def render(self, counts, sums):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s counter" % self.name,
+        ]
+        for value, counter in self.children.items():
+            lines.append('%s{%s="%s"} %d' % (self.name, self.label, value, counts[counter._offset]))
+        return lines
+
+
+class Histogram:
+    """
+        Log-linear histogram with fixed buckets.
+
+        Every power of two between 2 ** min_exp and 2 ** max_exp is split in `sub_buckets`
+        linear buckets, so the relative error is bounded by 1 / sub_buckets whatever the magnitude.
+        A bucket includes its lower bound, so a sample falling exactly on a bound is counted
+        one bucket higher than the `le` of the exposition format says, which only matters for made up values.
+        The first bucket takes everything below the range, the last one everything above.
+        The bucket of a sample is computed with frexp(), no search and no allocation.
+    """
+
+    def __init__(self, registry, name, help = "", min_exp = -20, max_exp = 6, sub_buckets = 4):
+        self.name = name
+        self.help = help
+        self.min_exp = min_exp
+        self.sub_buckets = sub_buckets
+        self.size = (max_exp - min_exp) * sub_buckets + 2
+        self._floor = 2.0 ** (min_exp - 1)
+        # bucket(v) = (exponent - min_exp) * sub_buckets + int((mantissa - 0.5) * 2 * sub_buckets) + 1, folded
+        self._scale = 2 * sub_buckets
+        self._base = 1 - sub_buckets - min_exp * sub_buckets
+        self._offset, self._sum_offset = registry._allocate(self.size, 1)
+        self._counts = registry.counts
+        self._sums = registry.sums
+
+    def bucket(self, value):
+        if value < self._floor:
+            return 0
+        mantissa, exponent = frexp(value)  # value = mantissa * 2 ** exponent, 0.5 <= mantissa < 1
+        index = exponent * self.sub_buckets + int(mantissa * self._scale) + self._base
+        return index if index < self.size else self.size - 1
+
+    def upper_bound(self, index):
+        if index == 0:
+            return self._floor
+        if index >= self.size - 1:
+            return math.inf
+        exponent, sub = divmod(index - 1, self.sub_buckets)
+        return math.ldexp(0.5 + (sub + 1) / (2.0 * self.sub_buckets), exponent + self.min_exp)
+
+    def observe(self, value):
+        # bucket() inlined, this is on the hot path
+        if value < self._floor:
+            index = 0
+        else:
+            mantissa, exponent = frexp(value)
+            index = exponent * self.sub_buckets + int(mantissa * self._scale) + self._base
+            if index >= self.size:
+                index = self.size - 1
+        self._counts[self._offset + index] += 1
+        self._sums[self._sum_offset] += value
+
+    def record(self, value, count = 1):
+        """ count samples of the same value at once """
+        self._counts[self._offset + self.bucket(value)] += count
+        self._sums[self._sum_offset] += value * count
+
+    # region <reading>
+
+    def bucket_counts(self, counts = None):
+        counts = self._counts if counts is None else counts
+        return counts[self._offset:self._offset + self.size]
+
+    @property
+    def count(self):
+        return sum(self.bucket_counts())
+
+    @property
+    def sum(self):
+        return self._sums[self._sum_offset]
+
+    def percentile(self, q, counts = None):
+        """ upper bound of the bucket holding the q-th percentile (0 < q <= 100) """
+        buckets = self.bucket_counts(counts)
+        total = sum(buckets)
+        if not total:
+            return 0.0
+        rank = total * q / 100.0
+        seen = 0
+        for index, count in enumerate(buckets):
+            seen += count
+            if seen >= rank:
+                return self.upper_bound(index)
+        return math.inf
+
+    def render(self, counts, sums):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s histogram" % self.name,
+        ]
+        cumulative = 0
+        for index, count in enumerate(self.bucket_counts(counts)):
+            cumulative += count
+            bound = self.upper_bound(index)
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, "+Inf" if bound == math.inf else "%.9g" % bound, cumulative))
+        lines.append("%s_sum %.9g" % (self.name, sums[self._sum_offset]))
+        lines.append("%s_count %d" % (self.name, cumulative))
+        return lines
+
+    # endregion
+
+
+class StatsSegment:
+    """
+        Storage of a Registry for all the workers of a prefork server, in one anonymous shared mmap
+        created before fork().
+
+        Slot i holds the counts then the sums of worker i, with the layout of the registry arrays:
+        the worker binds its registry to its slot (attach), an update stays one item store into memory
+        no other process writes, no lock. Any process reads all the slots to aggregate them.
+        The slots outlive the workers, the counters of a restarted worker go on from where its
+        predecessor stopped, the totals never go back. The gauges are computed by the scraped process only.
+    """
+
+    def __init__(self, registry, slots):
+        self.registry = registry
+        self.slots = slots
+        # fixed layout, the metrics registered afterwards have no room
+        self.count_size = len(registry.counts)
+        self.sum_size = len(registry.sums)
+        self.slot_size = 8 * (self.count_size + self.sum_size)
+        self.mm = mmap.mmap(-1, max(1, self.slot_size * slots))
+        self._view = memoryview(self.mm)
+
+    def slot(self, index):
+        """ (counts, sums) of slot index, memoryviews of the shared memory """
+        start = index * self.slot_size
+        middle = start + 8 * self.count_size
+        return self._view[start:middle].cast("Q"), self._view[middle:start + self.slot_size].cast("d")
+
+    def attach(self, index):
+        """ from now on the registry of this process writes into slot index """
+        if (len(self.registry.counts), len(self.registry.sums)) != (self.count_size, self.sum_size):
+            raise ValueError("metrics were registered after the stats segment was created")
+        self.registry.bind(*self.slot(index))
+        self.registry.segment = self
+
+    def aggregate(self):
+        """ (counts, sums) summed over all the slots """
+        counts = array("Q", bytes(8 * self.count_size))
+        sums = array("d", bytes(8 * self.sum_size))
+        for index in range(self.slots):
+            slot_counts, slot_sums = self.slot(index)
+            for i, value in enumerate(slot_counts):
+                if value:
+                    counts[i] += value
+            for i, value in enumerate(slot_sums):
+                sums[i] += value
+        return counts, sums
+
+    def value(self, counter, index):
+        """ value of a counter in slot index """
+        return self.slot(index)[0][counter._offset]
+
+
+# region <process metrics>
+
+REGISTRY = Registry()
+
+connections = REGISTRY.counter("qsonac_connections_total", "Accepted connections")
+accept_wakeups = REGISTRY.counter("qsonac_accept_wakeups_total", "Times a listening socket woke the acceptor up, connections_total / it is the accept batch")
+requests = REGISTRY.counter("qsonac_requests_total", "Requests handled")
+bytes_received = REGISTRY.counter("qsonac_received_bytes_total", "Bytes received from the clients")
+bytes_sent = REGISTRY.counter("qsonac_sent_bytes_total", "Bytes sent to the clients")
+write_pauses = REGISTRY.counter("qsonac_write_pauses_total", "Times a response waited for the socket to drain")
+shed_requests = REGISTRY.counter("qsonac_shed_requests_total", "Requests answered 503 by the concurrency limiter")
+stall_samples = REGISTRY.counter("qsonac_stall_samples_total", "Stack samples taken while the event loop was stuck")
+cache_hits = REGISTRY.counter("qsonac_cache_hits_total", "Responses served fresh from the response cache")
+cache_stale_hits = REGISTRY.counter("qsonac_cache_stale_hits_total", "Stale responses served while being revalidated")
+cache_misses = REGISTRY.counter("qsonac_cache_misses_total", "Responses produced by the application for the response cache")
+cache_coalesced = REGISTRY.counter("qsonac_cache_coalesced_total", "Misses which waited for a concurrent one instead of running the application")
+cache_evictions = REGISTRY.counter("qsonac_cache_evictions_total", "Responses evicted from the response cache to stay in its memory bound")
+# StreamSock and request handlers taken from the ObjectPool of their loop, or allocated because it was empty
+pool_acquires = REGISTRY.counter_family("qsonac_pool_acquires_total", "Connection objects reused from a pool or newly allocated", "outcome",
+                                        ("reused", "created"))
+# how the connections ended, see StreamSock.close
+connection_closes = REGISTRY.counter_family("qsonac_connection_closes_total", "Closed connections by the way they ended", "reason",
+                                            ("client", "lingering", "linger_timeout", "idle", "abort", "error"))
+# cyclic garbage collections by generation, timed only with GCTuning(pause_metrics=True), see qsonac.gctuning
+gc_collections = REGISTRY.counter_family("qsonac_gc_collections_total", "Garbage collections by generation", "generation", (0, 1, 2))
+
+accept_latency = REGISTRY.histogram("qsonac_accept_latency_seconds", "From accept() to the start of the connection handler")
+parse_latency = REGISTRY.histogram("qsonac_parse_latency_seconds", "Receiving and parsing the request head")
+app_latency = REGISTRY.histogram("qsonac_app_latency_seconds", "Running the wsgi application")
+drain_latency = REGISTRY.histogram("qsonac_drain_latency_seconds", "Waiting for the socket to drain the response")
+connection_duration = REGISTRY.histogram("qsonac_connection_duration_seconds", "Whole connection, from accept() to close")
+loop_lag = REGISTRY.histogram("qsonac_loop_lag_seconds", "How late the loop monitor heartbeat runs")
+gc_young_pause = REGISTRY.histogram("qsonac_gc_young_pause_seconds", "Garbage collections of the generations 0 and 1")
+gc_full_pause = REGISTRY.histogram("qsonac_gc_full_pause_seconds", "Full garbage collections, of the generation 2")
+
+# endregion
+
+
+def metrics_app(environ, start_response):
+    """ wsgi application exposing REGISTRY, in the Prometheus text format """
+    body = REGISTRY.render().encode("utf-8")
+    start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                              ("Content-Length", str(len(body)))])
+    return iter([body])
@@ -0,0 +1,149 @@
+# coding=utf-8
+
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+from qsonac import metrics
+
+logger = logging.getLogger("qsonac.monitor")
+
+
+class LoopMonitor:
+    """
+        Event loop lag monitor and stall sampler.
+
+        A heartbeat callback is scheduled every `interval` seconds, how late it runs is the loop lag,
+        recorded in metrics.loop_lag. A watchdog thread checks the time of the last heartbeat every
+        `sample_interval` seconds: when the loop has been stuck for more than `threshold` seconds,
+        it samples the stack of the loop thread until the loop gets back.
+
+        The samples are written to a rotating file in the collapsed stack format, one line per sample:
+
+            # <time> lag=<seconds> request=<id> <method> <path>
+            <thread>;<outermost frame>;...;<innermost frame> 1
+
+        the comment line tells which request was running, strip them (grep -v '^#')
+        before feeding the file to flamegraph.pl or speedscope.
+
+        Costs one timer callback per interval when the loop is healthy, nothing is sampled then.
+    """
+
+    def __init__(self, loop, interval = 0.05, threshold = 0.1, sample_interval = 0.01, path = None,
+                 max_bytes = 10 * 1024 * 1024, backup_count = 3):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        # defaults to qsonac-stalls-<pid>-<thread>.txt, one file per loop
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.samples = 0
+        self._thread_id = None
+        self._thread_name = None
+        self._handle = None
+        self._expected = None
+        self._last_beat = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._output = None
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self):
+        """ to be called from the loop thread """
+        if self.running:
+            return
+        thread = threading.current_thread()
+        self._thread_id = thread.ident
+        self._thread_name = thread.name
+        if self.path is None:
+            self.path = "qsonac-stalls-%d-%s.txt" % (os.getpid(), thread.name)
+        self._output = self._open_output()
+        self._last_beat = time.monotonic()
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._beat)
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="qsonac-loop-monitor", daemon=True)
+        self._watchdog.start()
+        logger.info("loop monitor started, stalls over %.3fs sampled to %s", self.threshold, self.path)
+
+    def stop(self):
+        """ to be called from the loop thread """
+        if not self.running:
+            return
+        self._handle.cancel()
+        self._handle = None
+        self._stopped.set()
+        self._watchdog.join()
+        self._watchdog = None
+        self._output.close()
+        self._output = None
+        logger.info("loop monitor stopped, %d stack samples taken", self.samples)
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _open_output(self):
+        output = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count)
+        output.setFormatter(logging.Formatter("%(message)s"))
+        return output
+
+    # region <loop side>
+
+    def _beat(self):
+        now = self.loop.time()
+        metrics.loop_lag.observe(max(now - self._expected, 0.0))
+        self._last_beat = time.monotonic()
+        self._expected = now + self.interval
+        self._handle = self.loop.call_at(self._expected, self._beat)
+
+    # endregion
+
+    # region <watchdog side>
+
+    def _watch(self):
+        while not self._stopped.wait(self.sample_interval):
+            lag = time.monotonic() - self._last_beat - self.interval
+            if lag >= self.threshold:
+                try:
+                    self.sample(lag)
+                except Exception:
+                    logger.exception("loop monitor failed to sample")
+
+    def sample(self, lag):
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        stack = []
+        handler = None
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s)" % (code.co_name, os.path.basename(code.co_filename)))
+            if handler is None and "self" in code.co_varnames:
+                owner = frame.f_locals.get("self")
+                if getattr(owner, "request_id", None) is not None:
+                    handler = owner
+            frame = frame.f_back
+        stack.append(self._thread_name)
+        stack.reverse()
+        if handler is not None:
+            request = "request=%s %s %s" % (handler.request_id, getattr(handler, "command", None), getattr(handler, "path", None))
+        else:
+            request = "request=-"
+        # the handler rotates the file and takes its own lock
+        self._output.handle(logging.makeLogRecord({ "msg": "# %.6f lag=%.3f %s\n%s 1" % (time.time(), lag, request, ";".join(stack)) }))
+        self.samples += 1
+        metrics.stall_samples.inc()
+
+    # endregion
+
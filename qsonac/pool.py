@@ -0,0 +1,67 @@
+# coding=utf-8
+
+import sys
+
+from qsonac import metrics
+
+
+def _held_by(obj):
+    return sys.getrefcount(obj)
+
+
+def _caller_only():
+    obj = object()
+    return _held_by(obj)
+
+
+# references to an object only the caller of release() holds, as release() counts them, it varies across versions;
+# None without reference counting (PyPy), nothing is pooled then
+_CALLER_ONLY = _caller_only() if hasattr(sys, "getrefcount") else None
+
+
+class ObjectPool:
+    """
+        Bounded free list of objects reset and reused instead of allocated per connection.
+
+        A pooled class implements
+        * reset(*args): take the state of a new object built with cls(*args)
+        * clear(): drop the references to the objects of the last use, called when it enters the pool
+        * self_references: the references it holds to itself (e.g. bound methods kept in attributes), 0 if not set
+
+        An object still referenced elsewhere when it is released (e.g. an environ kept by the application
+        holds wsgi.input) is not pooled, it is left to `discard` if given, then to the garbage collector.
+        A pool belongs to one event loop, it is not thread safe.
+    """
+
+    def __init__(self, factory, size = 256, discard = None):
+        self.factory = factory
+        self.size = size if _CALLER_ONLY is not None else 0
+        self.discard = discard
+        # a stack allocated once, pop() and append() would resize a list as the pool empties and fills up
+        self._free = [None] * self.size
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def acquire(self, *args):
+        if self._count:
+            self._count -= 1
+            obj = self._free[self._count]
+            self._free[self._count] = None
+            obj.reset(*args)
+            metrics.pool_acquires["reused"].inc()
+            return obj
+        metrics.pool_acquires["created"].inc()
+        return self.factory(*args)
+
+    def release(self, obj):
+        """ True when obj went back to the pool, the caller must not use it any more """
+        if self._count < self.size and sys.getrefcount(obj) <= _CALLER_ONLY + getattr(obj, "self_references", 0):
+            obj.clear()
+            self._free[self._count] = obj
+            self._count += 1
+            return True
+        if self.discard is not None:
+            self.discard(obj)
+        return False
@@ -0,0 +1,360 @@
+# coding=utf-8
+
+import asyncio
+import ctypes
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from multiprocessing.sharedctypes import RawArray
+
+from qsonac import listeners, metrics
+from qsonac.asynchttpserver import AsyncHTTPServer
+
+logger = logging.getLogger("qsonac.prefork")
+
+# state of a worker slot, set by the worker and read by the supervisor
+STARTING, READY, RETIRING = 0, 1, 2
+
+
+def rss():
+    """ resident set size of this process in bytes, 0 when unknown """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class PreforkWorkerServer(AsyncHTTPServer):
+    """
+        AsyncHTTPServer running inside a worker process of PreforkSupervisor.
+
+        Each finished request is published into the worker's slot of a shared array,
+        so the supervisor can report per-worker request counts without any IPC round trip.
+
+        Past max_requests requests, max_rss bytes of resident memory or max_age seconds the worker
+        retires: it flags its slot RETIRING and keeps serving until the supervisor, once a successor
+        is READY, sends it SIGTERM to drain and exit.
+    """
+
+    # seconds between two checks of the memory and age limits
+    lifecycle_check_interval = 1.0
+
+    def __init__(self, requestHandlerClass, client_address, loop, request_counts, index, sock = None, states = None,
+                 max_requests = None, max_rss = None, max_age = None, **options):
+        super().__init__(requestHandlerClass, client_address, loop, multiprocess=True, sock=sock, **options)
+        self.request_counts = request_counts
+        self.index = index
+        self.states = states
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.max_age = max_age
+        self.started = loop.time()
+        self.retire_reason = None
+
+    def serve_forever(self):
+        if self.max_rss or self.max_age:
+            self.loop.call_later(self.lifecycle_check_interval, self.check_lifecycle)
+        if self.states is not None:
+            # bound and listening, the supervisor may stop a predecessor
+            self.states[self.index] = READY
+        super().serve_forever()
+
+    def finish_request(self, request, client_address):
+        super().finish_request(request, client_address)
+        # a single store into our own slot, nobody else writes it
+        self.request_counts[self.index] = self.requests_served
+        if self.max_requests and self.requests_served >= self.max_requests:
+            self.retire("served %d requests" % self.requests_served)
+
+    def check_lifecycle(self):
+        if self.draining or self.retire_reason:
+            return
+        if self.max_age and self.loop.time() - self.started >= self.max_age:
+            self.retire("reached its max age of %ds" % self.max_age)
+        elif self.max_rss and rss() >= self.max_rss:
+            self.retire("uses %d MiB of memory" % (rss() >> 20))
+        else:
+            self.loop.call_later(self.lifecycle_check_interval, self.check_lifecycle)
+
+    def retire(self, reason):
+        """ ask the supervisor for a successor, it terminates us once the successor is ready """
+        if self.retire_reason or self.draining:
+            return
+        self.retire_reason = reason
+        logger.info("worker pid %d in slot %d %s, retiring", os.getpid(), self.index, reason)
+        if self.states is not None:
+            self.states[self.index] = RETIRING
+        else:
+            self.graceful_shutdown()
+
+
+class PreforkSupervisor:
+    """
+        Fork N worker processes and keep them alive.
+
+        * every worker runs its own event loop, either with its own SO_REUSEPORT listening sockets
+          or accepting on listening sockets created here, or given (sock), and inherited through fork(),
+          always so for the unix sockets
+        * workers that die unexpectedly are forked again in the same slot
+        * SIGINT, SIGTERM, SIGQUIT and SIGHUP are forwarded to the workers,
+          on SIGTERM and SIGHUP the workers drain gracefully, on SIGHUP they are replaced, which reloads them
+        * SIGUSR1 reports the per-worker request counts, SIGUSR2 (the re-exec of a single process server) is ignored
+        * started by a zero-downtime re-exec (handoff), the predecessor is told to drain once every worker is ready
+        * the metrics of every worker go to its slot of a shared StatsSegment,
+          the metrics endpoint of any worker serves the sum of all of them
+        * lifecycle policies recycle the workers: after max_requests requests (plus a random
+          0..max_requests_jitter so the workers do not all retire together), max_rss bytes of resident
+          memory or max_age seconds, a worker asks to retire, a successor is forked in the spare slot
+          of its index and the old worker drains only once the successor listens, capacity never dips
+    """
+
+    # seconds between two iterations of the supervision loop
+    tick = 0.5
+    # a worker dying faster than this after being forked is considered crash looping, its restart is delayed
+    min_uptime = 1
+    restart_delay = 1
+    # seconds the workers have to exit after a stop signal before they are killed
+    graceful_timeout = 30
+
+    stop_signals = (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT)
+    forwarded_signals = stop_signals + (signal.SIGHUP,)
+    # handled by the supervisor itself: SIGUSR1 reports, SIGUSR2 (re-exec of a single process server) is refused
+    own_signals = (signal.SIGUSR1, signal.SIGUSR2)
+
+    def __init__(self, requestHandlerClass, client_address = ("127.0.0.1", 80), workers = 2, reuse_port = True, max_requests = None,
+                 max_requests_jitter = 0, max_rss = None, max_age = None, sock = None, handoff = None, **options):
+        self.RequestHandlerClass = requestHandlerClass
+        self.client_address = client_address
+        self.workers = workers
+        self.reuse_port = reuse_port and hasattr(socket, "SO_REUSEPORT")
+        # the listening sockets shared by all the workers, None when each one binds its own
+        self.sockets = sock
+        self.owned_sockets = []
+        # the ListenSocketReceiver of a zero-downtime re-exec which handed us `sock`, acknowledged once the workers listen
+        self.handoff = handoff
+        # passed to every worker's AsyncHTTPServer
+        self.options = options
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss
+        self.max_age = max_age
+        # pid -> (worker index, fork time, slot), worker index i runs in slot i or, while it is replaced, i + workers
+        self.children = { }
+        # worker index -> time after which it can be forked again
+        self.pending_restarts = { }
+        # pid of a retiring worker -> pid of its successor
+        self.successors = { }
+        # retiring workers already told to drain
+        self.retired = set()
+        self.pending_signals = []
+        self.stopping = False
+        self.request_counts = RawArray(ctypes.c_uint64, 2 * workers)
+        # requests served by the workers gone, their slot is zeroed when it is reused
+        self.exited_requests = 0
+        self.states = RawArray(ctypes.c_uint8, 2 * workers)
+        self.stats = metrics.StatsSegment(metrics.REGISTRY, 2 * workers)
+
+    # region <lifecycle>
+
+    def run(self):
+        addresses = [listeners.parse_address(address) for address in [self.client_address] + list(self.options.get("listen", ()))]
+        socket_options = self.options.get("socket_options")
+        if isinstance(socket_options, dict):
+            socket_options = self.options["socket_options"] = listeners.SocketOptions(**socket_options)
+        if self.sockets is None and (not self.reuse_port or any(listeners.is_unix(address) for address in addresses)):
+            # bind once, every worker inherit the same listening sockets
+            for address in addresses:
+                self.owned_sockets.append(listeners.open_listener(address, self.options.get("backlog", 128), mode=self.options.get("unix_socket_mode"),
+                                                                  group=self.options.get("unix_socket_group"), options=socket_options))
+                logger.info("listening on %s", listeners.describe(address))
+            self.sockets = self.owned_sockets
+        for sig in self.forwarded_signals + self.own_signals:
+            signal.signal(sig, self.on_signal)
+        try:
+            for index in range(self.workers):
+                self.spawn(index)
+            while self.children:
+                self.handle_signals()
+                self.reap_workers()
+                self.restart_workers()
+                self.replace_retiring_workers()
+                self.acknowledge_handoff()
+                if self.stopping and time.monotonic() > self.stop_deadline:
+                    self.kill_workers(signal.SIGKILL)
+                time.sleep(self.tick)
+        finally:
+            self.kill_workers(signal.SIGKILL)
+            for sock in self.owned_sockets:
+                listeners.unlink(sock)
+                sock.close()
+            self.report()
+
+    def spawn(self, index):
+        slot = index if index not in self.used_slots() else index + self.workers
+        self.request_counts[slot] = 0
+        self.states[slot] = STARTING
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (index, time.monotonic(), slot)
+            return pid
+        # child
+        code = 0
+        try:
+            for sig in self.forwarded_signals + self.own_signals:
+                signal.signal(sig, signal.SIG_DFL)
+            # not the random sequence of the supervisor, every worker its own jitter
+            random.seed()
+            self.run_worker(slot)
+        except BaseException:
+            logger.exception("worker %d failed", index)
+            code = 1
+        finally:
+            # never return into the supervisor code
+            os._exit(code)
+
+    def run_worker(self, slot):
+        self.stats.attach(slot)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        server = PreforkWorkerServer(self.RequestHandlerClass, self.client_address, loop, self.request_counts, slot, self.sockets,
+                                     states=self.states, max_requests=max_requests, max_rss=self.max_rss, max_age=self.max_age, **self.options)
+        for sig in (signal.SIGINT, signal.SIGQUIT):
+            loop.add_signal_handler(sig, server.stop)
+        # drain before leaving when asked to terminate or reload
+        for sig in (signal.SIGTERM, signal.SIGHUP):
+            loop.add_signal_handler(sig, server.graceful_shutdown)
+        # sent to a worker pid, not forwarded by the supervisor
+        loop.add_signal_handler(signal.SIGUSR1, server.toggle_loop_monitor)
+        with server:
+            server.serve_forever()
+        loop.close()
+
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            self.stop_deadline = time.monotonic() + self.graceful_timeout
+            self.pending_restarts.clear()
+
+    # endregion
+
+    # region <supervision>
+
+    def on_signal(self, signum, frame):
+        # only record it, the real work is done out of the signal handler in the supervision loop
+        self.pending_signals.append(signum)
+
+    def handle_signals(self):
+        while self.pending_signals:
+            signum = self.pending_signals.pop(0)
+            if signum == signal.SIGUSR1:
+                self.report()
+                continue
+            if signum == signal.SIGUSR2:
+                logger.warning("zero-downtime re-exec is not supported in prefork mode, SIGHUP replaces the workers")
+                continue
+            if signum in self.stop_signals:
+                self.stop()
+            self.kill_workers(signum)
+
+    def kill_workers(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reap_workers(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            if pid not in self.children:
+                continue
+            index, started, slot = self.children.pop(pid)
+            self.exited_requests += self.request_counts[slot]
+            self.retired.discard(pid)
+            self.successors.pop(pid, None)
+            self.log(pid, index, "exited with status %d after %d requests" % (status, self.request_counts[slot]))
+            # a retired worker leaves its successor, a failed successor its predecessor, nothing to restart
+            if not self.stopping and index not in self.running_indexes():
+                now = time.monotonic()
+                self.pending_restarts[index] = now + self.restart_delay if now - started < self.min_uptime else now
+
+    def restart_workers(self):
+        now = time.monotonic()
+        for index, restart_at in list(self.pending_restarts.items()):
+            if restart_at <= now:
+                del self.pending_restarts[index]
+                self.spawn(index)
+
+    def replace_retiring_workers(self):
+        """ fork a successor to each retiring worker, terminate the worker once its successor is ready """
+        if self.stopping:
+            return
+        for pid, (index, started, slot) in list(self.children.items()):
+            if self.states[slot] != RETIRING or pid in self.retired:
+                continue
+            successor = self.successors.get(pid)
+            if successor not in self.children:
+                if len([child for child in self.children.values() if child[0] == index]) > 1:
+                    # both slots of the index are taken, the predecessor is still draining
+                    continue
+                self.successors[pid] = self.spawn(index)
+                self.log(pid, index, "retiring after %d requests, forked pid %d" % (self.request_counts[slot], self.successors[pid]))
+            elif self.states[self.children[successor][2]] != STARTING:
+                self.retired.add(pid)
+                os.kill(pid, signal.SIGTERM)
+
+    def acknowledge_handoff(self):
+        """ let the predecessor which handed its listening sockets over drain, once all our workers accept on them """
+        if self.handoff is None or self.stopping or len(self.running_indexes()) < self.workers:
+            return
+        if any(self.states[slot] == STARTING for index, started, slot in self.children.values()):
+            return
+        self.handoff.acknowledge()
+        self.handoff = None
+        # the socket files of our predecessor are ours to remove
+        self.owned_sockets.extend(sock for sock in self.sockets or () if sock.family == socket.AF_UNIX)
+
+    def used_slots(self):
+        return { slot for index, started, slot in self.children.values() }
+
+    def running_indexes(self):
+        return { index for index, started, slot in self.children.values() }
+
+    # endregion
+
+    # region <report>
+
+    def worker_request_counts(self):
+        """ pid -> number of requests served by the worker currently running in that slot """
+        return { pid: self.request_counts[slot] for pid, (index, started, slot) in self.children.items() }
+
+    def total_requests(self):
+        """ served by all the workers since start, the recycled ones included """
+        return self.exited_requests + sum(self.worker_request_counts().values())
+
+    def report(self):
+        for pid, (index, started, slot) in sorted(self.children.items(), key=lambda child: child[1]):
+            self.log(pid, index, "served %d requests" % self.request_counts[slot])
+        logger.info("total requests served: %d", self.total_requests())
+        logger.info("total since start: %d connections, %d requests, %d shed", *(
+            sum(self.stats.value(counter, slot) for slot in range(self.stats.slots))
+            for counter in (metrics.connections, metrics.requests, metrics.shed_requests)))
+
+    @staticmethod
+    def log(pid, index, msg):
+        logger.info("worker %d pid %s %s", index, pid, msg)
+
+    # endregion
@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+Replay a traffic capture (AsyncHTTPServer(capture=...), see logs.TrafficCapture) against a server.
+
+    python -m qsonac.replay capture.jsonl --port 48539                 # the original pace
+    python -m qsonac.replay capture.jsonl --port 48539 --speed 4      # four times faster
+    python -m qsonac.replay worker1.jsonl worker2.jsonl --speed 0.5 --json
+
+Every request is sent at its arrival time in the capture (divided by --speed) whatever the server does,
+as the open loop of qsonac.loadgen, and the latencies are measured from that time. The captured bodies
+are only samples: a body is its sample padded with spaces to the captured length.
+The latencies and the statuses of the capture are reported next to the replayed ones.
+"""
+import argparse
+import asyncio
+import collections
+import json
+
+from qsonac.loadgen import LoadGenerator, build_request, format_report
+from qsonac.metrics import Registry
+
+# set by build_request from the target, or not to be replayed as captured
+_SKIPPED_HEADERS = frozenset(("host", "content-length", "connection", "transfer-encoding", "keep-alive"))
+
+
+def load_capture(paths, host, port, keepalive = True):
+    """ [(offset, raw request)] in arrival order, and the captured entries """
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    if not entries:
+        raise ValueError("no request in %s" % ", ".join(paths))
+    # merged captures are ordered by their time, a single one would do with its offsets
+    key = "time" if all("time" in entry for entry in entries) else "offset"
+    entries.sort(key=lambda entry: entry[key])
+    origin = entries[0][key]
+    schedule = []
+    for entry in entries:
+        headers = { name: value for name, value in entry.get("headers", { }).items() if name.lower() not in _SKIPPED_HEADERS }
+        body = entry.get("body", "").encode("iso-8859-1")
+        body += b" " * (entry.get("body_length", 0) - len(body))
+        raw = build_request(host, port, entry.get("method", "GET"), entry.get("path", "/"), headers, body, keepalive)
+        schedule.append((entry[key] - origin, raw))
+    return schedule, entries
+
+
+def recorded_report(entries):
+    """ latency percentiles and statuses of the capture itself """
+    latency = Registry().histogram("latency", sub_buckets=16)
+    statuses = collections.Counter()
+    for entry in entries:
+        latency.observe(entry.get("latency", 0.0))
+        statuses[str(entry.get("status"))] += 1
+    return {
+        "requests": len(entries),
+        "duration": entries[-1].get("time", entries[-1].get("offset", 0.0)) - entries[0].get("time", entries[0].get("offset", 0.0)),
+        "statuses": dict(sorted(statuses.items())),
+        "latency" : { "p50": latency.percentile(50), "p90": latency.percentile(90), "p99": latency.percentile(99),
+                      "p999": latency.percentile(99.9) },
+    }
+
+
+class Replayer(LoadGenerator):
+    """ A LoadGenerator whose open loop follows the schedule of a capture, `speed` times faster """
+
+    def __init__(self, host = "127.0.0.1", port = 48539, schedule = (), connections = 10, speed = 1.0,
+                 keepalive = True, pipeline = 1, timeout = 10.0, loop = None):
+        self.schedule = [(offset / speed, raw) for offset, raw in schedule]
+        if not self.schedule:
+            raise ValueError("nothing to replay")
+        self.speed = speed
+        duration = self.schedule[-1][0]
+        # the mean rate, it only sets the open loop mode and is reported as the target
+        rate = len(self.schedule) / duration if duration > 0 else float(len(self.schedule))
+        super().__init__(host, port, [raw for _, raw in self.schedule], connections, duration, rate, keepalive, pipeline, timeout, loop)
+
+    async def _generate(self):
+        start = self.loop.time()
+        for offset, raw in self.schedule:
+            due = start + offset
+            delay = due - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._queue.put_nowait((due, raw))
+        for _ in range(self.connections):
+            self._queue.put_nowait(None)
+
+    def report(self):
+        report = super().report()
+        report["speed"] = self.speed
+        return report
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m qsonac.replay", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="JSONL capture files, merged by arrival time")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=48539)
+    parser.add_argument("--speed", type=float, default=1.0, help="rate factor, 2 replays twice as fast")
+    parser.add_argument("-c", "--connections", type=int, default=50, help="requests in flight at most (times --pipeline)")
+    parser.add_argument("--pipeline", type=int, default=1)
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    schedule, entries = load_capture(args.captures, args.host, args.port, args.keepalive)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        replayer = Replayer(args.host, args.port, schedule, args.connections, args.speed, args.keepalive, args.pipeline, args.timeout, loop)
+        report = loop.run_until_complete(replayer.run())
+    finally:
+        loop.close()
+    report["recorded"] = recorded_report(entries)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        recorded = report["recorded"]
+        print(format_report(report))
+        print("  captured: %d requests over %.2fs, statuses %s" % (
+            recorded["requests"], recorded["duration"], ", ".join("%s=%d" % item for item in recorded["statuses"].items())))
+        print("  captured latency     p50 %.3fms  p90 %.3fms  p99 %.3fms  p99.9 %.3fms" % tuple(
+            recorded["latency"][key] * 1000 for key in ("p50", "p90", "p99", "p999")))
+    return report
+
+
+if __name__ == "__main__":
+    main()
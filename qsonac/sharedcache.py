@@ -0,0 +1,341 @@
+# coding=utf-8
+
+import contextlib
+import logging
+import mmap
+import multiprocessing
+import struct
+import time
+import zlib
+
+from qsonac.cache import CachedResponse
+
+_HEADER = struct.Struct("<qqqqq")  # items, evictions, rejected, clock hand, next unassigned page
+# seq, hash, state, clock reference bit, key length, chunk offset, value length, expires (time.monotonic, 0 never)
+_BUCKET = struct.Struct("<IIBBHIId")
+_SEQ = struct.Struct("<I")
+_FIELDS = struct.Struct("<IBBHIId")  # the bucket after its seq
+_NEXT = struct.Struct("<q")
+
+EMPTY, USED, TOMBSTONE = 0, 1, 2
+
+logger = logging.getLogger("qsonac.cache")
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class SharedMemoryStore:
+    """
+        Fixed size key/value store in an anonymous shared mmap, created before fork() and used by all the workers.
+
+        * index: open addressing (linear probing, at most `max_probe` buckets) of `buckets` buckets
+        * values: slab allocated, the data is split into pages of `page_size` bytes, a page is given to a size class
+          (min_chunk, 2 * min_chunk, ... page_size) the first time the class runs out of chunks,
+          a chunk holds the key followed by the value
+        * reads take no lock: every bucket has a seqlock, odd while a writer changes the bucket or frees its chunk,
+          a reader seeing it odd, or changed after it copied the value, reads again
+        * writes are serialized by one process shared lock, a writer which died holding it is presumed after
+          `lock_timeout` seconds: the lock is taken over and the buckets it left half written are dropped
+        * eviction: LRU clock, a read sets the reference bit of the bucket, the hand clears it and evicts
+          the buckets it finds unreferenced (or expired) in the size class needing a chunk
+
+        A dead writer may leak the chunk it was writing. Pages are never given back to another class, a store whose traffic changes of value sizes
+        rejects (set() returns False) the values of a class that got no page and holds nothing to evict.
+    """
+
+    # seconds a write waits for the lock before its holder is taken for dead
+    lock_timeout = 2.0
+
+    def __init__(self, size = 64 * 1024 * 1024, buckets = None, page_size = 1024 * 1024, min_chunk = 64, max_probe = 64):
+        self.page_size = page_size
+        self.pages = max(1, size // page_size)
+        self.chunk_sizes = []
+        chunk = min_chunk
+        while chunk <= page_size:
+            self.chunk_sizes.append(chunk)
+            chunk *= 2
+        self.buckets = buckets or max(64, self.pages * page_size // 256)
+        self.max_probe = min(max_probe, self.buckets)
+
+        self._heads_at = _HEADER.size
+        self._page_classes_at = self._heads_at + 8 * len(self.chunk_sizes)
+        self._buckets_at = _align(self._page_classes_at + self.pages)
+        self._data_at = _align(self._buckets_at + self.buckets * _BUCKET.size)
+        self.mm = mmap.mmap(-1, self._data_at + self.pages * page_size)
+        self._lock = multiprocessing.Lock()
+        self.clear()
+
+    # region <layout>
+
+    def _header(self):
+        return list(_HEADER.unpack_from(self.mm, 0))
+
+    def _set_header(self, header):
+        _HEADER.pack_into(self.mm, 0, *header)
+
+    def _head(self, klass):
+        return _NEXT.unpack_from(self.mm, self._heads_at + 8 * klass)[0]
+
+    def _set_head(self, klass, chunk):
+        _NEXT.pack_into(self.mm, self._heads_at + 8 * klass, chunk)
+
+    def _class_of(self, size):
+        for klass, chunk_size in enumerate(self.chunk_sizes):
+            if size <= chunk_size:
+                return klass
+        return None
+
+    # endregion
+
+    def clear(self):
+        with self._writing():
+            self.mm[:self._data_at] = bytes(self._data_at)
+            for klass in range(len(self.chunk_sizes)):
+                self._set_head(klass, -1)
+
+    def __len__(self):
+        return self._header()[0]
+
+    def stats(self):
+        items, evictions, rejected, _, pages = self._header()
+        return { "items": items, "evictions": evictions, "rejected": rejected, "buckets": self.buckets,
+                 "pages": self.pages, "pages_used": pages }
+
+    @staticmethod
+    def _key(key):
+        return key.encode("utf-8") if isinstance(key, str) else key
+
+    def get(self, key):
+        key = self._key(key)
+        h = zlib.crc32(key)
+        mm = self.mm
+        for _ in range(100):
+            found = self._read(mm, key, h)
+            if found is not False:
+                return found
+        # a writer keeps changing our bucket, wait for it, or repair what it left if it died
+        with self._writing():
+            found = self._read(mm, key, h)
+        return found if found is not False else None
+
+    def _read(self, mm, key, h):
+        """ the value, None when missing, False when a writer interfered """
+        buckets_at, data_at = self._buckets_at, self._data_at
+        home = h % self.buckets
+        # buckets passed over, a torn copy of one of them may have hidden the key
+        passed = []
+        for i in range(self.max_probe):
+            at = buckets_at + ((home + i) % self.buckets) * _BUCKET.size
+            seq, bucket_hash, state, ref, key_len, chunk, value_len, expires = _BUCKET.unpack_from(mm, at)
+            if seq & 1:
+                return False
+            if state == EMPTY:
+                passed.append((at, seq))
+                break
+            if state == USED and bucket_hash == h and key_len == len(key):
+                start = data_at + chunk
+                data = mm[start:start + key_len + value_len]
+                if _SEQ.unpack_from(mm, at)[0] != seq:
+                    return False
+                if data[:key_len] == key:
+                    if expires and expires <= time.monotonic():
+                        return None
+                    if not ref:
+                        mm[at + 9] = 1  # the reference bit, racing with the clock hand is harmless
+                    return data[key_len:]
+            passed.append((at, seq))
+        for at, seq in passed:
+            if _SEQ.unpack_from(mm, at)[0] != seq:
+                return False
+        return None
+
+    def set(self, key, value, ttl = None):
+        """ False when the value could not be stored: too large, or nothing to evict in its size class """
+        key = self._key(key)
+        klass = self._class_of(len(key) + len(value))
+        if klass is None or len(key) > 0xffff:
+            return False
+        h = zlib.crc32(key)
+        expires = time.monotonic() + ttl if ttl else 0.0
+        with self._writing():
+            header = self._header()
+            # allocated first, the clock may evict any bucket, the one of the key too
+            chunk = self._allocate(klass, header)
+            if chunk is None:
+                header[2] += 1
+                self._set_header(header)
+                return False
+            target, old = self._find_slot(key, h)
+            if target is None:
+                target = self._evict_in_window(h, header)
+            # the chunk is not reachable yet, no reader can see it half written
+            start = self._data_at + chunk
+            self.mm[start:start + len(key) + len(value)] = key + value
+            at = self._buckets_at + target * _BUCKET.size
+            seq, _, state = _BUCKET.unpack_from(self.mm, at)[:3]
+            self._write_seq(at, seq + 1)
+            self.mm[at + 4:at + _BUCKET.size] = _FIELDS.pack(h, USED, 1, len(key), chunk, len(value), expires)
+            self._write_seq(at, seq + 2)
+            if old is not None:
+                self._free(old[0], old[1])
+            elif state != USED:
+                header[0] += 1
+            self._set_header(header)
+            return True
+
+    def delete(self, key):
+        key = self._key(key)
+        with self._writing():
+            target, old = self._find_slot(key, zlib.crc32(key))
+            if old is not None:
+                header = self._header()
+                self._remove(target)
+                header[0] -= 1
+                self._set_header(header)
+                return True
+            return False
+
+    # region <writer side, under the lock>
+
+    @contextlib.contextmanager
+    def _writing(self):
+        if not self._lock.acquire(timeout=self.lock_timeout):
+            # the writer holding it died (a process cannot release it any more), it is ours now
+            logger.warning("shared cache lock held for more than %.1fs, taken over", self.lock_timeout)
+            self._repair()
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _repair(self):
+        """ drop the buckets a dead writer left odd, recount the items """
+        items = 0
+        for index in range(self.buckets):
+            at = self._buckets_at + index * _BUCKET.size
+            seq, _, state = _BUCKET.unpack_from(self.mm, at)[:3]
+            if seq & 1:
+                # half written: a tombstone keeps the probe sequences through it, the chunk is lost
+                self.mm[at + 8] = TOMBSTONE
+                self._write_seq(at, seq + 1)
+            elif state == USED:
+                items += 1
+        header = self._header()
+        header[0] = items
+        self._set_header(header)
+
+    def _write_seq(self, at, seq):
+        # a copy of the packed bytes: struct.pack_into zeroes its target first, a reader could see seq 0
+        self.mm[at:at + 4] = _SEQ.pack(seq & 0xffffffff)
+
+    def _find_slot(self, key, h):
+        """ (bucket to write, (chunk, size class) it holds when the key is already there) """
+        home = h % self.buckets
+        free = None
+        for i in range(self.max_probe):
+            index = (home + i) % self.buckets
+            _, bucket_hash, state, _, key_len, chunk, value_len, _ = _BUCKET.unpack_from(self.mm, self._buckets_at + index * _BUCKET.size)
+            if state == EMPTY:
+                return (free if free is not None else index), None
+            if state == TOMBSTONE:
+                if free is None:
+                    free = index
+            elif bucket_hash == h and key_len == len(key):
+                start = self._data_at + chunk
+                if self.mm[start:start + key_len] == key:
+                    return index, (chunk, self._class_of(key_len + value_len))
+        return free, None
+
+    def _evict_in_window(self, h, header):
+        """ every bucket the key may go to is used, evict an unreferenced one, or the first """
+        home = h % self.buckets
+        victim = home
+        for i in range(self.max_probe):
+            index = (home + i) % self.buckets
+            if not self.mm[self._buckets_at + index * _BUCKET.size + 9]:
+                victim = index
+                break
+        self._remove(victim)
+        header[0] -= 1
+        header[1] += 1
+        return victim
+
+    def _remove(self, index):
+        at = self._buckets_at + index * _BUCKET.size
+        seq, _, _, _, key_len, chunk, value_len, _ = _BUCKET.unpack_from(self.mm, at)
+        self._write_seq(at, seq + 1)
+        self.mm[at + 8] = TOMBSTONE
+        self._write_seq(at, seq + 2)
+        # only now the chunk can be reused: a reader which copied it sees the new seq
+        self._free(chunk, self._class_of(key_len + value_len))
+
+    def _free(self, chunk, klass):
+        _NEXT.pack_into(self.mm, self._data_at + chunk, self._head(klass))
+        self._set_head(klass, chunk)
+
+    def _allocate(self, klass, header):
+        chunk = self._head(klass)
+        if chunk == -1 and header[4] < self.pages:
+            # carve a new page into chunks of the class
+            page = header[4]
+            header[4] += 1
+            self.mm[self._page_classes_at + page] = klass
+            chunk_size = self.chunk_sizes[klass]
+            for offset in range(page * self.page_size, (page + 1) * self.page_size - chunk_size + 1, chunk_size):
+                self._free(offset, klass)
+            chunk = self._head(klass)
+        if chunk == -1:
+            self._clock_evict(klass, header)
+            chunk = self._head(klass)
+        if chunk == -1:
+            return None
+        self._set_head(klass, _NEXT.unpack_from(self.mm, self._data_at + chunk)[0])
+        return chunk
+
+    def _clock_evict(self, klass, header):
+        """ move the clock hand until a bucket of the class is evicted, expired ones are removed on the way """
+        now = time.monotonic()
+        hand = header[3]
+        for _ in range(2 * self.buckets):
+            index = hand
+            hand = (hand + 1) % self.buckets
+            at = self._buckets_at + index * _BUCKET.size
+            _, _, state, ref, key_len, _, value_len, expires = _BUCKET.unpack_from(self.mm, at)
+            if state != USED:
+                continue
+            expired = expires and expires <= now
+            if ref and not expired:
+                self.mm[at + 9] = 0
+                continue
+            if expired or self._class_of(key_len + value_len) == klass:
+                self._remove(index)
+                header[0] -= 1
+                if not expired:
+                    header[1] += 1
+                if self._head(klass) != -1:
+                    break
+        header[3] = hand
+
+    # endregion
+
+
+class SharedBackend:
+    """ ResponseCache backend in a SharedMemoryStore, the workers forked after it share their responses """
+
+    def __init__(self, store = None, size = 64 * 1024 * 1024):
+        self.store = store if store is not None else SharedMemoryStore(size)
+
+    def get(self, key):
+        data = self.store.get(key)
+        return CachedResponse.loads(data) if data is not None else None
+
+    def set(self, key, entry):
+        self.store.set(key, entry.dumps())
+
+    def delete(self, key):
+        self.store.delete(key)
+
+    def clear(self):
+        self.store.clear()
@@ -1,8 +1,86 @@
 # coding=utf-8
 import asyncio
+import logging
 import socket
+import struct
+import weakref
 
+from qsonac import metrics
+from qsonac.logs import traced
+from qsonac.timerwheel import TimerWheel
 
+logger = logging.getLogger("qsonac.connection")
+
+# the buffer of a StreamSock with no data in flight, a bytearray is only allocated to hold some
+_EMPTY = b""
+
+# one receive buffer per event loop: recv_into() it, only the bytes received are copied out,
+# recv(n) would allocate n bytes at every call, then shrink them
+_receive_buffers = weakref.WeakKeyDictionary()
+
+
+def receive_buffer(loop, size):
+    view = _receive_buffers.get(loop)
+    if view is None or len(view) < size:
+        view = _receive_buffers[loop] = memoryview(bytearray(size))
+    return view
+
+
+class IOStats:
+    """
+        I/O accounting of one connection, or the sum of many (see add() and merge()),
+        the data behind the choice of the buffer sizes and water marks.
+    """
+
+    # a connection moving less bytes than this per syscall on average is dominated by syscalls
+    small_io = 1024
+
+    def __init__(self):
+        self.recv_calls = 0
+        self.send_calls = 0
+        self.eagain = 0  # recv()/send() answering EAGAIN
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.read_pauses = 0
+        self.write_pauses = 0
+        self.peak_read_buffer = 0
+        self.peak_write_buffer = 0
+        """aggregates"""
+        self.connections = 0
+        self.syscall_bound = 0
+
+    def __repr__(self):
+        return "IOStats(%s)" % ", ".join("%s=%s" % item for item in self.as_dict().items())
+
+    def is_syscall_bound(self):
+        calls = self.recv_calls + self.send_calls
+        return calls > 0 and self.bytes_in + self.bytes_out < calls * self.small_io
+
+    def add(self, connection):
+        """ account a finished connection """
+        self.merge(connection)
+        self.connections += 1
+        self.syscall_bound += connection.is_syscall_bound()
+
+    def merge(self, other):
+        """ sum another aggregate """
+        self.recv_calls += other.recv_calls
+        self.send_calls += other.send_calls
+        self.eagain += other.eagain
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.read_pauses += other.read_pauses
+        self.write_pauses += other.write_pauses
+        self.peak_read_buffer = max(self.peak_read_buffer, other.peak_read_buffer)
+        self.peak_write_buffer = max(self.peak_write_buffer, other.peak_write_buffer)
+        self.connections += other.connections
+        self.syscall_bound += other.syscall_bound
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+@traced
 class StreamSock:
     """
         State machine of calls:
@@ -13,29 +91,74 @@ class StreamSock:
         * ER: eof_received()
         * SD: shutdown()
         * CS: close()
+
+        Thousands of them may sit idle, so no __dict__, and the read and write buffers
+        are the shared _EMPTY until some data is actually in flight.
     """
-    buffer_factory = bytearray  # Constructs initial value for self._buffer.
+    __slots__ = ("_loop", "exception", "_waiter", "idle", "delimited", "timeout",
+                 "idle_timeout", "header_timeout", "body_timeout", "write_timeout", "phase", "deadline", "_timer_slot", "_wheel", "_receive_view",
+                 "io", "_sock", "_server",
+                 "_write_buffer", "_write_pause", "_write_eof", "_high_water", "_low_water",
+                 "_read_buffer", "_read_paused", "_read_eof")
+
+    buffer_factory = bytearray  # Constructs the buffers once there is data to hold.
+    _buffer_limit = 2 ** 16
+
+    # connection phases, each one with its own deadline
+    IDLE = "idle"  # waiting for the first byte of a request, total deadline
+    HEADER = "header"  # receiving the request head, total deadline if header_timeout is set, else a stall deadline
+    BODY = "body"  # reading the request body, stall deadline
+    WRITE = "write"  # waiting for the socket to take the response, stall deadline
+    CLOSE = "close"  # response sent, waiting for the client to close, total deadline set by close()
+
+    # seconds the client has to close first once the response is flushed, it keeps the TIME_WAIT state then
+    close_grace = 0.5
+    # seconds its input is read and discarded after our FIN, closing with unread input would reset the connection
+    lingering_timeout = 2.0
+    # SO_LINGER on, 0 second: close() resets the connection, no TIME_WAIT
+    _RESET_LINGER = struct.pack("ii", 1, 0)
+
+    # how the two ends of a unix socket connection, which have no address, look to the application:
+    # a local peer, and the default port to rebuild urls without a Host header
+    UNIX_PEER = ("127.0.0.1", 0)
+    UNIX_SERVER = ("localhost", 80)
 
     def __init__(self, loop: asyncio.SelectorEventLoop, sock: socket.socket, server = None):
         self._loop = loop
         self.exception = None
         self._waiter = None  # A future used by wait_for_()
+        self.idle = True  # no byte of a request received yet
+        self.delimited = False  # the response tells its length, the client knows its end without our FIN
         self.timeout = 3  # 30 second, it can be change with set timeout
 
+        """deadlines, tracked by the TimerWheel of the loop"""
+        # per phase timeouts, None falls back to self.timeout
+        self.idle_timeout = None
+        self.header_timeout = None
+        self.body_timeout = None
+        self.write_timeout = None
+        self.phase = self.IDLE
+        self.deadline = None  # absolute loop time
+        self._timer_slot = None
+        self._wheel = None
+        self._receive_view = None  # the receive buffer of the loop, set up with the wheel
+
+        # IOStats of this connection when the server accounts them, see AsyncHTTPServer.io_stats
+        self.io = None
+
         """SocketTransport"""
         self._sock = sock
-        self._buffer_limit = 2 ** 16
 
         """StreamProtocol"""
         self._server = server
 
         """StreamWriter"""
-        self._write_buffer = self.buffer_factory()
+        self._write_buffer = _EMPTY
         self._write_pause = False
         self._write_eof = False  # next drain will transmit all data in write_buffer
 
         """StreamReader"""
-        self._read_buffer = self.buffer_factory()
+        self._read_buffer = _EMPTY
         self._read_paused = False
         self._read_eof = False  # when all data are in read_buffer
 
@@ -49,13 +172,25 @@ class StreamSock:
     def socket(self):
         return self._sock
 
+    @property
+    def loop(self):
+        return self._loop
+
     @property
     def server(self):
         return self._server
 
+    @staticmethod
+    def unmapped(address):
+        # the IPv4 clients of a dual-stack listener come as ::ffff:a.b.c.d
+        if address[0].startswith("::ffff:") and "." in address[0]:
+            return address[0][7:], address[1]
+        return address
+
     @property
     def server_address(self):
-        return self.socket.getsockname()
+        address = self.socket.getsockname()
+        return self.unmapped(address) if isinstance(address, tuple) else self.UNIX_SERVER
 
     @property
     def host(self):
@@ -67,7 +202,8 @@ class StreamSock:
 
     @property
     def remote_address(self):
-        return self.socket.getpeername()
+        address = self.socket.getpeername()
+        return self.unmapped(address) if isinstance(address, tuple) else self.UNIX_PEER
 
     @property
     def remote_host(self):
@@ -85,12 +221,17 @@ class StreamSock:
     # region <static method>
 
     @staticmethod
-    def configure_connection(sock):
+    def configure_connection(sock, options = None):
         sock.setblocking(False)
-        # Disable the Nagle algorithm -- small writes will be
-        # sent without waiting for the TCP ACK.  This generally
-        # decreases the latency (in some cases significantly.)
-        if hasattr(socket, 'TCP_NODELAY'):
+        if sock.family == socket.AF_UNIX:
+            return
+        if options is not None:
+            # the SocketOptions of the server, its TCP_NODELAY included
+            options.apply_connection(sock)
+        elif hasattr(socket, 'TCP_NODELAY'):
+            # Disable the Nagle algorithm -- small writes will be
+            # sent without waiting for the TCP ACK.  This generally
+            # decreases the latency (in some cases significantly.)
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
 
     # endregion
@@ -98,14 +239,68 @@ class StreamSock:
     # region <method with no side effect>
 
     def setup(self):
-        self.configure_connection(self.socket)
+        self.configure_connection(self.socket, getattr(self.server, "socket_options", None))
         self.set_write_buffer_limits()
+        if self.server is not None:
+            for name in ("idle_timeout", "header_timeout", "body_timeout", "write_timeout"):
+                setattr(self, name, getattr(self.server, name, None))
+        self._wheel = TimerWheel.for_loop(self._loop)
+        self._receive_view = receive_buffer(self._loop, self._buffer_limit * 4)
+        self.set_phase(self.IDLE)
+        if getattr(self.server, "io_stats", False):
+            self.io = IOStats()
 
     def settimeout(self, timeout):
         self.timeout = timeout
 
-    def log(self, msg: str):
-        print(self.socket, msg, self)
+    def debug_log(self, msg: str):
+        logger.debug("%s %s", msg, self.socket)
+
+    # endregion
+
+    # region <deadline>
+
+    def phase_timeout(self, phase):
+        if phase == self.IDLE:
+            timeout = self.idle_timeout
+        elif phase == self.HEADER:
+            timeout = self.header_timeout
+        elif phase == self.BODY:
+            timeout = self.body_timeout
+        else:
+            timeout = self.write_timeout
+        return timeout or self.timeout
+
+    def is_stall_phase(self, phase):
+        # the deadline of a stall phase restarts with every wait, a total one is fixed when the phase begins
+        return phase in (self.BODY, self.WRITE) or (phase == self.HEADER and not self.header_timeout)
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.touch(self._loop.time() + self.phase_timeout(phase))
+
+    def touch(self, deadline):
+        """ Move the deadline, a later one is a plain assignment picked up lazily by the wheel """
+        previous = self.deadline
+        self.deadline = deadline
+        if deadline is None:
+            self._wheel.cancel(self)
+        elif self._timer_slot is None or previous is None or deadline < previous:
+            self._wheel.schedule(self)
+
+    def on_timeout(self):
+        """ Called by the TimerWheel, the pending wait raises TimeoutError, then the handler answers 408 """
+        waiter = self._waiter
+        if waiter is None or waiter.done():
+            return  # busy elsewhere, the next wait will see the expired deadline
+        if self._read_paused:
+            self._read_paused = False
+            self._loop.remove_reader(self)
+        if self._write_pause:
+            self._write_pause = False
+            self._loop.remove_writer(self)
+        self._waiter = None
+        waiter.set_exception(TimeoutError("%s timeout" % self.phase))
 
     # endregion
 
@@ -124,7 +319,7 @@ class StreamSock:
             self._server = None
         return False
 
-    async def __aiter__(self):
+    def __aiter__(self):
         return self
 
     async def __anext__(self):
@@ -133,16 +328,26 @@ class StreamSock:
             raise StopAsyncIteration
         return val
 
-    async def wait_stream_ready(self):
+    def wait_stream_ready(self):
+        """
+        The future to await until the stream is ready.
+        wait_stream_ready, pause_reading and wait_for_data are plain functions handing the future up,
+        an idle connection parks no coroutine frame for them.
+        """
         assert not self.closed, "warning: try to wait a closed connection"
+        if self.exception:
+            raise self.exception
         waiter = self._waiter
         assert waiter is None or waiter.cancelled() or waiter.done()
+        now = self._loop.time()
+        if self.is_stall_phase(self.phase):
+            self.touch(now + self.phase_timeout(self.phase))
+        elif self.deadline is not None and self.deadline <= now:
+            raise TimeoutError("%s timeout" % self.phase)
+        # no timer per wait, the wheel wakes this waiter up with TimeoutError when the deadline passes
         waiter = self._loop.create_future()
         self._waiter = waiter
-        try:
-            return await asyncio.wait_for(waiter, self.timeout)
-        except asyncio.TimeoutError:
-            raise TimeoutError
+        return waiter
 
     def _wakeup_waiter(self):
         """Wakeup  functions waiting for reading/writing data or EOF."""
@@ -159,38 +364,108 @@ class StreamSock:
 
     # region <close method>
 
+    def reset(self, loop, sock, server = None):
+        """ reused from an ObjectPool for a new connection """
+        self.__init__(loop, sock, server)
+
+    def clear(self):
+        """ entering an ObjectPool: its socket, server and last exception are not kept alive """
+        self._sock = None
+        self._server = None
+        self._waiter = None
+        self.exception = None
+        self.io = None
+
     def release_resource(self):
-        self._read_buffer.clear()
-        self._write_buffer.clear()
+        if self._wheel is not None:
+            self._wheel.cancel(self)
+        self._read_buffer = _EMPTY
+        self._write_buffer = _EMPTY
         self.socket.close()
         # self._sock = None
         # self._loop = None
 
-    def force_close(self):
+    def force_close(self, reason = "error"):
         """
         Close the transport immediately.
 
         Buffered data will be lost.  No more data will be received.
+        An idle or aborted connection is reset, nothing is on its way and no TIME_WAIT is left on our side.
         """
         if not self.closed:
             self._loop.remove_reader(self)
             self._loop.remove_writer(self)
-            self.socket.shutdown(socket.SHUT_RDWR)
+            if reason in ("idle", "abort"):
+                try:
+                    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, self._RESET_LINGER)
+                except OSError:
+                    pass
+            metrics.connection_closes[reason].inc()
         self.release_resource()
 
     async def close(self):
         """
         Close the transport.
 
-        Buffered data will be flushed asynchronously.  No more data will be received."""
-        # try to drain all data in self.timeout interval, and force close it
+        The buffered response is flushed, then the client of a response with a Content-Length has close_grace
+        seconds to close first, else our FIN is sent and its input discarded for lingering_timeout seconds at most (lingering close).
+        A connection which never received a byte, aborted or failed is closed right away.
+        """
         if self.closed:
             return
-        try:
-            await self.write_eof()
-        except Exception as e:
-            self.exception = e
-        self.force_close()
+        reason = "error"
+        if self.exception is None:
+            try:
+                reason = await self.linger()
+            except Exception as e:
+                self.exception = e
+        if isinstance(self.exception, ConnectionAbortedError):
+            reason = "abort"
+        self.force_close(reason)
+
+    async def linger(self):
+        """ flush, wait for the client to close, the reason of the close """
+        if self.idle and not self._read_eof:
+            return "idle"
+        self.set_write_buffer_limits(0)
+        await self.drain()
+        server = self._server
+        options = getattr(server, "socket_options", None)
+        if options is not None and "cork" in options.connection_options:
+            # push the last segment now, the client waits for it before closing
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        if self.delimited and await self.discard_until_eof(getattr(server, "close_grace", self.close_grace)):
+            return "client"
+        self.socket.shutdown(socket.SHUT_WR)
+        if await self.discard_until_eof(getattr(server, "lingering_timeout", self.lingering_timeout)):
+            return "lingering"
+        return "linger_timeout"
+
+    async def discard_until_eof(self, timeout):
+        """ True once the client closed its side within timeout seconds, what it sends meanwhile is dropped """
+        if not self._read_eof and timeout:
+            self.phase = self.CLOSE
+            self.touch(self._loop.time() + timeout)
+            try:
+                while not self._read_eof:
+                    self._read_buffer = _EMPTY
+                    await self.wait_for_data()
+            except TimeoutError:
+                pass
+        self._read_buffer = _EMPTY
+        return self._read_eof
+
+    def abort(self, exc = None):
+        """
+        Abort the connection from outside, e.g. on server shutdown.
+
+        The coroutine waiting on this stream raises `exc`, then the handler closes it as usual.
+        """
+        waiter = self._waiter
+        if self.exception is None:
+            self.exception = exc or ConnectionAbortedError("server is shutting down")
+        if waiter is not None and not waiter.done():
+            self._wakeup_waiter()
 
     def _fatal_error(self, exc, message = 'Fatal error on transport'):
         # Should be called from exception handler only.
@@ -213,11 +488,8 @@ class StreamSock:
         """
         self._read_eof = True
         self.log("received EOF")
-
         # We're keeping the connection open so the
-        # protocol can write more, but we still can't
-        # receive more, so remove the reader callback.
-        self.socket.shutdown(socket.SHUT_RD)
+        # protocol can write more, nothing more can be received: no shutdown(SHUT_RD) syscall needed
         return True
 
     async def write_eof(self):
@@ -232,11 +504,11 @@ class StreamSock:
         """
         self.log("wrote EOF")
         self._write_eof = True
-        # shutdown will be done in next drain
         # ensure next drain will send all data in write buffer
         self.set_write_buffer_limits(0)
-        # schedule the drain
         await self.drain()
+        self._sock.shutdown(socket.SHUT_WR)
+        self.log("sent EOF OK")
 
     # endregion
 
@@ -244,16 +516,19 @@ class StreamSock:
 
     # region <read-only>
 
-    async def pause_reading(self):
+    def pause_reading(self):
         """
         Pause all read method, wait to receive underlying data into read_buffer
         """
         assert not self._read_paused, 'Already paused'
+        # first: an expired deadline raises before the reader is registered
+        waiter = self.wait_stream_ready()
         self._read_paused = True
+        if self.io is not None:
+            self.io.read_pauses += 1
         self._loop.add_reader(self, self.feed_data_when_ready)
         self.log("pauses reading")
-        await self.wait_stream_ready()
-        self.log("pauses reading finished")
+        return waiter
 
     def resume_reading(self):
         """
@@ -271,20 +546,42 @@ class StreamSock:
             The argument is a bytes object.
         """
         assert not self._read_eof, "try to receive after feed EOF"
+        if self._receive():
+            self.resume_reading()
+
+    def _receive(self):
+        """ one recv() into the read buffer, True when it got data or EOF """
+        io = self.io
+        if io is not None:
+            io.recv_calls += 1
         try:
-            data = self._sock.recv(self._buffer_limit * 4)  # Buffer size passed to recv().
+            n = self._sock.recv_into(self._receive_view)
         except (BlockingIOError, InterruptedError):
-            pass
+            if io is not None:
+                io.eagain += 1
+            return False
         except Exception as e:
             self._fatal_error(e)
-        else:
-            if data:
+            return False
+        if n:
+            if self.idle:
+                self.idle = False
+                self.set_phase(self.HEADER)
+            data = self._receive_view[:n]
+            if self._read_buffer:
                 self._read_buffer.extend(data)
             else:
-                self.feed_eof()
-            self.resume_reading()
+                self._read_buffer = self.buffer_factory(data)
+            metrics.bytes_received.inc(n)
+            if io is not None:
+                io.bytes_in += n
+                if len(self._read_buffer) > io.peak_read_buffer:
+                    io.peak_read_buffer = len(self._read_buffer)
+        else:
+            self.feed_eof()
+        return True
 
-    async def wait_for_data(self):
+    def wait_for_data(self):
         """
         Wait until feed_data() or feed_eof() is called.
 
@@ -293,9 +590,15 @@ class StreamSock:
         # wait to receive data and fill into internal read_buffer, it is control by self.timeout
 
         assert not self._read_eof, '_wait_for_data after EOF'
+        if self.idle and self._receive():
+            # the request is usually there by the time its connection is accepted (always with TCP_DEFER_ACCEPT):
+            # read it right away, an eagerly started handler then runs without any poll round trip
+            ready = self._loop.create_future()
+            ready.set_result(None)
+            return ready
         # Waiting for data while paused will make deadlock, so prevent it.
         # This is essential for readexactly(n) for case when n > self._limit.
-        await self.pause_reading()
+        return self.pause_reading()
 
     # endregion
 
@@ -325,9 +628,19 @@ class StreamSock:
         """
         assert not self._write_pause
         self._write_pause = True
+        metrics.write_pauses.inc()
+        if self.io is not None:
+            self.io.write_pauses += 1
         self._loop.add_writer(self, self.write_data_when_ready)
         self.log("pauses writing")
-        await self.wait_stream_ready()
+        phase, deadline = self.phase, self.deadline
+        self.phase = self.WRITE
+        try:
+            await self.wait_stream_ready()
+        finally:
+            # back to the deadline of the reading side
+            self.phase = phase
+            self.touch(deadline)
         self.log("pause writing finished")
 
     def resume_write(self):
@@ -344,22 +657,39 @@ class StreamSock:
 
     def write_data_when_ready(self):
         assert self._write_buffer, 'Data should not be empty'
+        n = self._send()
+        if n is not None:
+            if n:
+                # progress, push the stall deadline back, O(1)
+                self.deadline = self._loop.time() + self.phase_timeout(self.WRITE)
+            # now can write more, need to be <=, because if zero is set to low water,
+            # this won call resume write while the write buffer is already empty
+            if self.get_write_buffer_size() <= self._low_water:
+                self.resume_write()  # wake up the waiter, which is usually self.drain who waited for
+
+    def _send(self):
+        """ one send() of the write buffer, the bytes the socket took, None when it failed """
+        io = self.io
+        if io is not None:
+            io.send_calls += 1
         try:
             n = self._sock.send(self._write_buffer)
         except (BlockingIOError, InterruptedError):
-            pass
+            if io is not None:
+                io.eagain += 1
+            return 0
         except Exception as e:
             self._fatal_error(e)
-        else:
-            if n:
+            return None
+        if n:
+            if n == len(self._write_buffer):
+                self._write_buffer = _EMPTY
+            else:
                 del self._write_buffer[:n]
-            # now can write more, need to be <=, because if zero is set to low water,
-            # this won call resume write while the write buffer is already empty
-            if self.get_write_buffer_size() <= self._low_water:
-                self.resume_write()  # wake up the waiter, which is usually self.drain who waited for
-                if self._write_eof and not self._write_buffer:
-                    self._sock.shutdown(socket.SHUT_WR)
-                    self.log("sent EOF OK")
+            metrics.bytes_sent.inc(n)
+            if io is not None:
+                io.bytes_out += n
+        return n
 
     async def drain(self):
         """
@@ -367,13 +697,23 @@ class StreamSock:
 
             The intended use is to write
 
-            w.write(data)
-            yield from w.drain()
+            await w.write(data)
+            await w.drain()
         """
         # drain until lower than low water when current write buffer exceed high water
         # if EOF was written wait to drain all
-        while self.get_write_buffer_size() > self._high_water:
-            await self.pause_writing()
+        if self.get_write_buffer_size() > self._high_water:
+            # the socket usually takes it all at once, only wait for it to be writable when it does not
+            if self._send() is None:
+                raise self.exception
+            if self.get_write_buffer_size() <= self._high_water:
+                return
+            start = self._loop.time()
+            try:
+                while self.get_write_buffer_size() > self._high_water:
+                    await self.pause_writing()
+            finally:
+                metrics.drain_latency.observe(self._loop.time() - start)
 
     # endregion
 
@@ -421,6 +761,10 @@ class StreamSock:
         """Return True if the buffer is empty and 'feed_eof' was called."""
         return self._read_eof and not self._read_buffer
 
+    def peek(self, n):
+        """ at most n bytes already in the read buffer, left there for the next read """
+        return bytes(self._read_buffer[:n])
+
     # endregion
 
     # region <StreamReader>
@@ -493,9 +837,7 @@ class StreamSock:
         if isep > limit:
             raise OverflowError
 
-        chunk = self._read_buffer[:isep + seplen]
-        del self._read_buffer[:isep + seplen]
-        return bytes(chunk)
+        return self._consume(isep + seplen)
 
     async def read(self, n = -1):
         """
@@ -519,8 +861,16 @@ class StreamSock:
             await self.wait_for_data()
 
         # This will work right even if buffer is less than n bytes
-        data = bytes(self._read_buffer[:n])
-        del self._read_buffer[:n]
+        return self._consume(n if n > 0 else len(self._read_buffer))
+
+    def _consume(self, n):
+        """ take n bytes from the read buffer, dropping it once emptied """
+        buffer = self._read_buffer
+        if n >= len(buffer):
+            self._read_buffer = _EMPTY
+            return bytes(buffer)
+        data = bytes(buffer[:n])
+        del buffer[:n]
         return data
 
     # endregion
@@ -544,8 +894,15 @@ class StreamSock:
             raise RuntimeError('Cannot call write() after write_eof()')
         if not data:
             return
+        # answered (e.g. a 408 before any request byte): closed gracefully, not reset as idle
+        self.idle = False
 
-        self._write_buffer.extend(data)  # Add it to the buffer.
+        if self._write_buffer:
+            self._write_buffer.extend(data)  # Add it to the buffer.
+        else:
+            self._write_buffer = self.buffer_factory(data)
+        if self.io is not None and len(self._write_buffer) > self.io.peak_write_buffer:
+            self.io.peak_write_buffer = len(self._write_buffer)
         return await self.drain()  # drain data if need
 
     async def writelines(self, list_of_data):
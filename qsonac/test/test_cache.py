@@ -0,0 +1,201 @@
+# coding=utf-8
+import asyncio
+import threading
+import time
+import unittest
+
+from qsonac.cache import CachedResponse, MemoryBackend, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def environ(path = "/", method = "GET", query = "", **headers):
+    environ = { "REQUEST_METHOD": method, "PATH_INFO": path, "QUERY_STRING": query }
+    environ.update(("HTTP_" + name.upper(), value) for name, value in headers.items())
+    return environ
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.calls = 0
+
+    def produce(self, status = "200 OK", headers = (("Content-Type", "text/plain"),)):
+        def produce():
+            self.calls += 1
+            return status, list(headers), b"body %d" % self.calls
+
+        return produce
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=1.0, clock=self.clock)
+        self.assertEqual(cache.fetch("k", self.produce()).body, b"body 1")
+        self.clock.now += 0.5
+        self.assertEqual(cache.fetch("k", self.produce()).body, b"body 1")
+        self.clock.now += 0.6
+        self.assertEqual(cache.fetch("k", self.produce()).body, b"body 2")
+
+    def test_not_stored(self):
+        cache = ResponseCache(clock=self.clock)
+        cache.fetch("error", self.produce("500 Internal Server Error"))
+        cache.fetch("cookie", self.produce(headers=[("Set-Cookie", "a=1")]))
+        cache.fetch("private", self.produce(headers=[("Cache-Control", "private, max-age=10")]))
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_key(self):
+        cache = ResponseCache(vary=("Accept-Encoding",))
+        self.assertEqual(cache.key(environ("/a", query="x=1", ACCEPT_ENCODING="gzip")), cache.key(environ("/a", query="x=1", ACCEPT_ENCODING="gzip", COOKIE="c")))
+        self.assertNotEqual(cache.key(environ("/a", ACCEPT_ENCODING="gzip")), cache.key(environ("/a", ACCEPT_ENCODING="br")))
+        self.assertNotEqual(cache.key(environ("/a", query="x=1")), cache.key(environ("/a", query="x=2")))
+        self.assertNotEqual(cache.key(environ("/a")), cache.key(environ("/a", method="HEAD")))
+
+    def test_lru_memory_bound(self):
+        entry_size = CachedResponse("200 OK", [], b"x" * 100).size
+        backend = MemoryBackend(max_bytes=entry_size * 3)
+        for key in "abc":
+            backend.set(key, CachedResponse("200 OK", [], b"x" * 100))
+        backend.get("a")
+        backend.set("d", CachedResponse("200 OK", [], b"x" * 100))
+        self.assertIsNone(backend.get("b"))
+        self.assertIsNotNone(backend.get("a"))
+        self.assertEqual(backend.size, entry_size * 3)
+        # never stored, bigger than the whole cache
+        backend.set("e", CachedResponse("200 OK", [], b"x" * entry_size * 3))
+        self.assertIsNone(backend.get("e"))
+
+    def test_stale_while_revalidate(self):
+        cache = ResponseCache(ttl=1.0, stale_while_revalidate=5.0, clock=self.clock)
+        loop = asyncio.new_event_loop()
+        try:
+            async def request():
+                return cache.fetch("k", self.produce()).body
+
+            self.assertEqual(loop.run_until_complete(request()), b"body 1")
+            self.clock.now += 2
+            # served stale, refreshed once after it
+            self.assertEqual(loop.run_until_complete(request()), b"body 1")
+            self.assertEqual(loop.run_until_complete(request()), b"body 2")
+            self.assertEqual(self.calls, 2)
+            self.clock.now += 10
+            self.assertEqual(loop.run_until_complete(request()), b"body 3")
+        finally:
+            loop.close()
+
+    def test_miss_during_a_refresh_on_the_same_loop(self):
+        cache = ResponseCache(ttl=1.0, stale_while_revalidate=5.0, clock=self.clock)
+        loop = asyncio.new_event_loop()
+        try:
+            async def requests():
+                cache.fetch("k", self.produce())
+                self.clock.now += 2
+                # served stale, the refresh queued on this loop
+                self.assertEqual(cache.fetch("k", self.produce()).body, b"body 1")
+                cache.invalidate("k")
+                # a miss before the loop got to the refresh does not wait for it
+                return cache.fetch("k", self.produce()).body
+
+            started = time.monotonic()
+            self.assertEqual(loop.run_until_complete(requests()), b"body 2")
+            self.assertLess(time.monotonic() - started, 1.0)
+            # the queued refresh was done already
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(self.calls, 2)
+        finally:
+            loop.close()
+
+    def test_single_flight(self):
+        cache = ResponseCache(clock=self.clock)
+        started = threading.Barrier(8)
+        results = []
+
+        def slow():
+            time.sleep(0.2)
+            return self.produce()()
+
+        def request():
+            started.wait()
+            results.append(cache.fetch("k", slow).body)
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [b"body 1"] * 8)
+
+    def test_single_flight_not_shared_when_not_stored(self):
+        cache = ResponseCache(clock=self.clock)
+        started = threading.Barrier(3)
+        results = []
+
+        def slow():
+            time.sleep(0.2)
+            return self.produce(headers=[("Set-Cookie", "session=user%d" % (self.calls + 1))])()
+
+        def request():
+            started.wait()
+            results.append(cache.fetch("k", slow).body)
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every waiter ran the application for its own response
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(sorted(results), [b"body 1", b"body 2", b"body 3"])
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_middleware(self):
+        def app(environ, start_response):
+            self.calls += 1
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"hello ", environ["PATH_INFO"].encode()]
+
+        cached = ResponseCache(clock=self.clock).wsgi(app)
+        for _ in range(3):
+            heads = []
+            body = b"".join(cached(environ("/x"), lambda status, headers: heads.append((status, headers))))
+            self.assertEqual(body, b"hello /x")
+            self.assertEqual(heads, [("200 OK", [("Content-Type", "text/plain")])])
+        b"".join(cached(environ("/x", method="POST"), lambda status, headers: None))
+        self.assertEqual(self.calls, 2)
+
+
+class TestApplicationCache(unittest.TestCase):
+    def test_route_cache(self):
+        from qsonac.application import Application
+        app = Application()
+        calls = []
+
+        @app.route("/cached", cache=True)
+        def cached(request):
+            calls.append(request.path)
+            return "cached %d" % len(calls)
+
+        @app.route("/fresh")
+        def fresh(request):
+            calls.append(request.path)
+            return "fresh %d" % len(calls)
+
+        def get(path):
+            heads = []
+            body = b"".join(app(environ(path), lambda status, headers: heads.append(status)))
+            return heads[0], body
+
+        self.assertEqual(get("/cached"), ("200 OK", b"cached 1"))
+        self.assertEqual(get("/cached"), ("200 OK", b"cached 1"))
+        self.assertEqual(get("/fresh"), ("200 OK", b"fresh 2"))
+        self.assertEqual(get("/fresh"), ("200 OK", b"fresh 3"))
+        self.assertIs(app.route_caches[cached], app.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# coding=utf-8
+import gc
+import unittest
+
+from qsonac import metrics
+from qsonac.gctuning import GCTuning
+
+
+class TestGCTuning(unittest.TestCase):
+    def setUp(self):
+        self.thresholds = gc.get_threshold()
+
+    def tearDown(self):
+        gc.set_threshold(*self.thresholds)
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+
+    def apply(self, **options):
+        tuning = GCTuning(**options)
+        report = tuning.apply()
+        self.addCleanup(lambda: tuning.on_collection in gc.callbacks and gc.callbacks.remove(tuning.on_collection))
+        return tuning, report
+
+    def test_pause_metrics(self):
+        tuning, _ = self.apply(freeze=False)
+        full, young = metrics.gc_full_pause.count, metrics.gc_young_pause.count
+        collections = [metrics.gc_collections[generation].value for generation in (0, 1, 2)]
+        gc.collect()
+        gc.collect(0)
+        self.assertEqual(metrics.gc_full_pause.count, full + 1)
+        self.assertEqual(metrics.gc_young_pause.count, young + 1)
+        self.assertEqual(metrics.gc_collections[2].value, collections[2] + 1)
+        self.assertEqual(metrics.gc_collections[0].value, collections[0] + 1)
+        # applied twice, timed once
+        tuning.apply()
+        self.assertEqual(gc.callbacks.count(tuning.on_collection), 1)
+
+    def test_thresholds(self):
+        _, report = self.apply(freeze=False, pause_metrics=False, thresholds=(50000, 20, 100))
+        self.assertEqual(gc.get_threshold(), (50000, 20, 100))
+        self.assertIn("thresholds=50000/20/100", report)
+        with self.assertRaises(ValueError):
+            GCTuning(thresholds=(1, 2, 3, 4))
+
+    @unittest.skipUnless(hasattr(gc, "freeze"), "gc.freeze() needs python 3.7+")
+    def test_freeze(self):
+        kept = [[] for _ in range(100)]
+        _, report = self.apply(pause_metrics=False)
+        self.assertGreaterEqual(gc.get_freeze_count(), len(kept))
+        self.assertIn("objects frozen", report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 # coding=utf-8
+import asyncio
+import logging
 import socket
 import unittest
 
 from config import Config
+from qsonac import metrics
+from qsonac.asynchttpserver import AsyncHTTPServer
+from qsonac.handler import makeWSGIhandler
 
 test_request = b"\r\n".join([
     b'GET / HTTP/1.1',
@@ -132,3 +137,86 @@ class TestHandler(unittest.TestCase):
         finally:
             sock1.close()
             sock2.close()
+
+
+class ServedInProcess(unittest.TestCase):
+    """ one connection at a time through AsyncHTTPServer.handle_one_request, over TCP on the loopback """
+
+    app = None
+    options = { }
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncHTTPServer(makeWSGIhandler(type(self).app), ("127.0.0.1", 0), self.loop, **self.options)
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+
+    def tearDown(self):
+        self.listener.close()
+        self.loop.close()
+
+    def connect(self, rcvbuf = None):
+        client = socket.socket()
+        if rcvbuf:
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        client.connect(self.listener.getsockname())
+        client.settimeout(1)
+        self.addCleanup(client.close)
+        sock, address = self.listener.accept()
+        sock.setblocking(False)
+        return client, sock, address
+
+    def handle(self, sock, address):
+        self.loop.run_until_complete(AsyncHTTPServer.handle_one_request(sock, address, self.server, self.loop))
+
+
+def big_body(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(4 << 20))])
+    return [b"x" * (4 << 20)]
+
+
+class TestWriteTimeout(ServedInProcess):
+    app = big_body
+    options = dict(write_timeout=0.2)
+
+    def test_response_cut_not_answered_408(self):
+        aborts = metrics.connection_closes["abort"].value
+        # the client takes the head and a part of the body, then stops reading
+        client, sock, address = self.connect(rcvbuf=4096)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        client.sendall(b"GET /big HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+        self.handle(sock, address)
+        self.assertEqual(metrics.connection_closes["abort"].value, aborts + 1)
+        received = bytearray()
+        with self.assertRaises(ConnectionResetError):
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                received.extend(chunk)
+        self.assertNotIn(b"408", received)
+        self.assertLess(len(received), 4 << 20)
+
+
+def hello(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "5")])
+    return [b"hello"]
+
+
+class TestDrain(ServedInProcess):
+    app = hello
+
+    def test_idle_connection_closed_quietly(self):
+        errors = []
+        handler = logging.Handler(logging.ERROR)
+        handler.emit = errors.append
+        logging.getLogger("qsonac.handler").addHandler(handler)
+        self.addCleanup(logging.getLogger("qsonac.handler").removeHandler, handler)
+        aborts = metrics.connection_closes["abort"].value
+        # a keep-alive connection without a request yet when the server drains
+        client, sock, address = self.connect()
+        self.loop.call_later(0.05, self.server.abort_connections, True)
+        self.handle(sock, address)
+        self.assertEqual(errors, [])
+        self.assertEqual(metrics.connection_closes["abort"].value, aborts + 1)
@@ -0,0 +1,85 @@
+# coding=utf-8
+import asyncio
+import socket
+import unittest
+
+from qsonac.streamsock import IOStats, StreamSock
+
+
+def connection(recv_calls, send_calls, bytes_in, bytes_out, peak_write_buffer = 0):
+    io = IOStats()
+    io.recv_calls = recv_calls
+    io.send_calls = send_calls
+    io.bytes_in = bytes_in
+    io.bytes_out = bytes_out
+    io.peak_write_buffer = peak_write_buffer
+    return io
+
+
+class TestIOStats(unittest.TestCase):
+    def test_syscall_bound(self):
+        self.assertTrue(connection(40, 40, 800, 800).is_syscall_bound())
+        self.assertFalse(connection(1, 3, 200, 190000).is_syscall_bound())
+        self.assertFalse(IOStats().is_syscall_bound())
+
+    def test_add_and_merge(self):
+        loop_a, loop_b = IOStats(), IOStats()
+        loop_a.add(connection(40, 40, 800, 800, peak_write_buffer=800))
+        loop_a.add(connection(1, 3, 200, 190000, peak_write_buffer=65536))
+        loop_b.add(connection(2, 2, 300, 300, peak_write_buffer=300))
+        summary = IOStats()
+        summary.merge(loop_a)
+        summary.merge(loop_b)
+        self.assertEqual(summary.connections, 3)
+        self.assertEqual(summary.syscall_bound, 2)
+        self.assertEqual(summary.send_calls, 45)
+        self.assertEqual(summary.bytes_out, 191100)
+        self.assertEqual(summary.peak_write_buffer, 65536)
+
+
+
+class TestConnectionAccounting(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        server_side, self.client = socket.socketpair()
+        # small kernel buffers, a big response cannot be sent at once
+        server_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        self.client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        server_side.setblocking(False)
+        self.client.setblocking(False)
+        self.stream = StreamSock(self.loop, server_side)
+        self.stream.setup()
+        self.stream.io = IOStats()
+
+    def tearDown(self):
+        self.stream.force_close()
+        self.client.close()
+        self.loop.close()
+
+    def test_real_io(self):
+        io = self.stream.io
+        # nothing to read yet: one recv() answering EAGAIN, then waiting for the socket
+        waiter = self.stream.wait_for_data()
+        self.assertEqual((io.recv_calls, io.eagain, io.read_pauses), (1, 1, 1))
+        self.client.sendall(b"ping")
+        self.loop.run_until_complete(waiter)
+        self.assertEqual(self.loop.run_until_complete(self.stream.read(4)), b"ping")
+        self.assertEqual((io.recv_calls, io.bytes_in, io.peak_read_buffer), (2, 4, 4))
+
+        # the socket takes a part of the response, the rest waits for the client to read
+        received = bytearray()
+        self.loop.add_reader(self.client, lambda: received.extend(self.client.recv(65536)))
+        response = b"x" * (1 << 20)
+        # until all of it is sent
+        self.stream.set_write_buffer_limits(0)
+        self.loop.run_until_complete(self.stream.write(response))
+        self.loop.remove_reader(self.client)
+        self.assertEqual(io.bytes_out, len(response))
+        self.assertEqual(io.peak_write_buffer, len(response))
+        self.assertGreater(io.send_calls, 1)
+        self.assertGreaterEqual(io.write_pauses, 1)
+        self.assertFalse(io.is_syscall_bound())
+
+
+if __name__ == '__main__':
+    unittest.main()
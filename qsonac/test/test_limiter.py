@@ -0,0 +1,87 @@
+# coding=utf-8
+import asyncio
+import time
+import unittest
+
+from qsonac.asynchttpserver import AsyncHTTPServer
+from qsonac.handler import makeWSGIhandler
+from qsonac.limiter import ConcurrencyLimiter
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = ConcurrencyLimiter(initial_limit=4, min_limit=2, max_limit=8, window=0.1)
+
+    def next_window(self):
+        self.limiter.update(self.limiter._window_end)
+
+    def test_sheds_over_the_limit(self):
+        for _ in range(4):
+            self.assertTrue(self.limiter.try_acquire())
+        self.assertFalse(self.limiter.try_acquire())
+        self.assertEqual(self.limiter.shed, 1)
+        self.limiter.release(0.01)
+        self.assertTrue(self.limiter.try_acquire())
+
+    def test_grows_when_saturated_and_healthy(self):
+        for _ in range(4):
+            self.limiter.try_acquire()
+        for _ in range(4):
+            self.limiter.release(0.01)
+        self.next_window()
+        self.assertEqual(self.limiter.limit, 5)
+
+    def test_does_not_grow_when_unused(self):
+        self.limiter.try_acquire()
+        self.limiter.release(0.01)
+        self.next_window()
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_backs_off_on_latency(self):
+        for latency in [0.01] * 5 + [0.2] * 30:
+            self.limiter.try_acquire()
+            self.limiter.release(latency)
+        self.assertTrue(self.limiter.overloaded)
+        self.next_window()
+        self.assertLess(self.limiter.limit, 4)
+
+    def test_backs_off_on_loop_lag(self):
+        for _ in range(50):
+            self.limiter.observe_lag(0.3)
+        self.assertTrue(self.limiter.overloaded)
+        for _ in range(20):
+            self.next_window()
+        self.assertEqual(self.limiter.limit, 2)
+
+
+    def test_lag_probe(self):
+        loop = asyncio.new_event_loop()
+        try:
+            limiter = ConcurrencyLimiter(lag_interval=0.01)
+            limiter.start_lag_probe(loop)
+            loop.run_until_complete(asyncio.sleep(0.1))
+            self.assertLess(limiter.lag, limiter.max_lag)
+            # callbacks holding the loop for 0.1s each delay the probe as much
+            for delay in range(1, 11):
+                loop.call_later(delay * 0.01, time.sleep, 0.1)
+            loop.run_until_complete(asyncio.sleep(0.2))
+            self.assertTrue(limiter.overloaded)
+            limiter.stop_lag_probe()
+            self.assertIsNone(limiter._probe)
+        finally:
+            loop.close()
+
+
+class TestServerLimiters(unittest.TestCase):
+    def test_priority_path_with_a_query(self):
+        loop = asyncio.new_event_loop()
+        try:
+            server = AsyncHTTPServer(makeWSGIhandler(None), ("127.0.0.1", 0), loop, concurrency_limit=True, metrics_path="/metrics")
+            self.assertIsNone(server.request_limiter(loop, "/metrics?x=1"))
+            self.assertIs(server.request_limiter(loop, "/api?x=1"), server.limiters[loop])
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# coding=utf-8
+import asyncio
+import os
+import socket
+import stat
+import tempfile
+import unittest
+
+from qsonac import listeners
+from qsonac.streamsock import StreamSock
+
+
+class TestAddresses(unittest.TestCase):
+    def test_parse_address(self):
+        self.assertEqual(listeners.parse_address("127.0.0.1:8080"), ("127.0.0.1", 8080))
+        self.assertEqual(listeners.parse_address("[::]:8080"), ("::", 8080))
+        self.assertEqual(listeners.parse_address(("::1", 80)), ("::1", 80))
+        self.assertEqual(listeners.parse_address("unix:/run/app.sock"), "unix:/run/app.sock")
+        self.assertEqual(listeners.family_of(("::", 80)), socket.AF_INET6)
+        self.assertEqual(listeners.family_of("unix:/run/app.sock"), socket.AF_UNIX)
+        self.assertEqual(listeners.describe(("::", 80)), "http://[::]:80")
+
+
+class TestUnixListener(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "app.sock")
+        self.address = listeners.UNIX_PREFIX + self.path
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.rmdir(self.dir)
+
+    def test_mode_and_unlink(self):
+        sock = listeners.open_listener(self.address, mode=0o660)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o660)
+        finally:
+            listeners.unlink(sock)
+            sock.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_stale_socket_file(self):
+        # left by a dead server
+        dead = socket.socket(socket.AF_UNIX)
+        dead.bind(self.path)
+        dead.close()
+        sock = listeners.open_listener(self.address)
+        try:
+            # a live server keeps its socket file
+            with self.assertRaises(OSError):
+                listeners.open_listener(self.address)
+        finally:
+            sock.close()
+
+    def test_unix_peer_address(self):
+        loop = asyncio.new_event_loop()
+        server, client = socket.socketpair()
+        try:
+            stream = StreamSock(loop, server)
+            self.assertEqual(stream.remote_address, StreamSock.UNIX_PEER)
+            self.assertEqual(stream.server_address, StreamSock.UNIX_SERVER)
+        finally:
+            server.close()
+            client.close()
+            loop.close()
+
+
+class TestSocketOptions(unittest.TestCase):
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            listeners.SocketOptions(rcvbuf=-1)
+        with self.assertRaises(ValueError):
+            listeners.SocketOptions(keepalive=(60, 10))
+
+    def test_apply(self):
+        options = listeners.SocketOptions(defer_accept=1, sndbuf=1 << 16, keepalive=(60, 10, 5), quickack=True, cork=True)
+        sock = listeners.open_listener(("127.0.0.1", 0), options=options)
+        client = socket.create_connection(sock.getsockname())
+        try:
+            report = options.apply(sock)
+            self.assertIn("keepalive=60/10/5", report)
+            self.assertIn("defer_accept=1", report)
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 60)
+            client.sendall(b"GET")
+            sock.setblocking(True)
+            conn, _ = sock.accept()
+            StreamSock.configure_connection(conn, options)
+            self.assertTrue(conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK))
+            self.assertTrue(conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            # inherited from the listening socket
+            self.assertTrue(conn.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+            conn.close()
+        finally:
+            client.close()
+            sock.close()
+
+    def test_nothing_asked(self):
+        sock = socket.socket()
+        try:
+            self.assertEqual(listeners.SocketOptions(nodelay=False).apply(sock), "kernel defaults")
+        finally:
+            sock.close()
+
+
+class TestSocketActivation(unittest.TestCase):
+    def test_adopt_fd(self):
+        sock = socket.socket(socket.AF_INET6)
+        sock.bind(("::1", 0))
+        sock.listen(1)
+        adopted = listeners.adopt_fd(os.dup(sock.fileno()))
+        try:
+            self.assertEqual(adopted.family, socket.AF_INET6)
+            self.assertEqual(adopted.getsockname()[:2], sock.getsockname()[:2])
+        finally:
+            adopted.close()
+            sock.close()
+
+    def test_listen_fds_of_another_process(self):
+        os.environ.update(LISTEN_PID=str(os.getpid() + 1), LISTEN_FDS="1")
+        self.assertEqual(listeners.listen_fds(), [])
+        self.assertNotIn("LISTEN_FDS", os.environ)
+        self.assertEqual(listeners.listen_fds(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# coding=utf-8
+import asyncio
+import unittest
+
+from qsonac.loadgen import LoadGenerator, build_request, corrected, read_response
+from qsonac.metrics import Registry
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def parse(self, data):
+        reader = asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return self.loop.run_until_complete(read_response(reader))
+
+    def test_build_request(self):
+        raw = build_request("127.0.0.1", 80, "POST", "/api", { "X-A": "1" }, "{}", keepalive=False)
+        self.assertTrue(raw.startswith(b"POST /api HTTP/1.1\r\nHost: 127.0.0.1:80\r\nX-A: 1\r\n"))
+        self.assertIn(b"Content-Length: 2\r\nConnection: close\r\n\r\n{}", raw)
+
+    def test_read_response(self):
+        self.assertEqual(self.parse(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"), (200, False))
+        self.assertEqual(self.parse(b"HTTP/1.1 503 Busy\r\nConnection: close\r\nContent-Length: 0\r\n\r\n"), (503, True))
+        self.assertEqual(self.parse(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nok\r\n0\r\n\r\n"), (200, False))
+        self.assertEqual(self.parse(b"HTTP/1.1 200 OK\r\n\r\nuntil the end"), (200, True))
+
+    def test_coordinated_omission_correction(self):
+        histogram = Registry().histogram("latency", sub_buckets=16)
+        for _ in range(99):
+            histogram.observe(0.001)
+        histogram.observe(1.0)
+        self.assertLess(histogram.percentile(99), 0.0011)
+        fixed = corrected(histogram, 0.001)
+        # the stalled second hid about a thousand requests
+        self.assertGreater(fixed.count, 1000)
+        self.assertGreater(fixed.percentile(99), 0.5)
+
+    def test_correction_stays_in_the_buckets(self):
+        histogram = Registry().histogram("latency", sub_buckets=16)
+        for latency in (0.0004, 0.0009, 0.0021, 0.0131):
+            histogram.observe(latency)
+        # no gap to fill: the same buckets
+        self.assertEqual(corrected(histogram, 1.0).bucket_counts(), histogram.bucket_counts())
+        fixed = corrected(histogram, 0.001)
+        for q in (50, 90, 99, 99.9, 100):
+            self.assertLessEqual(fixed.percentile(q), histogram.percentile(100))
+
+    def test_percentiles_not_past_the_max(self):
+        generator = LoadGenerator(loop=self.loop)
+        for latency in (0.0004, 0.0009, 0.0131):
+            generator.latency.observe(latency)
+            generator.statuses[200] += 1
+        generator.max_latency = 0.0131
+        generator.elapsed = 1.0
+        latency = generator.report()["latency"]
+        self.assertTrue(all(latency[q] <= 0.0131 for q in ("p50", "p90", "p99", "p999")), latency)
+
+    def test_against_a_server(self):
+        async def handle(reader, writer):
+            while True:
+                try:
+                    await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            writer.close()
+
+        server = self.loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        try:
+            for rate in (None, 200):
+                generator = LoadGenerator("127.0.0.1", port, connections=2, duration=0.3, rate=rate, pipeline=2, loop=self.loop)
+                report = self.loop.run_until_complete(generator.run())
+                self.assertGreater(report["completed"], 10)
+                self.assertEqual(report["errors"], { })
+                self.assertEqual(report["connects"], 2)
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# coding=utf-8
+import gc
+import os
+import tempfile
+import unittest
+
+from qsonac import logs
+from qsonac.logs import AccessLog
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".log")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_restart(self):
+        log = AccessLog(self.path, flush_interval=0.01)
+        for request in range(2):
+            log.start()
+            log.record("127.0.0.1", "GET", "/%d" % request, "HTTP/1.1", 200, 5, 0.001)
+            log.stop()
+            # the file opened from the path is closed once stopped
+            self.assertTrue(log.stream.closed)
+        log.start()
+        self.assertTrue(log._writer.is_alive())
+        log.stop()
+        with open(self.path) as f:
+            self.assertEqual([line.split('"')[1] for line in f], ["GET /0 HTTP/1.1", "GET /1 HTTP/1.1"])
+
+
+class TestTraced(unittest.TestCase):
+    def test_classes_not_kept_alive(self):
+        @logs.traced
+        class Traced:
+            def debug_log(self, *args):
+                pass
+
+        self.assertIn(Traced, logs._traced)
+        # the handler classes of earlier tests, unreachable but not collected yet
+        gc.collect()
+        count = len(logs._traced)
+        del Traced
+        gc.collect()
+        self.assertEqual(len(logs._traced), count - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
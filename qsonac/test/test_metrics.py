@@ -0,0 +1,118 @@
+# coding=utf-8
+import math
+import os
+import unittest
+
+from qsonac.metrics import Registry, StatsSegment
+
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.histogram = self.registry.histogram("latency_seconds", "latency")
+
+    def test_bucket_bounds(self):
+        for value in (1e-6, 0.00042, 0.003, 0.5, 1.0, 1.7, 12.0):
+            index = self.histogram.bucket(value)
+            self.assertLessEqual(value, self.histogram.upper_bound(index))
+            # a bucket includes its lower bound
+            self.assertGreaterEqual(value, self.histogram.upper_bound(index - 1))
+
+    def test_relative_error(self):
+        for value in (0.00013, 0.0021, 0.077, 3.3):
+            bound = self.histogram.upper_bound(self.histogram.bucket(value))
+            self.assertLessEqual((bound - value) / value, 1.0 / self.histogram.sub_buckets)
+
+    def test_out_of_range(self):
+        self.assertEqual(self.histogram.bucket(0), 0)
+        self.assertEqual(self.histogram.bucket(1e6), self.histogram.size - 1)
+        self.assertEqual(self.histogram.upper_bound(self.histogram.size - 1), math.inf)
+
+    def test_percentile(self):
+        for _ in range(99):
+            self.histogram.observe(0.001)
+        self.histogram.observe(2.0)
+        self.assertEqual(self.histogram.count, 100)
+        self.assertAlmostEqual(self.histogram.sum, 2.099)
+        self.assertLess(self.histogram.percentile(50), 0.0013)
+        self.assertGreaterEqual(self.histogram.percentile(100), 2.0)
+
+    def test_storage_is_shared(self):
+        counter = self.registry.counter("requests_total")
+        counter.inc(3)
+        self.histogram.observe(0.01)
+        self.assertEqual(len(self.registry.counts), self.histogram.size + 1)
+        self.assertEqual(counter.value, 3)
+
+    def test_render(self):
+        self.registry.counter("requests_total", "requests").inc(2)
+        self.histogram.observe(0.01)
+        self.registry.gauge("open", "open connections", lambda: 7)
+        text = self.registry.render()
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("latency_seconds_count 1", text)
+        self.assertIn("requests_total 2", text)
+        self.assertIn("open 7", text)
+
+    def test_counter_family(self):
+        closes = self.registry.counter_family("closes_total", "closes", "reason", ("client", "idle"))
+        closes["client"].inc(2)
+        closes["idle"].inc()
+        self.assertEqual(len(self.registry.counts), self.histogram.size + 2)
+        text = self.registry.render()
+        self.assertEqual(text.count("# TYPE closes_total counter"), 1)
+        self.assertIn('closes_total{reason="client"} 2', text)
+        self.assertIn('closes_total{reason="idle"} 1', text)
+
+
+
+class TestStatsSegment(unittest.TestCase):
+    def test_workers_aggregate(self):
+        registry = Registry()
+        counter = registry.counter("requests_total")
+        histogram = registry.histogram("latency_seconds")
+        segment = StatsSegment(registry, 3)
+        pids = []
+        for index in range(3):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    segment.attach(index)
+                    counter.inc(index + 1)
+                    for _ in range(index + 1):
+                        histogram.observe(0.5)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        # the parent is not attached, its own registry is untouched
+        self.assertEqual(counter.value, 0)
+        self.assertEqual([segment.value(counter, index) for index in range(3)], [1, 2, 3])
+        counts, sums = segment.aggregate()
+        self.assertEqual(histogram.percentile(50, counts), histogram.upper_bound(histogram.bucket(0.5)))
+        text = registry.render(counts, sums)
+        self.assertIn("requests_total 6", text)
+        self.assertIn("latency_seconds_count 6", text)
+        self.assertIn("latency_seconds_sum 3", text)
+
+    def test_attached_render(self):
+        registry = Registry()
+        counter = registry.counter("requests_total")
+        segment = StatsSegment(registry, 2)
+        segment.slot(1)[0][counter._offset] = 5
+        segment.attach(0)
+        counter.inc()
+        self.assertEqual(counter.value, 1)
+        self.assertIn("requests_total 6", registry.render())
+
+    def test_layout_is_fixed(self):
+        registry = Registry()
+        segment = StatsSegment(registry, 1)
+        registry.counter("late_total")
+        self.assertRaises(ValueError, segment.attach, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding=utf-8
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from qsonac.monitor import LoopMonitor
+
+
+class Handler:
+    request_id = 42
+    command = "GET"
+    path = "/slow"
+
+    def block(self):
+        time.sleep(0.3)
+
+
+class TestLoopMonitor(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.path = os.path.join(tempfile.mkdtemp(), "stalls.txt")
+        self.monitor = LoopMonitor(self.loop, interval=0.02, threshold=0.05, sample_interval=0.01, path=self.path)
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.loop.close()
+
+    def run_loop(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_healthy_loop_is_not_sampled(self):
+        self.monitor.start()
+        self.run_loop(0.2)
+        self.assertEqual(self.monitor.samples, 0)
+
+    def test_stall_is_sampled(self):
+        self.monitor.start()
+        self.loop.call_later(0.05, Handler().block)
+        self.run_loop(0.5)
+        self.monitor.stop()
+        self.assertGreater(self.monitor.samples, 0)
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith("# "))
+        self.assertIn("request=42 GET /slow", lines[0])
+        self.assertTrue(lines[1].endswith("block (test_monitor.py) 1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
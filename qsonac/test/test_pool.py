@@ -0,0 +1,55 @@
+# coding=utf-8
+import unittest
+
+from qsonac.pool import ObjectPool
+
+
+class Pooled:
+    def __init__(self, value):
+        self.value = value
+        self.cleared = False
+
+    def reset(self, value):
+        self.__init__(value)
+
+    def clear(self):
+        self.value = None
+        self.cleared = True
+
+
+class TestObjectPool(unittest.TestCase):
+    def test_reuse(self):
+        pool = ObjectPool(Pooled, size=2)
+        obj = pool.acquire(1)
+        self.assertTrue(pool.release(obj))
+        self.assertTrue(obj.cleared)
+        self.assertIs(pool.acquire(2), obj)
+        self.assertEqual(obj.value, 2)
+        self.assertEqual(len(pool), 0)
+
+    def test_bounded(self):
+        discarded = []
+        pool = ObjectPool(Pooled, size=2, discard=discarded.append)
+        objs = [pool.acquire(i) for i in range(3)]
+        self.assertEqual([pool.release(objs.pop()) for _ in range(3)], [True, True, False])
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(len(discarded), 1)
+
+    def test_referenced_elsewhere(self):
+        pool = ObjectPool(Pooled)
+        obj = pool.acquire(1)
+        kept = [obj]
+        self.assertFalse(pool.release(obj))
+        self.assertEqual(obj.value, 1)
+        kept.clear()
+        self.assertTrue(pool.release(obj))
+
+    def test_disabled(self):
+        pool = ObjectPool(Pooled, size=0)
+        obj = pool.acquire(1)
+        self.assertFalse(pool.release(obj))
+        self.assertIsNot(pool.acquire(2), obj)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# coding=utf-8
+import itertools
+import signal
+import unittest
+from unittest import mock
+
+from qsonac import prefork
+from qsonac.prefork import PreforkSupervisor, READY, RETIRING
+
+
+def FakeSupervisor(**options):
+    return PreforkSupervisor(None, ("127.0.0.1", 0), **options)
+
+
+class ForkPatched(unittest.TestCase):
+    """ the real spawn() with os.fork() returning the pids 101, 102, ... in the supervisor """
+
+    def setUp(self):
+        patcher = mock.patch.object(prefork.os, "fork", side_effect=itertools.count(101))
+        self.fork = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def slots(self, supervisor):
+        return { pid: (index, slot) for pid, (index, _, slot) in supervisor.children.items() }
+
+
+class TestWorkerRecycling(ForkPatched):
+    def test_successor_before_drain(self):
+        supervisor = FakeSupervisor(workers=2, max_requests=10)
+        for index in range(2):
+            supervisor.spawn(index)
+        supervisor.states[1] = RETIRING
+        with mock.patch("os.kill") as kill:
+            supervisor.replace_retiring_workers()
+            # forked in the spare slot of worker 1, the old one keeps serving
+            self.assertEqual(self.slots(supervisor)[103], (1, 3))
+            self.assertEqual(supervisor.states[3], prefork.STARTING)
+            self.assertEqual(supervisor.successors, { 102: 103 })
+            supervisor.replace_retiring_workers()
+            kill.assert_not_called()
+            supervisor.states[3] = READY
+            supervisor.replace_retiring_workers()
+            kill.assert_called_once_with(102, signal.SIGTERM)
+            supervisor.replace_retiring_workers()
+            self.assertEqual(kill.call_count, 1)
+        self.assertEqual(len(supervisor.children), 3)
+        self.assertEqual(self.fork.call_count, 3)
+
+    def test_no_third_worker_while_draining(self):
+        supervisor = FakeSupervisor(workers=1)
+        supervisor.spawn(0)
+        supervisor.states[0] = RETIRING
+        with mock.patch("os.kill"):
+            supervisor.replace_retiring_workers()
+            supervisor.states[1] = READY
+            supervisor.replace_retiring_workers()
+            # the successor retires before its predecessor is gone
+            supervisor.states[1] = RETIRING
+            supervisor.replace_retiring_workers()
+        self.assertEqual(sorted(supervisor.children), [101, 102])
+        self.assertEqual(self.fork.call_count, 2)
+        self.assertEqual(supervisor.running_indexes(), { 0 })
+
+    def test_total_requests_across_recycling(self):
+        supervisor = FakeSupervisor(workers=1, max_requests=10)
+        supervisor.spawn(0)
+        supervisor.request_counts[0] = 10
+        supervisor.states[0] = RETIRING
+        with mock.patch("os.kill"):
+            supervisor.replace_retiring_workers()
+            supervisor.states[1] = READY
+            supervisor.replace_retiring_workers()
+        supervisor.request_counts[1] = 3
+        with mock.patch("os.waitpid", side_effect=[(101, 0), (0, 0)]):
+            supervisor.reap_workers()
+        # the slot of the retired worker is taken by the next successor
+        supervisor.states[1] = RETIRING
+        with mock.patch("os.kill"):
+            supervisor.replace_retiring_workers()
+        self.assertEqual(self.slots(supervisor)[103], (0, 0))
+        self.assertEqual(supervisor.request_counts[0], 0)
+        self.assertEqual(supervisor.total_requests(), 13)
+
+    def test_rss(self):
+        self.assertGreater(prefork.rss(), 1 << 20)
+
+
+class TestHandoff(ForkPatched):
+    def test_acknowledged_once_the_workers_are_ready(self):
+        handoff = mock.Mock()
+        supervisor = FakeSupervisor(workers=2, handoff=handoff)
+        supervisor.spawn(0)
+        supervisor.states[0] = READY
+        supervisor.acknowledge_handoff()
+        supervisor.spawn(1)
+        supervisor.acknowledge_handoff()
+        handoff.acknowledge.assert_not_called()
+        supervisor.states[1] = READY
+        supervisor.acknowledge_handoff()
+        supervisor.acknowledge_handoff()
+        handoff.acknowledge.assert_called_once_with()
+
+    def test_reexec_signal_ignored(self):
+        supervisor = FakeSupervisor(workers=1)
+        supervisor.spawn(0)
+        supervisor.pending_signals.append(signal.SIGUSR2)
+        with mock.patch("os.kill") as kill:
+            supervisor.handle_signals()
+        kill.assert_not_called()
+        self.assertFalse(supervisor.stopping)
+
+
+if __name__ == '__main__':
+    unittest.main()
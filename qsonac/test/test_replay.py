@@ -0,0 +1,150 @@
+# coding=utf-8
+import asyncio
+import io
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+from qsonac.asynchttpserver import AsyncHTTPServer
+from qsonac.handler import makeWSGIhandler
+from qsonac.loadgen import build_request
+from qsonac.logs import TrafficCapture
+from qsonac.replay import Replayer, load_capture, recorded_report
+
+
+class TestTrafficCapture(unittest.TestCase):
+    def test_format(self):
+        stream = io.StringIO()
+        capture = TrafficCapture(stream)
+        capture.record("POST", "/api?x=1", { "Host": " 127.0.0.1", "content-length": " 10", "": "" }, b"name=a&", "200", 17, 0.5)
+        capture.flush()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry["method"], "POST")
+        self.assertEqual(entry["path"], "/api?x=1")
+        self.assertEqual(entry["headers"], { "Host": "127.0.0.1", "content-length": "10" })
+        self.assertEqual(entry["body_length"], 10)
+        self.assertEqual(entry["body"], "name=a&")
+        self.assertEqual((entry["status"], entry["bytes"], entry["latency"]), (200, 17, 0.5))
+        # the arrival is back by the latency
+        self.assertAlmostEqual(entry["offset"], -0.5, delta=0.1)
+
+    def test_head_timeout(self):
+        # the request line came, the headers never did: answered 408 and still captured, by a fresh then a pooled handler
+        stream = io.StringIO()
+        capture = TrafficCapture(stream)
+        loop = asyncio.new_event_loop()
+        server = AsyncHTTPServer(makeWSGIhandler(lambda environ, start_response: []), ("127.0.0.1", 0), loop, capture=capture,
+                                 header_timeout=0.1, close_grace=0.05, lingering_timeout=0.05)
+        try:
+            for _ in range(2):
+                server_side, client = socket.socketpair()
+                server_side.setblocking(False)
+                client.sendall(b"GET /slow HTTP/1.1\r\nHost: 127.0.0.1\r\n")
+                loop.run_until_complete(AsyncHTTPServer.handle_one_request(server_side, ("127.0.0.1", 0), server, loop))
+                self.assertIn(b"408", client.recv(4096))
+                client.close()
+        finally:
+            loop.close()
+        capture.flush()
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(entry["method"], entry["path"], entry["status"]) for entry in entries], [("GET", "/slow", 408)] * 2)
+        self.assertEqual(entries[0]["headers"], { })
+        # a record without any head is formatted too
+        self.assertIsNone(json.loads(TrafficCapture.format((0.0, 0.0, None, None, None, None, 408, 0, 0.1)))["path"])
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.files = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        for path in self.files:
+            os.remove(path)
+
+    def capture_file(self, entries):
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        self.files.append(path)
+        return path
+
+    def test_load_capture(self):
+        first = self.capture_file([
+            { "time": 100.5, "method": "POST", "path": "/b", "headers": { "Host": "prod", "X-A": "1" }, "body_length": 6, "body": "ab",
+              "status": 201, "latency": 0.01 },
+            { "time": 100.0, "path": "/a", "status": 200, "latency": 0.02 },
+        ])
+        second = self.capture_file([{ "time": 100.2, "path": "/c", "status": 404, "latency": 0.03 }])
+        schedule, entries = load_capture([first, second], "127.0.0.1", 8080)
+        self.assertEqual([round(offset, 6) for offset, _ in schedule], [0.0, 0.2, 0.5])
+        self.assertTrue(schedule[1][1].startswith(b"GET /c HTTP/1.1\r\nHost: 127.0.0.1:8080\r\n"))
+        raw = schedule[2][1]
+        self.assertNotIn(b"prod", raw)
+        self.assertIn(b"X-A: 1\r\n", raw)
+        self.assertTrue(raw.endswith(b"Content-Length: 6\r\nConnection: keep-alive\r\n\r\nab    "))
+        recorded = recorded_report(entries)
+        self.assertEqual(recorded["statuses"], { "200": 1, "201": 1, "404": 1 })
+        self.assertAlmostEqual(recorded["duration"], 0.5)
+
+    def test_capture_round_trip(self):
+        # a percent-encoded target is captured as sent, its replay is the same request
+        seen = []
+
+        def app(environ, start_response):
+            seen.append(environ["PATH_INFO"])
+            start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "2")])
+            return [b"ok"]
+
+        capture = self.capture_file([])
+        server = AsyncHTTPServer(makeWSGIhandler(app), ("127.0.0.1", 0), self.loop, capture=TrafficCapture(capture), close_grace=0.05,
+                                 lingering_timeout=0.05)
+        with server:
+            server.start_serve()
+            port = server.listeners[0].getsockname()[1]
+            request = build_request("127.0.0.1", port, path="/search?q=a%20b", keepalive=False)
+            first = self.loop.run_until_complete(Replayer("127.0.0.1", port, [(0.0, request)], connections=1, keepalive=False, loop=self.loop).run())
+            server.capture.flush()
+            schedule, entries = load_capture([capture], "127.0.0.1", port, keepalive=False)
+            second = self.loop.run_until_complete(Replayer("127.0.0.1", port, schedule, connections=1, keepalive=False, loop=self.loop).run())
+        self.assertEqual(entries[0]["path"], "/search?q=a%20b")
+        for report in (first, second):
+            self.assertEqual((report["statuses"], report["errors"]), ({ "200": 1 }, { }))
+        self.assertEqual(seen, ["/search?q=a b"] * 2)
+
+    def test_replay(self):
+        async def handle(reader, writer):
+            while True:
+                try:
+                    await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            writer.close()
+
+        server = self.loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        path = self.capture_file([{ "offset": i * 0.02, "path": "/%d" % i } for i in range(20)])
+        try:
+            schedule, _ = load_capture([path], "127.0.0.1", port)
+            replayer = Replayer("127.0.0.1", port, schedule, connections=2, speed=2.0, loop=self.loop)
+            started = self.loop.time()
+            report = self.loop.run_until_complete(replayer.run())
+            # 0.38s of capture replayed twice as fast
+            self.assertGreaterEqual(self.loop.time() - started, 0.18)
+            self.assertEqual(report["completed"], 20)
+            self.assertEqual(report["errors"], { })
+            self.assertEqual(report["mode"], "open")
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# coding=utf-8
+import hashlib
+import os
+import time
+import unittest
+import zlib
+
+from qsonac.cache import CachedResponse, ResponseCache
+from qsonac.sharedcache import _BUCKET, _SEQ, SharedBackend, SharedMemoryStore
+
+
+def fork(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            target(*args)
+            code = 0
+        finally:
+            os._exit(code)
+    return pid
+
+
+def wait(pids):
+    return [os.waitpid(pid, 0)[1] for pid in pids]
+
+
+class TestSharedMemoryStore(unittest.TestCase):
+    def test_get_set_delete(self):
+        store = SharedMemoryStore(size=1 << 20, page_size=1 << 16)
+        self.assertIsNone(store.get("missing"))
+        self.assertTrue(store.set("a", b"1"))
+        self.assertTrue(store.set(b"b", b"2" * 1000))
+        self.assertEqual(store.get("a"), b"1")
+        self.assertEqual(store.get("b"), b"2" * 1000)
+        # replaced, in another size class
+        self.assertTrue(store.set("a", b"3" * 5000))
+        self.assertEqual(store.get("a"), b"3" * 5000)
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.delete("a"))
+        self.assertFalse(store.delete("a"))
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(len(store), 1)
+        # larger than a page
+        self.assertFalse(store.set("big", b"x" * (1 << 17)))
+
+    def test_ttl(self):
+        store = SharedMemoryStore(size=1 << 20, page_size=1 << 16)
+        store.set("k", b"v", ttl=0.05)
+        self.assertEqual(store.get("k"), b"v")
+        time.sleep(0.06)
+        self.assertIsNone(store.get("k"))
+
+    def test_clock_eviction(self):
+        # one page of 16 chunks of 256 bytes
+        store = SharedMemoryStore(size=4096, page_size=4096, min_chunk=256, buckets=256)
+        for i in range(16):
+            self.assertTrue(store.set("k%d" % i, b"v" * 200))
+        for i in range(16):
+            store.get("k%d" % i)
+        # the hand clears all the reference bits, then evicts the first bucket it finds again
+        self.assertTrue(store.set("new", b"v" * 200))
+        self.assertEqual(store.stats()["evictions"], 1)
+        self.assertEqual(len(store), 16)
+        # k0..k15 were referenced, the one evicted lost its bit first, the new one is readable
+        self.assertEqual(store.get("new"), b"v" * 200)
+        self.assertEqual(sum(store.get("k%d" % i) is not None for i in range(16)), 15)
+        # no page for another size class
+        self.assertFalse(store.set("other", b"v" * 300))
+        self.assertEqual(store.stats()["rejected"], 1)
+
+    def test_shared_between_forked_workers(self):
+        store = SharedMemoryStore(size=1 << 20, page_size=1 << 16)
+
+        def worker(index):
+            for i in range(50):
+                assert store.set("w%d-%d" % (index, i), b"%d" % (index * 1000 + i))
+
+        self.assertEqual(wait([fork(worker, index) for index in range(4)]), [0] * 4)
+        for index in range(4):
+            for i in range(50):
+                self.assertEqual(store.get("w%d-%d" % (index, i)), b"%d" % (index * 1000 + i))
+        self.assertEqual(len(store), 200)
+
+    def test_concurrent_readers_see_whole_values(self):
+        store = SharedMemoryStore(size=1 << 20, page_size=1 << 16)
+        keys = ["k%d" % i for i in range(8)]
+
+        def value(key, version):
+            body = (b"%s:%d:" % (key.encode(), version)) * (50 + version % 200)
+            return hashlib.md5(body).digest() + body
+
+        for key in keys:
+            store.set(key, value(key, 0))
+
+        def writer():
+            deadline = time.monotonic() + 0.5
+            version = 1
+            while time.monotonic() < deadline:
+                for key in keys:
+                    store.set(key, value(key, version))
+                version += 1
+
+        def reader():
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                for key in keys:
+                    data = store.get(key)
+                    assert data is not None
+                    assert hashlib.md5(data[16:]).digest() == data[:16], "torn read"
+
+        pids = [fork(writer), fork(writer), fork(reader), fork(reader)]
+        self.assertEqual(wait(pids), [0] * 4)
+
+    def test_writer_died_holding_the_lock(self):
+        store = SharedMemoryStore(size=1 << 20, page_size=1 << 16)
+        store.lock_timeout = 0.1
+        store.set("a", b"1")
+
+        def dying_writer():
+            # dies between the two seq updates of the bucket of "a"
+            store._lock.acquire()
+            index, _ = store._find_slot(b"a", zlib.crc32(b"a"))
+            at = store._buckets_at + index * _BUCKET.size
+            store._write_seq(at, _SEQ.unpack_from(store.mm, at)[0] + 1)
+
+        self.assertEqual(wait([fork(dying_writer)]), [0])
+        # a miss, not an error
+        self.assertIsNone(store.get("a"))
+        self.assertIsNone(SharedBackend(store).get("a"))
+        self.assertTrue(store.set("b", b"2"))
+        self.assertTrue(store.set("a", b"3"))
+        self.assertEqual((store.get("a"), store.get("b"), len(store)), (b"3", b"2", 2))
+
+
+class TestSharedBackend(unittest.TestCase):
+    def test_response_cache_across_workers(self):
+        cache = ResponseCache(ttl=60, backend=SharedBackend(size=1 << 20))
+
+        def worker():
+            cache.fetch("GET /x?", lambda: ("200 OK", [("Content-Type", "text/plain")], b"from the worker"))
+
+        self.assertEqual(wait([fork(worker)]), [0])
+        entry = cache.fetch("GET /x?", lambda: ("200 OK", [], b"from the parent"))
+        self.assertEqual(entry.body, b"from the worker")
+        self.assertEqual(entry.headers, [("Content-Type", "text/plain")])
+
+    def test_serialization(self):
+        entry = CachedResponse("404 Not Found", [("A", "b")], b"\x00body", 1.5, 2.5)
+        copy = CachedResponse.loads(entry.dumps())
+        self.assertEqual((copy.status, copy.headers, copy.body, copy.expires, copy.stale_until),
+                         ("404 Not Found", [("A", "b")], b"\x00body", 1.5, 2.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
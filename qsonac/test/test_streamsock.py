@@ -0,0 +1,97 @@
+# coding=utf-8
+import asyncio
+import socket
+import unittest
+
+from qsonac import metrics
+from qsonac.streamsock import StreamSock
+
+
+class QuickClose(StreamSock):
+    close_grace = 0.05
+    lingering_timeout = 0.1
+
+
+class Connection(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.client = socket.create_connection(self.listener.getsockname())
+        self.client.settimeout(1)
+        sock, _ = self.listener.accept()
+        sock.setblocking(False)
+        self.stream = QuickClose(self.loop, sock)
+
+    def tearDown(self):
+        self.client.close()
+        self.listener.close()
+        self.loop.close()
+
+
+class TestEagerIO(Connection):
+    def test_no_poll_when_ready(self):
+        self.client.sendall(b"ping")
+        self.stream.setup()
+        # already readable: no reader registered, nothing to wait for
+        self.assertTrue(self.stream.wait_for_data().done())
+        self.assertEqual(self.loop.run_until_complete(self.stream.read(4)), b"ping")
+        self.stream.set_write_buffer_limits(0)
+        self.loop.run_until_complete(self.stream.write(b"pong"))
+        self.assertFalse(self.stream._write_pause)
+        self.assertEqual(self.client.recv(4), b"pong")
+        self.stream.force_close()
+
+
+class TestClose(Connection):
+    def serve(self, request = b"ping", delimited = True, client = None):
+        """ answer pong to the request, close, the reason counted """
+        before = { reason: counter.value for reason, counter in metrics.connection_closes.children.items() }
+        if request:
+            self.client.sendall(request)
+
+        async def handle():
+            async with self.stream:
+                if request:
+                    await self.stream.read(len(request))
+                    await self.stream.write(b"pong")
+                    self.stream.delimited = delimited
+                if client is not None:
+                    self.loop.call_later(0.01, client)
+
+        self.loop.run_until_complete(handle())
+        self.assertTrue(self.stream.closed)
+        after = { reason: counter.value - before[reason] for reason, counter in metrics.connection_closes.children.items() }
+        return [reason for reason, count in after.items() if count]
+
+    def test_client_closes_first(self):
+        def client():
+            self.assertEqual(self.client.recv(4), b"pong")
+            self.client.close()
+
+        self.assertEqual(self.serve(client=client), ["client"])
+
+    def test_lingering_close(self):
+        # the client sends more than was read and waits for our FIN to close
+        def client():
+            self.client.sendall(b"unread")
+            self.assertEqual(self.client.recv(4), b"pong")
+            self.assertEqual(self.client.recv(4), b"")
+            self.client.close()
+
+        self.assertEqual(self.serve(delimited=False, client=client), ["lingering"])
+
+    def test_linger_timeout(self):
+        self.assertEqual(self.serve(), ["linger_timeout"])
+        self.assertEqual(self.client.recv(4), b"pong")
+        self.assertEqual(self.client.recv(4), b"")
+
+    def test_idle_connection_is_reset(self):
+        self.assertEqual(self.serve(request=b""), ["idle"])
+        with self.assertRaises(ConnectionResetError):
+            self.client.recv(4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# coding=utf-8
+import asyncio
+import unittest
+
+from qsonac.timerwheel import TimerWheel
+
+
+class Entry:
+    def __init__(self, name, deadline, fired):
+        self.name = name
+        self.deadline = deadline
+        self._timer_slot = None
+        self.fired = fired
+
+    def on_timeout(self):
+        self.fired.append(self.name)
+
+
+class TestTimerWheel(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.wheel = TimerWheel(self.loop, resolution=0.01, size=8)
+        self.fired = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def sleep(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_fire_in_deadline_order(self):
+        now = self.loop.time()
+        self.wheel.schedule(Entry("late", now + 0.08, self.fired))
+        self.wheel.schedule(Entry("early", now + 0.02, self.fired))
+        self.assertEqual(len(self.wheel), 2)
+        self.sleep(0.05)
+        self.assertEqual(self.fired, ["early"])
+        self.sleep(0.06)
+        self.assertEqual(self.fired, ["early", "late"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_pushed_back_deadline_is_not_fired(self):
+        entry = Entry("conn", self.loop.time() + 0.02, self.fired)
+        self.wheel.schedule(entry)
+        # O(1) update, no reschedule
+        entry.deadline = self.loop.time() + 0.15
+        self.sleep(0.06)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.wheel), 1)
+        self.sleep(0.15)
+        self.assertEqual(self.fired, ["conn"])
+
+    def test_deadline_beyond_one_rotation(self):
+        # 8 slots of 10 ms, a rotation is 80 ms
+        self.wheel.schedule(Entry("far", self.loop.time() + 0.2, self.fired))
+        self.sleep(0.1)
+        self.assertEqual(self.fired, [])
+        self.sleep(0.15)
+        self.assertEqual(self.fired, ["far"])
+
+    def test_cancel(self):
+        entry = Entry("conn", self.loop.time() + 0.02, self.fired)
+        self.wheel.schedule(entry)
+        self.wheel.cancel(entry)
+        self.sleep(0.05)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertIsNone(entry._timer_slot)
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+import math
+import weakref
+
+
+class TimerWheel:
+    """
+        Hashed timer wheel tracking the deadlines of many connections with one loop timer.
+
+        An entry is any object with the attributes
+        * deadline: absolute loop time, or None
+        * _timer_slot: the slot holding it, managed by the wheel, must be initialized to None
+        * on_timeout(): called once the deadline has passed
+
+        An entry is hashed into the slot of its deadline tick. Pushing a deadline later is a plain
+        assignment, O(1) and without any new timer object, the wheel notices it when it reaches the slot
+        and moves the entry further. Only moving a deadline earlier needs schedule() again.
+    """
+
+    # one wheel per event loop, every connection of this loop share it
+    _wheels = weakref.WeakKeyDictionary()
+
+    def __init__(self, loop, resolution = 0.25, size = 512):
+        self._loop = loop
+        self.resolution = resolution
+        self.size = size
+        self._slots = [set() for _ in range(size)]
+        self._tick = int(loop.time() / resolution)  # last processed tick
+        self._handle = None
+        self._count = 0
+
+    @classmethod
+    def for_loop(cls, loop):
+        wheel = cls._wheels.get(loop)
+        if wheel is None:
+            wheel = cls._wheels[loop] = cls(loop)
+        return wheel
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, entry):
+        """ (Re)hash the entry by its current deadline """
+        self.cancel(entry)
+        if entry.deadline is None:
+            return
+        if not self._count:
+            # nothing was tracked, skip the empty ticks elapsed since then
+            self._tick = max(self._tick, int(self._loop.time() / self.resolution))
+        tick = max(math.ceil(entry.deadline / self.resolution), self._tick + 1)
+        slot = self._slots[tick % self.size]
+        slot.add(entry)
+        entry._timer_slot = slot
+        self._count += 1
+        if self._handle is None:
+            self._handle = self._loop.call_at((self._tick + 1) * self.resolution, self._advance)
+
+    def cancel(self, entry):
+        slot = entry._timer_slot
+        if slot is not None:
+            slot.discard(entry)
+            entry._timer_slot = None
+            self._count -= 1
+
+    def _advance(self):
+        self._handle = None
+        now = self._loop.time()
+        target = int(now / self.resolution)
+        # after a long stall of the loop every slot is visited at most once
+        self._tick = max(self._tick, target - self.size)
+        expired = []
+        while self._tick < target:
+            self._tick += 1
+            slot = self._slots[self._tick % self.size]
+            if not slot:
+                continue
+            for entry in list(slot):
+                deadline = entry.deadline
+                if deadline is None or deadline <= now:
+                    self.cancel(entry)
+                    if deadline is not None:
+                        expired.append(entry)
+                elif math.ceil(deadline / self.resolution) % self.size != self._tick % self.size:
+                    # the deadline was pushed back since it was hashed
+                    self.schedule(entry)
+        for entry in expired:
+            entry.on_timeout()
+        if self._count and self._handle is None:
+            self._handle = self._loop.call_at((self._tick + 1) * self.resolution, self._advance)
@@ -1,7 +1,7 @@
 # coding=utf-8
 
 from typing import Callable
-from collections import MutableMapping
+from collections.abc import MutableMapping
 
 
 class TreeMap(MutableMapping):
@@ -1,6 +1,6 @@
 # coding=utf-8
 from sanic import Sanic
-from sanic.response import json
+from sanic.response import file, json, text
 from config import Config
 
 app = Sanic()
@@ -11,5 +11,25 @@ async def test(request):
     return json({ "hello": "world" })
 
 
+@app.route("/hello")
+async def hello(request):
+    return text(Config.message)
+
+
+@app.route("/headers")
+async def headers(request):
+    return text(str(dict(request.headers)))
+
+
+@app.route("/large")
+async def large(request):
+    return text(Config.large_body)
+
+
+@app.route("/static/file")
+async def static_file(request):
+    return await file("./static/testFile.htm")
+
+
 if __name__ == "__main__":
     app.run(host=Config.host, port=Config.port)